@@ -1,7 +1,10 @@
+import base64
+from pathlib import Path
+from urllib.parse import urlparse
 import streamlit as st
 from streamlit.logger import get_logger
-import pandas as pd
-from modules.shared_functions import *
+from modules.shared_functions import switch_page
+from modules.memory_functions import get_memory_usage
 
 LOGGER = get_logger(__name__)
 
@@ -30,6 +33,11 @@ def run():
         if next_button: 
             switch_page("STEP1-UPLOAD")
 
+    # memory held by all open sessions, to help size the server
+    usage = get_memory_usage()
+    st.caption(f"Server memory in use: {usage['total'] / 1024**2:.0f} MB of {usage['budget'] / 1024**2:.0f} MB "
+               f"across {len(usage['sessions'])} sessions")
+
 
 #allows addition of logo to top of sidebar menu
 
@@ -42,7 +50,7 @@ def add_logo(logo_url: str, height: int = 120):
         logo_url (str): URL/local path of the logo
     """
 
-    if validators.url(logo_url) is True:
+    if urlparse(logo_url).scheme in ("http", "https"):
         logo = f"url({logo_url})"
     else:
         logo = f"url(data:image/png;base64,{base64.b64encode(Path(logo_url).read_bytes()).decode()})"
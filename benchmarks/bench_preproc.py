@@ -0,0 +1,301 @@
+# ------Description: This file contains the benchmark suite for the preprocessing functions and the data export------
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_preproc.py                               # 10k, 100k and 1M rows, narrow and wide
+#   python benchmarks/bench_preproc.py --sizes 10k,10m --schemas narrow
+#   python benchmarks/bench_preproc.py --output results.json --baseline benchmarks/baseline.json
+#
+# Every case is timed (best of --repeat runs) and run once more under
+# tracemalloc for its peak allocation. With --baseline the results are compared
+# to a saved run and the script exits with status 1 if any case got slower or
+# bigger than the thresholds allow.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import preproc_functions as preproc
+from modules import encoding_functions as encoding
+from modules import reduction_functions as reduction
+from modules.export_functions import export_dataframe, EXPORT_FORMATS
+
+DEFAULT_SIZES = "10k,100k,1m"
+SCHEMAS = {"narrow": 8, "wide": 64}   # number of columns per schema
+NULL_RATE = 0.05                      # share of missing values in nullable columns
+DUPLICATE_RATE = 0.05                 # share of rows that repeat an earlier row
+TIME_THRESHOLD = 0.20                 # a case regresses when it is this much slower than the baseline...
+MIN_SECONDS = 0.005                   # ...and at least this many seconds slower (shorter timings are noise)
+MEMORY_THRESHOLD = 0.20               # or when its peak allocation grows by this much
+
+#--------------------------------DATASETS--------------------------------
+
+#function to build a deterministic synthetic dataset
+
+def make_dataset(rows, schema="narrow", seed=0):
+    """
+    Build a synthetic dataset with mixed dtypes, missing values and duplicate rows
+
+    Columns cycle through integer, float, nullable float, boolean, low and high
+    cardinality text and datetime columns. The same rows, schema and seed
+    always give the same data.
+
+    Args:
+        rows (int): Number of rows
+        schema (str): One of the keys of SCHEMAS
+        seed (int): Seed of the random generator
+
+    Returns:
+        pandas.DataFrame: The dataset
+    """
+    rng = np.random.default_rng(seed)
+    builders = [
+        lambda: rng.integers(0, 1000, rows),
+        lambda: rng.normal(50, 10, rows),
+        lambda: _with_nulls(rng, rng.normal(0, 1, rows)),
+        lambda: rng.random(rows) < 0.5,
+        lambda: pd.Categorical.from_codes(rng.integers(0, 12, rows), [f"group_{i}" for i in range(12)]),
+        lambda: _with_nulls(rng, np.char.add("id_", rng.integers(0, rows, rows).astype(str)).astype(object)),
+        lambda: pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 10**8, rows), unit="s"),
+        lambda: _with_nulls(rng, rng.exponential(3, rows)),
+    ]
+    data = {f"col{i}_{['int', 'float', 'nullfloat', 'bool', 'cat', 'text', 'date', 'skewed'][i % 8]}": builders[i % 8]()
+            for i in range(SCHEMAS[schema])}
+    # repeat some earlier rows so duplicate handling has work to do
+    order = np.arange(rows)
+    targets = rng.choice(np.arange(1, rows), size=int((rows - 1) * DUPLICATE_RATE), replace=False)
+    order[targets] = (targets * rng.random(len(targets))).astype(int)
+    return pd.DataFrame(data).iloc[order].reset_index(drop=True)
+
+def _with_nulls(rng, values):
+    '''return values with NULL_RATE of them replaced by missing values'''
+    values = pd.Series(values)
+    return values.mask(rng.random(len(values)) < NULL_RATE).to_numpy()
+
+#--------------------------------CASES--------------------------------
+
+#function to list the benchmark cases for a dataset
+
+def get_cases(df, export_dir):
+    """
+    List every benchmarked call on a dataset
+
+    Inputs that a case needs but does not measure (such as a row index or
+    outlier scores) are computed here, before timing starts.
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        export_dir (str): Folder the export cases write to
+
+    Returns:
+        dict: Mapping of case name to a function without arguments
+    """
+    numeric = preproc.get_numerical_features(df)
+    feature = next(col for col in numeric if df[col].isna().any())
+    index = preproc.build_row_index(df)
+    keep = ~preproc.duplicate_mask(index)
+    scores = preproc.compute_outlier_scores(df)
+    profile = preproc.profile_dataframe(df, index)
+    filled = df.copy()
+    filled[feature] = filled[feature].fillna(0)
+    text = [col for col in df.columns if col.endswith(("_cat", "_text"))]
+    onehot = encoding.fit_encoder(df, {'op': 'encode', 'method': 'onehot', 'columns': text,
+                                       'max_categories': encoding.ONEHOT_MAX_CATEGORIES})
+    scale = {'op': 'scale', 'method': 'standard', 'columns': numeric}
+    scaler = encoding.fit_scaler(df, scale)
+
+    cases = {
+        "build_row_index": lambda: preproc.build_row_index(df),
+        "filter_row_index": lambda: preproc.filter_row_index(index, keep),
+        "refresh_row_index": lambda: preproc.refresh_row_index(index, filled, [feature]),
+        "duplicate_mask": lambda: preproc.duplicate_mask(index),
+        "count_duplicate_rows": lambda: preproc.count_duplicate_rows(df),
+        "count_duplicate_rows (indexed)": lambda: preproc.count_duplicate_rows(df, index=index),
+        "remove_duplicate_rows": lambda: preproc.remove_duplicate_rows(df, index=index),
+        "get_total_missing_values": lambda: preproc.get_total_missing_values(df),
+        "get_missing_values_by_feature": lambda: preproc.get_missing_values_by_feature(df),
+        "fill_missing_values": lambda: preproc.fill_missing_values(df.copy(deep=False), "Fill with mean", feature, None),
+        "impute_missing_values": lambda: preproc.impute_missing_values(df, {col: {'method': "Fill with median"} for col in numeric}),
+        "compute_outlier_scores": lambda: preproc.compute_outlier_scores(df),
+        "outlier_mask": lambda: preproc.outlier_mask(scores, 3.0),
+        "count_outliers": lambda: preproc.count_outliers(df, feature, 3.0),
+        "count_outliers (scored)": lambda: preproc.count_outliers(df, feature, 3.0, scores=scores),
+        "remove_outliers": lambda: preproc.remove_outliers(df, feature, 3.0, scores=scores),
+        "get_outliers": lambda: preproc.get_outliers(df, feature, 3.0, scores=scores),
+        "get_outliers_table": lambda: preproc.get_outliers_table(df, feature, 3.0, scores=scores),
+        "get_numerical_features": lambda: preproc.get_numerical_features(df),
+        "get_categorical_features": lambda: preproc.get_categorical_features(df),
+        "profile_columns": lambda: preproc.profile_columns(df),
+        "profile_dataframe": lambda: preproc.profile_dataframe(df, index),
+        "refresh_profile": lambda: preproc.refresh_profile(filled, profile, [feature], index),
+        "fit_encoder (one-hot)": lambda: encoding.fit_encoder(df, {key: value for key, value in onehot.items() if key != 'params'}),
+        "apply_encoder (one-hot)": lambda: encoding.apply_encoder(df, onehot),
+        "encode_sparse": lambda: encoding.encode_sparse(df, onehot),
+        "fit_scaler (standard)": lambda: encoding.fit_scaler(df, scale),
+        "apply_scaler (standard)": lambda: encoding.apply_scaler(df, scaler),
+        "find_correlated_features": lambda: reduction.find_correlated_features(df, numeric),
+        "fit_pca (incremental)": lambda: reduction.fit_pca(df, numeric, 5, method="incremental"),
+        "fit_pca (randomized)": lambda: reduction.fit_pca(df, numeric, 5, method="randomized"),
+    }
+    # the chunked exports that replaced convert_df
+    for export_format, spec in EXPORT_FORMATS.items():
+        path = os.path.join(export_dir, f"export.{spec['extension']}")
+        cases[f"export_dataframe ({export_format})"] = lambda path=path, export_format=export_format: \
+            export_dataframe(df, path, export_format)
+    return cases
+
+#--------------------------------MEASUREMENT--------------------------------
+
+#function to time a call and measure its peak allocation
+
+def measure(case, repeat=3):
+    """
+    Time a call and measure the memory it allocates
+
+    Args:
+        case (callable): The call to measure
+        repeat (int): Number of timed runs, the fastest is kept
+
+    Returns:
+        dict: 'seconds' (fastest run) and 'peak_bytes' (peak traced allocation)
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        case()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(timings), 'peak_bytes': peak}
+
+#function to run every case on every dataset
+
+def run_benchmarks(sizes, schemas, repeat=3, cases=None, log=None):
+    """
+    Run the benchmark cases on datasets of every size and schema
+
+    Args:
+        sizes (list): Row counts
+        schemas (list): Keys of SCHEMAS
+        repeat (int): Timed runs per case (one run for datasets of a million rows or more)
+        cases (list, optional): Only run the cases with these names
+        log (callable, optional): Called with a progress line per case, prints by default
+
+    Returns:
+        dict: 'meta' (environment and parameters) and 'results' (mapping of
+        "schema/rows/case" to the measurement from measure)
+    """
+    log = log or (lambda line: print(line, flush=True))
+    results = {}
+    with tempfile.TemporaryDirectory() as export_dir:
+        for schema in schemas:
+            for rows in sizes:
+                df = make_dataset(rows, schema)
+                for name, case in get_cases(df, export_dir).items():
+                    if cases and name not in cases:
+                        continue
+                    key = f"{schema}/{rows}/{name}"
+                    results[key] = measure(case, repeat if rows < 1_000_000 else 1)
+                    log(f"{key:<70} {results[key]['seconds']:>10.4f}s {results[key]['peak_bytes'] / 1024**2:>10.1f} MB")
+                del df
+    meta = {
+        'timestamp': datetime.now().isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'sizes': sizes,
+        'schemas': schemas,
+        'repeat': repeat,
+    }
+    return {'meta': meta, 'results': results}
+
+#--------------------------------BASELINE COMPARISON--------------------------------
+
+#function to compare a run against a saved baseline
+
+def compare_to_baseline(current, baseline, time_threshold=TIME_THRESHOLD, memory_threshold=MEMORY_THRESHOLD,
+                        min_seconds=MIN_SECONDS):
+    """
+    Compare the cases of two runs
+
+    Args:
+        current (dict): The results of run_benchmarks
+        baseline (dict): Saved results of an earlier run
+        time_threshold (float): Allowed relative slowdown
+        memory_threshold (float): Allowed relative growth of the peak allocation
+        min_seconds (float): Slowdowns smaller than this are ignored as noise
+
+    Returns:
+        list: One dict per case found in both runs with 'case', 'time_ratio',
+        'memory_ratio' and 'regressed'
+    """
+    rows = []
+    for key, new in current['results'].items():
+        old = baseline['results'].get(key)
+        if old is None:
+            continue
+        time_ratio = new['seconds'] / old['seconds'] if old['seconds'] else float("inf")
+        memory_ratio = new['peak_bytes'] / old['peak_bytes'] if old['peak_bytes'] else 1.0
+        slower = time_ratio > 1 + time_threshold and new['seconds'] - old['seconds'] > min_seconds
+        bigger = memory_ratio > 1 + memory_threshold and new['peak_bytes'] - old['peak_bytes'] > 1024**2
+        rows.append({'case': key, 'time_ratio': time_ratio, 'memory_ratio': memory_ratio, 'regressed': slower or bigger})
+    return rows
+
+def _parse_size(text):
+    '''turn "10k" or "1m" into a number of rows'''
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the preprocessing functions and the data export")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated row counts, e.g. 10k,100k,1m,10m")
+    parser.add_argument("--schemas", default=",".join(SCHEMAS), help=f"comma separated schemas out of {', '.join(SCHEMAS)}")
+    parser.add_argument("--cases", default="", help="comma separated case names to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, the fastest is kept")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare against the results in this JSON file")
+    parser.add_argument("--time-threshold", type=float, default=TIME_THRESHOLD, help="allowed relative slowdown")
+    parser.add_argument("--memory-threshold", type=float, default=MEMORY_THRESHOLD, help="allowed relative memory growth")
+    args = parser.parse_args(argv)
+
+    sizes = [_parse_size(size) for size in args.sizes.split(",")]
+    schemas = args.schemas.split(",")
+    cases = [case.strip() for case in args.cases.split(",") if case.strip()]
+    current = run_benchmarks(sizes, schemas, args.repeat, cases)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare_to_baseline(current, baseline, args.time_threshold, args.memory_threshold)
+        for row in comparison:
+            flag = "REGRESSED" if row['regressed'] else ""
+            print(f"{row['case']:<70} time x{row['time_ratio']:.2f} memory x{row['memory_ratio']:.2f} {flag}")
+        regressions = [row for row in comparison if row['regressed']]
+        print(f"{len(regressions)} of {len(comparison)} cases regressed")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+# ------Description: This file contains the startup benchmark for the app's entry points------
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_startup.py                               # every page, 10k rows of data loaded
+#   python benchmarks/bench_startup.py --pages HOME.py --rows 0
+#   python benchmarks/bench_startup.py --output startup.json --baseline benchmarks/startup_baseline.json
+#
+# Every page is started in a fresh interpreter, as in a cold container. The
+# child times the page's imports, its first render and a rerun (with
+# Streamlit's AppTest, so no browser or server is needed) and lists the heavy
+# libraries loaded by then. The fastest of --repeat cold starts is kept. With
+# --baseline the results are compared like bench_preproc's and the script exits
+# with status 1 if a page got slower.
+
+import argparse
+import ast
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROWS = 10_000
+HEAVY_MODULES = ["matplotlib", "seaborn", "scipy", "sklearn", "nbformat", "openpyxl", "pyarrow.parquet"]   # should only load when a feature needs them
+RENDER_TIMEOUT = 120              # seconds a page may take to render
+
+#--------------------------------CHILD PROCESS--------------------------------
+
+#function to measure the cold start of one page, run in a fresh interpreter
+
+def measure_page(page, rows):
+    """
+    Time the imports, first render and rerun of a page in the current (fresh) interpreter
+
+    Args:
+        page (str): Path of the page script, relative to the repository root
+        rows (int): Rows of the synthetic dataset put in the session, 0 for none
+
+    Returns:
+        dict: 'import_seconds', 'first_render_seconds', 'rerun_seconds',
+        'max_rss_bytes', 'heavy_modules' (the HEAVY_MODULES loaded by the end)
+        and 'exception' (the page's exception, if it raised one)
+    """
+    sys.path.insert(0, ROOT)
+    path = os.path.join(ROOT, page)
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    imports = ast.Module([node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))], [])
+    start = time.perf_counter()
+    exec(compile(imports, path, "exec"), {})
+    import_seconds = time.perf_counter() - start
+
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(path, default_timeout=RENDER_TIMEOUT)
+    if rows:
+        sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+        from bench_preproc import make_dataset
+        from modules.store_functions import write_dataset
+        handle = write_dataset(make_dataset(rows), 1)
+        app.session_state['dataset'] = handle
+        app.session_state['history'] = {'base': handle, 'deltas': [], 'position': 0}
+        app.session_state['dataset_version'] = 1
+    start = time.perf_counter()
+    app.run()
+    first_render_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    app.run()
+    rerun_seconds = time.perf_counter() - start
+    return {
+        'import_seconds': import_seconds,
+        'first_render_seconds': first_render_seconds,
+        'rerun_seconds': rerun_seconds,
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules],
+        'exception': str(app.exception[0].value) if app.exception else None,
+    }
+
+#--------------------------------MEASUREMENT--------------------------------
+
+#function to list the app's entry points
+
+def get_pages():
+    '''return the home page and every page of the app, relative to the repository root'''
+    return ["HOME.py"] + sorted(os.path.relpath(path, ROOT) for path in glob.glob(os.path.join(ROOT, "pages", "*.py")))
+
+#function to run the cold start of every page
+
+def run_benchmarks(pages, rows=DEFAULT_ROWS, repeat=3, log=None):
+    """
+    Cold start every page in fresh interpreters
+
+    Args:
+        pages (list): Page scripts, relative to the repository root
+        rows (int): Rows of the synthetic dataset loaded in the session
+        repeat (int): Cold starts per page, the fastest of each measurement is kept
+        log (callable, optional): Called with a progress line per page, prints by default
+
+    Returns:
+        dict: 'meta' (environment and parameters) and 'results' (mapping of
+        "page/measurement" to 'seconds' and 'peak_bytes', the format bench_preproc compares)
+    """
+    log = log or (lambda line: print(line, flush=True))
+    results = {}
+    with tempfile.TemporaryDirectory() as store_dir:
+        # each cold start gets an empty store, as a new container would
+        env = {**os.environ, "TADA_STORE_DIR": store_dir, "PYTHONDONTWRITEBYTECODE": "1"}
+        for page in pages:
+            runs = []
+            for _ in range(repeat):
+                child = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", page, "--rows", str(rows)],
+                                       capture_output=True, text=True, cwd=ROOT, env=env, check=True)
+                runs.append(json.loads(child.stdout.strip().splitlines()[-1]))
+            peak = min(run['max_rss_bytes'] for run in runs)
+            for measurement in ('import_seconds', 'first_render_seconds', 'rerun_seconds'):
+                key = f"{page}/{measurement.rsplit('_', 1)[0].replace('_', ' ')}"
+                results[key] = {'seconds': min(run[measurement] for run in runs), 'peak_bytes': peak}
+            heavy = ", ".join(runs[0]['heavy_modules']) or "none"
+            failed = f" raised: {runs[0]['exception']}" if runs[0]['exception'] else ""
+            log(f"{page:<40} import {results[f'{page}/import']['seconds']:>7.3f}s "
+                f"first render {results[f'{page}/first render']['seconds']:>7.3f}s "
+                f"rerun {results[f'{page}/rerun']['seconds']:>7.3f}s {peak / 1024**2:>7.0f} MB  heavy: {heavy}{failed}")
+    meta = {
+        'timestamp': datetime.now().isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'pages': pages,
+        'rows': rows,
+        'repeat': repeat,
+    }
+    return {'meta': meta, 'results': results}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cold start of the app's pages")
+    parser.add_argument("--pages", default="", help="comma separated page scripts (default: every page)")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="rows of data loaded in the session, 0 for none")
+    parser.add_argument("--repeat", type=int, default=3, help="cold starts per page, the fastest is kept")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare against the results in this JSON file")
+    parser.add_argument("--time-threshold", type=float, default=None, help="allowed relative slowdown")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure_page(args.child, args.rows)))
+        return 0
+
+    sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+    from bench_preproc import compare_to_baseline, TIME_THRESHOLD
+
+    pages = [page.strip() for page in args.pages.split(",") if page.strip()] or get_pages()
+    current = run_benchmarks(pages, args.rows, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # the resident memory of a whole interpreter is too noisy to gate on
+        comparison = compare_to_baseline(current, baseline, args.time_threshold or TIME_THRESHOLD, memory_threshold=float("inf"))
+        for row in comparison:
+            flag = "REGRESSED" if row['regressed'] else ""
+            print(f"{row['case']:<60} time x{row['time_ratio']:.2f} {flag}")
+        regressions = [row for row in comparison if row['regressed']]
+        print(f"{len(regressions)} of {len(comparison)} measurements regressed")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+# ------Description: This file contains the headless batch runner applying a preprocessing plan to a folder of files------
+#
+# Usage (from the repository root):
+#   python -m modules.batch_functions pipeline.json exports/ cleaned/
+#   python -m modules.batch_functions pipeline.json exports/ cleaned/ --workers 8 --pattern "*.csv"
+#
+# pipeline.json holds a plan (see pipeline_functions), as downloaded from the
+# preprocessing page with "Download steps as pipeline". Every CSV and Excel
+# file under the input folder is cleaned on a pool of processes and written to
+# the output folder as Parquet, in the same sub-folders. A report with one row
+# per file is written to batch_report.csv. The exit status is 1 if a file failed.
+
+import argparse
+import fnmatch
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from modules import parallel_functions
+from modules.pipeline_functions import apply_plan, describe_plan, load_plan
+from modules.upload_functions import infer_schema, conform_chunk, read_csv_chunked, read_excel_sheet, combine_sheets, CSV_CHUNK_ROWS
+
+BATCH_EXTENSIONS = (".csv", ".xlsx", ".xlsm")   # files picked up in the input folder
+BATCH_REPORT = "batch_report.csv"
+STREAMED_FILL_METHODS = ("Fill with custom value",)   # fills that need no statistic of the data, so they run per chunk
+
+#--------------------------------FILES--------------------------------
+
+#function to list the files of a folder a batch runs on
+
+def find_batch_files(input_dir, pattern="*"):
+    '''return the CSV and Excel files under input_dir whose name matches pattern, relative to input_dir and sorted'''
+    files = []
+    for folder, _, names in os.walk(input_dir):
+        for name in names:
+            if name.lower().endswith(BATCH_EXTENSIONS) and fnmatch.fnmatch(name, pattern):
+                files.append(os.path.relpath(os.path.join(folder, name), input_dir))
+    return sorted(files)
+
+#function to decide whether a plan can run one chunk of rows at a time
+
+def is_streamable(plan):
+    """
+    Return True if every step of a plan gives the same result chunk by chunk
+
+    Duplicates are tracked across chunks by row hash, custom-value fills,
+    fitted encoders, scalers and PCA, and dropped columns only look at the
+    row they change. Mean, median and mode fills, outlier removal and steps
+    fitted on the data need statistics of the whole file.
+    """
+    for step in plan:
+        if step['op'] == 'fill' and step['method'] not in STREAMED_FILL_METHODS:
+            return False
+        if step['op'] == 'remove_outliers':
+            return False
+        if step['op'] in ('encode', 'scale', 'reduce') and 'params' not in step:
+            return False
+    return True
+
+#--------------------------------PROCESSING A FILE--------------------------------
+
+#function to clean one file and write it as parquet, run in a worker process
+
+def process_file(input_path, output_path, plan, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Apply a plan to one CSV or Excel file and write the result as Parquet
+
+    CSV files are streamed chunk by chunk when the plan allows it (see
+    is_streamable), so their size is not limited by memory. Otherwise, or when
+    a later chunk no longer fits the column types of the first ones, the file
+    is parsed in chunks into one DataFrame and the plan runs on all of it.
+
+    Args:
+        input_path (str): The CSV or Excel file
+        output_path (str): The Parquet file to write
+        plan (list): The plan steps
+        chunk_rows (int): Rows parsed, cleaned and written at a time
+
+    Returns:
+        dict: One report row: 'file', 'status' ("done" or "failed"), 'error',
+        'mode' ("streamed" or "in memory"), 'rows in', 'rows out', 'columns in',
+        'columns out', 'missing in', 'missing out', 'bytes in', 'bytes out' and 'seconds'
+    """
+    started = time.perf_counter()
+    stats = {'file': input_path, 'status': "done", 'error': None, 'mode': None, 'rows in': 0, 'rows out': 0,
+             'columns in': 0, 'columns out': 0, 'missing in': 0, 'missing out': 0,
+             'bytes in': os.path.getsize(input_path), 'bytes out': 0, 'seconds': 0.0}
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    try:
+        streamed = None
+        if input_path.lower().endswith(".csv") and is_streamable(plan):
+            streamed = _stream_csv(input_path, output_path, plan, chunk_rows)
+        if streamed is not None:
+            stats.update(streamed, mode="streamed")
+        else:
+            stats.update(_process_in_memory(input_path, output_path, plan, chunk_rows), mode="in memory")
+        stats['bytes out'] = os.path.getsize(output_path)
+    except Exception as e:
+        stats.update(status="failed", error=f"{type(e).__name__}: {e}")
+        _remove_partial(output_path)
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+def _process_in_memory(input_path, output_path, plan, chunk_rows):
+    '''load a whole file, run the plan with apply_plan and write the result'''
+    from modules.export_functions import export_dataframe
+
+    if input_path.lower().endswith(".csv"):
+        df = read_csv_chunked(input_path, chunksize=chunk_rows)
+    else:
+        from openpyxl import load_workbook
+        workbook = load_workbook(input_path, read_only=True)
+        sheet_names = workbook.sheetnames
+        workbook.close()
+        df = combine_sheets({name: read_excel_sheet(input_path, name) for name in sheet_names})
+    stats = {'rows in': len(df), 'columns in': df.shape[1], 'missing in': int(df.isna().sum().sum())}
+    df = apply_plan(df, plan)[0]
+    export_dataframe(df.reset_index(drop=True), output_path, "Parquet", chunk_rows)
+    return {**stats, 'rows out': len(df), 'columns out': df.shape[1], 'missing out': int(df.isna().sum().sum())}
+
+def _stream_csv(input_path, output_path, plan, chunk_rows):
+    '''run a streamable plan on a CSV one chunk at a time, writing every cleaned chunk straight to Parquet,
+    return None if the file has no rows or a later chunk no longer fits the column types of the first one'''
+    import pyarrow.parquet as pq
+
+    # the steps between two duplicate removals run together, duplicates are tracked across chunks by row hash
+    segments, steps = [], []
+    for step in plan:
+        if step['op'] == 'drop_duplicates':
+            segments.extend([steps, step] if steps else [step])
+            steps = []
+        else:
+            steps.append(step)
+    segments += [steps] if steps else []
+    seen = [np.empty(0, dtype='uint64') for _ in segments]
+
+    stats = {'rows in': 0, 'rows out': 0, 'columns in': 0, 'columns out': 0, 'missing in': 0, 'missing out': 0}
+    partial_path = output_path + ".partial"
+    column_types, schema, writer = None, None, None
+    try:
+        with pd.read_csv(input_path, chunksize=chunk_rows, low_memory=False) as reader:
+            for chunk in reader:
+                column_types = column_types or infer_schema(chunk)
+                chunk = conform_chunk(chunk, column_types)
+                stats['rows in'] += len(chunk)
+                stats['columns in'] = chunk.shape[1]
+                stats['missing in'] += int(chunk.isna().sum().sum())
+                for number, segment in enumerate(segments):
+                    if isinstance(segment, dict):
+                        chunk, seen[number] = _drop_seen_rows(chunk, segment.get('subset') or None, seen[number])
+                    else:
+                        chunk = apply_plan(chunk, segment)[0]
+                table = pa.Table.from_pandas(chunk.reset_index(drop=True), preserve_index=False)
+                if schema is None:
+                    schema = _stream_schema(table.schema)
+                    writer = pq.ParquetWriter(partial_path, schema, compression="zstd")
+                writer.write_table(table.cast(schema))
+                stats['rows out'] += len(chunk)
+                stats['columns out'] = chunk.shape[1]
+                stats['missing out'] += int(chunk.isna().sum().sum())
+    except pa.ArrowException:
+        # a later chunk changed a column's type, the whole file is needed to settle it
+        if writer is not None:
+            writer.close()
+        _remove_partial(output_path)
+        return None
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        _remove_partial(output_path)
+        raise
+    if writer is None:
+        return None
+    writer.close()
+    os.replace(partial_path, output_path)
+    return stats
+
+def _drop_seen_rows(chunk, subset, seen):
+    '''drop the rows of chunk that repeat an earlier row of the chunk or a row hash in seen, return the chunk and the new seen hashes'''
+    hashes = pd.util.hash_pandas_object(chunk[subset] if subset else chunk, index=False).to_numpy()
+    keep = ~pd.Series(hashes).duplicated().to_numpy() & ~np.isin(hashes, seen, assume_unique=False)
+    return chunk[keep], np.union1d(seen, hashes[keep])
+
+def _stream_schema(schema):
+    '''return schema with categorical columns widened to int32 codes, so chunks with more categories still fit'''
+    fields = [pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type))
+              if pa.types.is_dictionary(field.type) else field for field in schema]
+    return pa.schema(fields, metadata=schema.metadata)
+
+def _remove_partial(output_path):
+    '''delete a half-written output'''
+    try:
+        os.remove(output_path + ".partial")
+    except FileNotFoundError:
+        pass
+
+#--------------------------------RUNNING A BATCH--------------------------------
+
+#function to clean every file of a folder on a pool of processes
+
+def run_batch(input_dir, output_dir, plan, workers=None, pattern="*", chunk_rows=CSV_CHUNK_ROWS, log=None):
+    """
+    Apply a plan to every CSV and Excel file of a folder, one file per worker process at a time
+
+    Args:
+        input_dir (str): Folder searched (with its sub-folders) for files
+        output_dir (str): Folder the Parquet files and the report are written to
+        plan (list): The plan steps
+        workers (int, optional): Worker processes, one per CPU by default
+        pattern (str): Only process file names matching this glob pattern
+        chunk_rows (int): Rows parsed, cleaned and written at a time
+        log (callable, optional): Called with a line per finished file, prints by default
+
+    Returns:
+        pandas.DataFrame: The report, one row per file in file order, also written to BATCH_REPORT in output_dir
+    """
+    log = log or (lambda line: print(line, flush=True))
+    files = find_batch_files(input_dir, pattern)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(files) or 1))
+    jobs = [(os.path.join(input_dir, name), os.path.join(output_dir, os.path.splitext(name)[0] + ".parquet"))
+            for name in files]
+    rows = []
+    if workers > 1:
+        # spawned workers start clean, and each runs its column kernels on one thread as the files already fill the CPUs
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker) as pool:
+            futures = [pool.submit(process_file, input_path, output_path, plan, chunk_rows) for input_path, output_path in jobs]
+            for future in as_completed(futures):
+                rows.append(future.result())
+                log(_report_line(rows[-1], input_dir, len(rows), len(jobs)))
+    else:
+        for input_path, output_path in jobs:
+            rows.append(process_file(input_path, output_path, plan, chunk_rows))
+            log(_report_line(rows[-1], input_dir, len(rows), len(jobs)))
+
+    report = pd.DataFrame(rows, columns=['file', 'status', 'error', 'mode', 'rows in', 'rows out', 'columns in',
+                                         'columns out', 'missing in', 'missing out', 'bytes in', 'bytes out', 'seconds'])
+    report['file'] = [os.path.relpath(path, input_dir) for path in report['file']]
+    report = report.sort_values('file', ignore_index=True)
+    os.makedirs(output_dir, exist_ok=True)
+    report.to_csv(os.path.join(output_dir, BATCH_REPORT), index=False)
+    return report
+
+def _init_worker():
+    '''keep a worker's column kernels on its own thread'''
+    parallel_functions.PARALLEL_WORKERS = 1
+
+def _report_line(stats, input_dir, done, total):
+    '''return the progress line printed for a finished file'''
+    name = os.path.relpath(stats['file'], input_dir)
+    if stats['status'] != "done":
+        return f"[{done}/{total}] {name}: failed, {stats['error']}"
+    return (f"[{done}/{total}] {name}: {stats['rows in']:,} -> {stats['rows out']:,} rows, "
+            f"{stats['missing in']:,} -> {stats['missing out']:,} missing values, {stats['mode']}, {stats['seconds']:.2f}s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a preprocessing plan to every CSV and Excel file of a folder")
+    parser.add_argument("pipeline", help="JSON file holding the plan, as downloaded from the preprocessing page")
+    parser.add_argument("input_dir", help="folder searched, with its sub-folders, for .csv and .xlsx files")
+    parser.add_argument("output_dir", help="folder the Parquet files and the report are written to")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--pattern", default="*", help="only process file names matching this pattern, e.g. '*.csv'")
+    parser.add_argument("--chunk-rows", type=int, default=CSV_CHUNK_ROWS, help="rows parsed, cleaned and written at a time")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.pipeline) as f:
+            plan = load_plan(f.read())
+    except (OSError, ValueError) as e:
+        parser.error(f"cannot read the pipeline {args.pipeline}: {e}")
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"{args.input_dir} is not a folder")
+
+    print(f"Plan: {describe_plan(plan) or 'no steps'}", flush=True)
+    report = run_batch(args.input_dir, args.output_dir, plan, args.workers, args.pattern, args.chunk_rows)
+    failed = int((report['status'] != "done").sum())
+    print(f"{len(report) - failed} of {len(report)} files done, {report['rows in'].sum():,} -> {report['rows out'].sum():,} rows "
+          f"in {report['seconds'].sum():.1f}s of work. Report written to {os.path.join(args.output_dir, BATCH_REPORT)}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+# ------Description: This file contains functions for fitting and applying categorical encoders and numeric scalers------
+
+import numpy as np
+import pandas as pd
+
+from modules.parallel_functions import map_column_blocks, nan_mean_std, nan_percentiles, nan_min_max
+from modules.timing_functions import timed
+
+ENCODING_METHODS = {"One-hot": "onehot", "Ordinal": "ordinal", "Frequency": "frequency", "Target": "target"}
+SCALING_METHODS = {"Standard": "standard", "Min-max": "minmax", "Robust": "robust"}
+ONEHOT_MAX_CATEGORIES = 50        # most frequent categories given their own one-hot column, the rest share an "other" column
+TARGET_SMOOTHING = 10.0           # rows of prior blended into each category's target mean, so rare categories stay near the prior
+OTHER = "other"
+
+# An encoder or scaler is a plan step (see pipeline_functions). The options
+# chosen by the user are filled in with the parameters fitted on the data the
+# step first ran on, so the same transform can be replayed on new data:
+#   {'op': 'encode', 'method': 'onehot' / 'ordinal' / 'frequency' / 'target', 'columns': [...],
+#    'max_categories': int, 'target': str,
+#    'params': {column: {'categories': [...], 'values': [...], 'default': float, 'other': bool, 'names': [...] (one-hot columns)}}}
+#   {'op': 'scale', 'method': 'standard' / 'minmax' / 'robust', 'columns': [...],
+#    'params': {'center': [...], 'scale': [...]}}
+
+#--------------------------------ENCODERS--------------------------------
+
+#function to learn the categories of the columns an encoder step encodes
+
+@timed()
+def fit_encoder(df, step, progress_callback=None):
+    """
+    Fit an encode step on a DataFrame
+
+    One-hot and ordinal encoders learn the categories of each column (one-hot
+    keeps the max_categories most frequent ones and names their columns so no
+    name is used twice or taken by another column), the frequency encoder the
+    share of rows of each category and the target encoder the smoothed mean of
+    the target column per category.
+
+    Args:
+        df (pandas.DataFrame): The data the step is fitted on
+        step (dict): An encode step without 'params'
+        progress_callback (callable, optional): Called with the fraction of
+            columns fitted (0 to 1) after each column
+
+    Returns:
+        dict: The step with its fitted 'params'
+    """
+    params = {}
+    taken = {col for col in df.columns if col not in step['columns']}  # the encoded columns themselves are replaced
+    if step['method'] == 'target':
+        target = pd.to_numeric(df[step['target']], errors='coerce').astype('float64')
+        prior = float(target.mean())
+    for col in step['columns']:
+        counts = df[col].value_counts(sort=True, dropna=True)
+        counts = counts[counts > 0]  # unused categories of a categorical column
+        if step['method'] == 'onehot':
+            limit = step.get('max_categories') or len(counts)
+            params[col] = {'categories': counts.index[:limit].tolist(), 'other': len(counts) > limit}
+            params[col]['names'] = _unique_names(_onehot_names(col, params[col]), taken)
+        elif step['method'] == 'ordinal':
+            params[col] = {'categories': counts.index.tolist()}
+        elif step['method'] == 'frequency':
+            params[col] = {'categories': counts.index.tolist(), 'values': (counts / len(df)).tolist(), 'default': 0.0}
+        else:
+            # one grouped pass gives every category's target sum and count
+            stats = target.groupby(df[col], sort=False, observed=True).agg(['sum', 'count'])
+            stats = stats[stats['count'] > 0]
+            values = (stats['sum'] + TARGET_SMOOTHING * prior) / (stats['count'] + TARGET_SMOOTHING)
+            params[col] = {'categories': stats.index.tolist(), 'values': values.tolist(), 'default': prior}
+        if progress_callback is not None:
+            progress_callback(len(params) / len(step['columns']))
+    return {**step, 'params': params}
+
+#function to encode columns with a fitted encoder step
+
+@timed()
+def apply_encoder(df, step, progress_callback=None):
+    """
+    Encode the columns of a fitted encode step
+
+    One-hot columns are replaced by one uint8 column per category, named
+    "<column>_<category>", plus "<column>_other" for the categories that were
+    not kept (with a "_2", "_3", ... suffix where fit_encoder found the name
+    taken). Ordinal codes are int32 (-1 for missing or unseen values) and
+    frequency and target encodings float32 (unseen values get the default).
+
+    Args:
+        df (pandas.DataFrame): The data to encode
+        step (dict): A fitted encode step
+        progress_callback (callable, optional): Called with the fraction of
+            columns encoded (0 to 1) after each column
+
+    Returns:
+        tuple: The encoded DataFrame and the list of its new or changed columns
+    """
+    new_df = df.copy(deep=False)
+    changed = []
+    for number, (col, params) in enumerate(step['params'].items()):
+        if progress_callback is not None and number:
+            progress_callback(number / len(step['params']))
+        if col not in new_df.columns:
+            continue
+        codes = _category_codes(df[col], params['categories'])
+        if step['method'] == 'onehot':
+            dummies = _onehot_block(df[col], codes, params)
+            position = new_df.columns.get_loc(col)
+            new_df = pd.concat([new_df.iloc[:, :position], dummies, new_df.iloc[:, position + 1:]], axis=1, copy=False)
+            changed.extend(dummies.columns)
+        elif step['method'] == 'ordinal':
+            new_df[col] = codes.astype('int32')
+            changed.append(col)
+        else:
+            values = np.append(np.asarray(params['values'], dtype='float32'), np.float32(params['default']))
+            new_df[col] = values[codes]  # code -1 picks the appended default
+            changed.append(col)
+    if progress_callback is not None:
+        progress_callback(1.0)
+    return new_df, changed
+
+#function to one-hot encode columns into a sparse matrix
+
+@timed()
+def encode_sparse(df, step):
+    """
+    One-hot encode the columns of a fitted one-hot step into a sparse matrix
+
+    Unlike apply_encoder, every category of a high-cardinality column can be
+    kept: the matrix stores one entry per row and column instead of a byte for
+    every category of every row.
+
+    Args:
+        df (pandas.DataFrame): The data to encode
+        step (dict): A fitted one-hot encode step
+
+    Returns:
+        tuple: A scipy.sparse CSR matrix of uint8 (rows x one-hot columns) and
+        the names of its columns
+    """
+    import scipy.sparse as sp  # only loaded when a sparse matrix is asked for, it adds a quarter second to startup
+
+    matrices, names = [], []
+    for col, params in step['params'].items():
+        codes = _category_codes(df[col], params['categories'])
+        width = len(params['categories'])
+        if params.get('other'):
+            codes = np.where((codes < 0) & df[col].notna().to_numpy(), width, codes)
+            width += 1
+        rows = np.flatnonzero(codes >= 0)
+        matrices.append(sp.csr_matrix((np.ones(len(rows), dtype='uint8'), (rows, codes[rows])), shape=(len(df), width)))
+        names.extend(_onehot_names(col, params))
+    if not matrices:
+        return sp.csr_matrix((len(df), 0), dtype='uint8'), names
+    return sp.hstack(matrices, format='csr'), names
+
+#function to estimate the memory a one-hot encoding would take
+
+def onehot_nbytes(df, columns, max_categories=None):
+    """
+    Estimate the memory of one-hot encoding columns as dense uint8 columns and as a sparse matrix
+
+    Args:
+        df (pandas.DataFrame): The data
+        columns (list): The columns to encode
+        max_categories (int, optional): Categories kept per column by the dense encoding
+
+    Returns:
+        pandas.DataFrame: One row per column with its 'categories', the 'dense MB'
+        of the one-hot columns and the 'sparse MB' of the full CSR matrix
+    """
+    rows = []
+    for col in columns:
+        categories = int(df[col].nunique())
+        kept = min(categories, max_categories) + (categories > max_categories) if max_categories else categories
+        present = int(df[col].notna().sum())
+        # CSR keeps one uint8 value and one int32 column index per entry, and one int32 offset per row
+        rows.append({'column': col, 'categories': categories, 'dense MB': len(df) * kept / 1024**2,
+                     'sparse MB': (present * 5 + (len(df) + 1) * 4) / 1024**2})
+    return pd.DataFrame(rows, columns=['column', 'categories', 'dense MB', 'sparse MB'])
+
+def _category_codes(series, categories):
+    '''return the position of each value in categories, -1 for missing and unseen values'''
+    return pd.Categorical(series, categories=pd.Index(categories, dtype=object)).codes.astype('int64')
+
+def _onehot_names(col, params):
+    '''return the names of the one-hot columns of a column, as fitted, or "<column>_<category>" for steps fitted without names'''
+    if 'names' in params:
+        return params['names']
+    return [f"{col}_{category}" for category in params['categories']] + ([f"{col}_{OTHER}"] if params.get('other') else [])
+
+def _unique_names(names, taken):
+    '''return names with a "_2", "_3", ... suffix on those already in taken, and add them all to taken'''
+    unique = []
+    for name in names:
+        candidate, number = name, 1
+        while candidate in taken:
+            number += 1
+            candidate = f"{name}_{number}"
+        taken.add(candidate)
+        unique.append(candidate)
+    return unique
+
+def _onehot_block(series, codes, params):
+    '''return the dense uint8 one-hot columns of a column as one block'''
+    names = _onehot_names(series.name, params)
+    block = np.zeros((len(names), len(series)), dtype='uint8')  # one row per one-hot column, so each column is contiguous
+    rows = np.flatnonzero(codes >= 0)
+    block[codes[rows], rows] = 1
+    if params.get('other'):
+        block[-1] = (codes < 0) & series.notna().to_numpy()
+    return pd.DataFrame(block.T, index=series.index, columns=names, copy=False)
+
+#--------------------------------SCALERS--------------------------------
+
+#function to compute the center and scale of the columns a scaler step scales
+
+@timed()
+def fit_scaler(df, step, progress_callback=None):
+    """
+    Fit a scale step on a DataFrame
+
+    The statistics of every column are computed in one pass over float blocks
+    of columns (in parallel for wide frames): mean and standard deviation for
+    the standard scaler, minimum and range for min-max and median and
+    interquartile range for the robust scaler. Columns with no spread get a
+    scale of 1, so they are only centered.
+
+    Args:
+        df (pandas.DataFrame): The data the step is fitted on
+        step (dict): A scale step without 'params'
+        progress_callback (callable, optional): Called with the fraction of
+            blocks of columns done (0 to 1)
+
+    Returns:
+        dict: The step with its fitted 'params' ('center' and 'scale', one value per column)
+    """
+    columns = step['columns']
+
+    def block_stats(start, stop):
+        block = df[columns[start:stop]].to_numpy(dtype='float64', na_value=np.nan)
+        # all-missing columns get a NaN center, the nan_ statistics do not warn (see parallel_functions)
+        if step['method'] == 'standard':
+            return nan_mean_std(block)
+        if step['method'] == 'minmax':
+            low, high = nan_min_max(block)
+            return low, high - low
+        q1, median, q3 = nan_percentiles(block, [25, 50, 75])
+        return median, q3 - q1
+
+    stats = map_column_blocks(block_stats, len(df), len(columns), progress_callback=progress_callback)
+    center = np.concatenate([block_center for block_center, _ in stats]) if columns else np.zeros(0)
+    scale = np.concatenate([block_scale for _, block_scale in stats]) if columns else np.zeros(0)
+    scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+    return {**step, 'params': {'center': np.nan_to_num(center).tolist(), 'scale': scale.tolist()}}
+
+#function to scale columns with a fitted scaler step
+
+@timed()
+def apply_scaler(df, step, inplace=False, progress_callback=None):
+    """
+    Scale the columns of a fitted scale step to float32
+
+    Each column is converted to float32 once and then centered and divided in
+    place, without temporary arrays. With inplace=True, float32 columns of a
+    writable df are scaled in df's own memory.
+
+    Args:
+        df (pandas.DataFrame): The data to scale
+        step (dict): A fitted scale step
+        inplace (bool): Scale df itself instead of a shallow copy
+        progress_callback (callable, optional): Called with the fraction of
+            blocks of columns done (0 to 1)
+
+    Returns:
+        tuple: The scaled DataFrame and the list of scaled columns
+    """
+    new_df = df if inplace else df.copy(deep=False)
+    columns = [col for col in step['columns'] if col in df.columns]
+    center = dict(zip(step['columns'], np.asarray(step['params']['center'], dtype='float32')))
+    scale = dict(zip(step['columns'], np.asarray(step['params']['scale'], dtype='float32')))
+
+    def scale_block(start, stop):
+        scaled = []
+        for col in columns[start:stop]:
+            values = df[col].to_numpy(dtype='float32', na_value=np.nan, copy=not inplace)
+            if not values.flags.writeable:
+                values = values.copy()  # columns memory-mapped from the session store are read-only
+            values -= center[col]
+            values /= scale[col]
+            scaled.append(values)
+        return scaled
+
+    blocks = map_column_blocks(scale_block, len(df), len(columns), progress_callback=progress_callback)
+    for col, values in zip(columns, [values for block in blocks for values in block]):
+        new_df[col] = values
+    return new_df, columns
+
+#--------------------------------NOTEBOOK EXPORT--------------------------------
+
+#function to write a fitted encoder or scaler step as pandas code
+
+def transform_code(step):
+    '''return the lines that replay a fitted encode or scale step with pandas'''
+    if step['op'] == 'scale':
+        columns, params = step['columns'], step['params']
+        return [f"df[{columns!r}] = (df[{columns!r}].astype('float32') - np.array({params['center']!r}, dtype='float32')) "
+                f"/ np.array({params['scale']!r}, dtype='float32')"]
+    lines = []
+    for col, params in step['params'].items():
+        categorical = f"pd.Categorical(df[{col!r}], categories={params['categories']!r})"
+        if step['method'] == 'onehot':
+            lines += [f"dummies = pd.get_dummies({categorical}, dtype='uint8').set_index(df.index)"]
+            if params.get('other'):
+                lines += [f"dummies[{OTHER!r}] = ({categorical}.isna() & df[{col!r}].notna()).astype('uint8')"]
+            lines += [f"dummies.columns = {_onehot_names(col, params)!r}",
+                      f"position = df.columns.get_loc({col!r})",
+                      "df = pd.concat([df.iloc[:, :position], dummies, df.iloc[:, position + 1:]], axis=1)"]
+        elif step['method'] == 'ordinal':
+            lines += [f"df[{col!r}] = {categorical}.codes.astype('int32')"]
+        else:
+            mapping = dict(zip(params['categories'], params['values']))
+            lines += [f"df[{col!r}] = df[{col!r}].map({mapping!r}).astype('float32').fillna({params['default']!r})"]
+    return lines
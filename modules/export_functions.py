@@ -0,0 +1,65 @@
+# ------Description: This file contains functions for exporting the dataset to downloadable files------
+
+import gzip
+import os
+
+import pyarrow as pa
+
+EXPORT_CHUNK_ROWS = 100_000       # rows converted and written at a time
+
+EXPORT_FORMATS = {
+    "CSV": {'extension': 'csv', 'mime': 'text/csv'},
+    "CSV (gzip)": {'extension': 'csv.gz', 'mime': 'application/gzip'},
+    "Parquet": {'extension': 'parquet', 'mime': 'application/vnd.apache.parquet'},
+    "Feather": {'extension': 'feather', 'mime': 'application/octet-stream'},
+}
+
+#function to write a dataframe to a file in chunks
+
+def export_dataframe(df, path, export_format="CSV", chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Write a DataFrame to a file chunk by chunk
+
+    Only one chunk is converted at a time, so the export never holds a second
+    full-size copy of the data in memory. The file is written under a temporary
+    name and renamed at the end, so a half-written export is never served.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame to export
+        path (str): The file to write
+        export_format (str): One of the keys of EXPORT_FORMATS
+        chunk_rows (int): Number of rows written at a time
+
+    Returns:
+        str: The path of the written file
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format}. Must be one of {list(EXPORT_FORMATS)}")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial_path = path + ".partial"
+    try:
+        if export_format in ("CSV", "CSV (gzip)"):
+            opener = gzip.open if export_format == "CSV (gzip)" else open
+            with opener(partial_path, "wt", encoding="utf-8", newline="") as f:
+                for start in range(0, max(len(df), 1), chunk_rows):
+                    df.iloc[start:start + chunk_rows].to_csv(f, header=start == 0)
+        else:
+            # the schema comes from the whole frame, a chunk alone can infer another type (e.g. an all-null text chunk)
+            schema = pa.Schema.from_pandas(df, preserve_index=True)
+            with _open_arrow_writer(partial_path, schema, export_format) as writer:
+                for start in range(0, max(len(df), 1), chunk_rows):
+                    writer.write_table(pa.Table.from_pandas(df.iloc[start:start + chunk_rows], schema=schema,
+                                                            preserve_index=True))
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    os.replace(partial_path, path)
+    return path
+
+def _open_arrow_writer(path, schema, export_format):
+    '''open a chunked Parquet or Feather (Arrow IPC) writer'''
+    if export_format == "Parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(path, schema, compression="zstd")
+    return pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
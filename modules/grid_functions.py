@@ -0,0 +1,186 @@
+# ------Description: This file contains functions for showing a dataset one page at a time with server side sorting and filtering------
+
+import re
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from modules.store_functions import get_cached_result
+from modules.timing_functions import timed
+
+GRID_PAGE_SIZES = [25, 50, 100, 250, 500]
+ALL_COLUMNS = "All columns"
+NO_SORT = "No sorting"
+COMPARISON = re.compile(r"^\s*(<=|>=|==|!=|<|>|=)\s*(.+?)\s*$")
+
+#--------------------------------SORTING--------------------------------
+
+#function to compute the row order that sorts a dataframe by one column
+
+@timed()
+def sort_permutation(df, column, ascending=True):
+    """
+    Return the row positions that sort a DataFrame by one column
+
+    The sort is stable and missing values always come last. Columns holding
+    values that cannot be compared (for example mixed text and numbers) are
+    sorted by their text representation.
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        column (str): The column to sort by
+        ascending (bool): Sort direction
+
+    Returns:
+        numpy.ndarray: Row positions in sorted order
+    """
+    values = df[column].reset_index(drop=True)
+    try:
+        ordered = values.sort_values(ascending=ascending, kind="stable", na_position="last")
+    except TypeError:
+        ordered = values.astype(str).where(values.notna()).sort_values(ascending=ascending, kind="stable",
+                                                                       na_position="last")
+    return ordered.index.to_numpy()
+
+#--------------------------------FILTERING--------------------------------
+
+#function to find the rows matching a search, in one column or in all of them
+
+@timed()
+def search_mask(df, query, column=None):
+    """
+    Return a mask of the rows matching a search
+
+    The search is a case-insensitive substring match on the displayed values.
+    When a single numeric or datetime column is searched, the query can also
+    be a comparison such as "> 10", "<= 2020-01-01" or "!= 0".
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        query (str): The text to search for
+        column (str, optional): The column to search, all columns if None
+
+    Returns:
+        numpy.ndarray: Boolean mask, True for matching rows
+    """
+    if column is not None:
+        comparison = COMPARISON.match(query)
+        if comparison and _is_comparable(df[column]):
+            return _compare(df[column], *comparison.groups())
+    columns = df.columns if column is None else [column]
+    mask = np.zeros(len(df), dtype=bool)
+    for col in columns:
+        mask |= _contains(df[col], query)
+    return mask
+
+def _contains(series, query):
+    '''return a mask of the values whose text contains query, ignoring case'''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # search the categories once instead of every row
+        matches = series.cat.categories.astype(str).str.contains(query, case=False, regex=False)
+        codes = series.cat.codes.to_numpy()
+        return np.append(matches, False)[codes]  # code -1 (missing) maps to the appended False
+    return series.astype(str).str.contains(query, case=False, regex=False).to_numpy(dtype=bool) & series.notna().to_numpy()
+
+def _is_comparable(series):
+    '''return True for columns a comparison query can be used on'''
+    return (pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)) \
+        or pd.api.types.is_datetime64_any_dtype(series)
+
+def _compare(series, operator, value):
+    '''return a mask of the rows where series compares true against value'''
+    try:
+        value = pd.Timestamp(value) if pd.api.types.is_datetime64_any_dtype(series) else float(value)
+    except ValueError:
+        return np.zeros(len(series), dtype=bool)
+    result = {
+        "<": series < value, "<=": series <= value, ">": series > value, ">=": series >= value,
+        "=": series == value, "==": series == value, "!=": series != value,
+    }[operator]
+    return result.to_numpy(dtype=bool)
+
+#--------------------------------PAGES--------------------------------
+
+#function to work out which rows are shown after sorting and filtering
+
+def grid_positions(n_rows, order=None, mask=None):
+    """
+    Combine a sort order and a filter mask into the row positions to show
+
+    Args:
+        n_rows (int): Number of rows in the dataset
+        order (numpy.ndarray, optional): Row positions in sorted order
+        mask (numpy.ndarray, optional): Boolean mask of the rows to keep
+
+    Returns:
+        numpy.ndarray: Row positions to show, in display order
+    """
+    if order is None:
+        return np.flatnonzero(mask) if mask is not None else np.arange(n_rows)
+    return order[mask[order]] if mask is not None else order
+
+#function to show a dataframe one page at a time
+
+def show_data_grid(df, key, source="current"):
+    """
+    Show a dataset one page at a time with sorting, filtering and column search
+
+    Only the rows of the visible page are sent to the browser. Sort orders and
+    search results are cached per dataset version, so paging through them
+    does not recompute them.
+
+    Args:
+        df (pandas.DataFrame): The data to show
+        key (str): Prefix for the widget keys, unique on the page
+        source: Hashable name of the shown data (for example "current" or
+            ("step", 2)), so cached orders of different data are kept apart
+    """
+    columns = list(df.columns)
+    shown_columns = st.multiselect("Columns", columns, key=f"{key}_columns", placeholder="All columns")
+    shown_columns = shown_columns or columns
+
+    sort_col, direction_col, search_col, search_in_col = st.columns([3, 2, 4, 3])
+    with sort_col:
+        sort_by = st.selectbox("Sort by", [NO_SORT] + columns, key=f"{key}_sort")
+    with direction_col:
+        direction = st.radio("Order", ["Ascending", "Descending"], key=f"{key}_direction", horizontal=True,
+                             disabled=sort_by == NO_SORT)
+    with search_col:
+        query = st.text_input("Search", key=f"{key}_query",
+                              help="Finds rows containing this text. In a numeric or date column you can also use comparisons such as > 10")
+    with search_in_col:
+        search_in = st.selectbox("Search in", [ALL_COLUMNS] + columns, key=f"{key}_search_in")
+
+    order = None
+    if sort_by != NO_SORT:
+        ascending = direction == "Ascending"
+        order = get_cached_result("grid_sort", (source, sort_by, ascending),
+                                  lambda: sort_permutation(df, sort_by, ascending), max_entries=8)
+    mask = None
+    if query:
+        search_column = None if search_in == ALL_COLUMNS else search_in
+        mask = get_cached_result("grid_search", (source, query, search_column),
+                                 lambda: search_mask(df, query, search_column), max_entries=8)
+    positions = grid_positions(len(df), order, mask)
+
+    page_rows = st.session_state.get(f"{key}_page_rows", GRID_PAGE_SIZES[1])
+    pages = max(1, -(-len(positions) // page_rows))
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages  # the filter left fewer pages than before
+    page = st.session_state.get(f"{key}_page", 1)
+    start = (page - 1) * page_rows
+    st.dataframe(df.iloc[positions[start:start + page_rows]][shown_columns])
+
+    info_col, rows_col, page_col = st.columns([8, 2, 2])
+    with rows_col:
+        st.selectbox("Rows per page", GRID_PAGE_SIZES, index=1, key=f"{key}_page_rows")
+    with page_col:
+        st.number_input("Page", min_value=1, max_value=pages, key=f"{key}_page")
+    with info_col:
+        filtered = f" (filtered from {len(df):,})" if mask is not None else ""
+        if len(positions):
+            st.caption(f"Rows {start + 1:,} to {min(start + page_rows, len(positions)):,} of {len(positions):,}{filtered}, "
+                       f"page {page} of {pages}")
+        else:
+            st.caption(f"No rows match{filtered}")
@@ -0,0 +1,161 @@
+# ------Description: This file contains functions for recording dataset changes as compact deltas------
+
+import numpy as np
+
+#--------------------------------DELTAS--------------------------------
+
+#function to record a step that only dropped rows
+
+def make_row_delta(kept_rows, description=None):
+    """
+    Record a step that dropped rows as a bit-packed mask
+
+    Args:
+        kept_rows (numpy.ndarray): Boolean mask over the rows before the step, True for kept rows
+        description (str, optional): Label shown in the history
+
+    Returns:
+        dict: The delta, or None if no row was dropped
+    """
+    kept_rows = np.asarray(kept_rows, dtype=bool)
+    if kept_rows.all():
+        return None
+    return {
+        'kind': 'rows',
+        'description': description or f"Removed {int((~kept_rows).sum())} rows",
+        'mask': np.packbits(kept_rows),
+        'length': len(kept_rows),
+    }
+
+#function to record a step that changed some columns, storing only the cells that differ
+
+def make_column_delta(old_df, new_df, changed_columns, description=None):
+    """
+    Record a step that changed some columns as sparse cell patches
+
+    Only the cells whose value changed are stored. Columns that are new or
+    whose dtype changed are stored whole.
+
+    Args:
+        old_df (pandas.DataFrame): The dataset before the step
+        new_df (pandas.DataFrame): The dataset after the step (same rows)
+        changed_columns (list): The columns the step touched
+        description (str, optional): Label shown in the history
+
+    Returns:
+        dict: The delta, or None if nothing changed
+    """
+    patches = {}
+    for col in changed_columns:
+        if col not in new_df.columns:
+            continue
+        new = new_df[col]
+        if col not in old_df.columns or old_df[col].dtype != new.dtype:
+            patches[col] = (None, new.reset_index(drop=True))
+            continue
+        old = old_df[col]
+        both_missing = old.isna().to_numpy() & new.isna().to_numpy()
+        # nullable dtypes compare to NA where one side is missing, which is a change
+        positions = np.flatnonzero((old != new).to_numpy(dtype=bool, na_value=True) & ~both_missing)
+        if len(positions):
+            patches[col] = (positions, new.iloc[positions].reset_index(drop=True))
+
+    dropped = [col for col in old_df.columns if col not in new_df.columns]
+    if not patches and not dropped and list(old_df.columns) == list(new_df.columns):
+        return None
+    changed_cells = sum(len(values) for _, values in patches.values())
+    return {
+        'kind': 'patch',
+        'description': description or f"Changed {changed_cells} values",
+        'patches': patches,
+        'columns': new_df.columns.tolist(),
+    }
+
+#function to record a step that dropped rows and then changed some columns
+
+def make_delta(old_df, new_df, changed_columns=None, kept_rows=None, description=None):
+    """
+    Record a step described by the rows it kept and/or the columns it changed
+
+    Args:
+        old_df (pandas.DataFrame): The dataset before the step
+        new_df (pandas.DataFrame): The dataset after the step
+        changed_columns (list, optional): The columns the step touched
+        kept_rows (numpy.ndarray, optional): Boolean mask over old_df's rows, True for kept rows
+        description (str, optional): Label shown in the history
+
+    Returns:
+        dict: The delta, or None if nothing changed
+    """
+    row_delta = make_row_delta(kept_rows, description) if kept_rows is not None else None
+    column_delta = None
+    if changed_columns:
+        before = old_df[np.asarray(kept_rows, dtype=bool)] if kept_rows is not None else old_df
+        column_delta = make_column_delta(before, new_df, changed_columns, description)
+    if row_delta is None or column_delta is None:
+        return row_delta or column_delta
+    return {'kind': 'steps', 'description': description or row_delta['description'], 'deltas': [row_delta, column_delta]}
+
+#function to describe what a recorded step changed
+
+def delta_changes(delta):
+    '''return (changed columns, kept rows mask or None) for a recorded step'''
+    if delta['kind'] == 'rows':
+        return [], np.unpackbits(delta['mask'], count=delta['length']).astype(bool)
+    if delta['kind'] == 'patch':
+        return list(delta['patches']), None
+    row_delta, column_delta = delta['deltas']
+    return delta_changes(column_delta)[0], delta_changes(row_delta)[1]
+
+#--------------------------------REPLAY--------------------------------
+
+#function to apply one recorded step to a dataframe
+
+def apply_delta(df, delta):
+    """
+    Apply a recorded step to the dataset it was recorded on
+
+    Args:
+        df (pandas.DataFrame): The dataset before the step
+        delta (dict): A delta from make_delta, make_row_delta or make_column_delta
+
+    Returns:
+        pandas.DataFrame: The dataset after the step
+    """
+    if delta['kind'] == 'rows':
+        return df[np.unpackbits(delta['mask'], count=delta['length']).astype(bool)]
+    if delta['kind'] == 'steps':
+        return replay_deltas(df, delta['deltas'])
+
+    df = df.copy(deep=False)
+    for col, (positions, values) in delta['patches'].items():
+        # the array keeps extension dtypes (nullable, Arrow strings, categories) that to_numpy would turn into objects
+        if positions is None:
+            df[col] = values.array
+        else:
+            column = df[col].copy()
+            column.iloc[positions] = values.array
+            df[col] = column
+    return df[delta['columns']]
+
+#function to rebuild a dataset from its base and a list of steps
+
+def replay_deltas(base_df, deltas):
+    '''return the dataset after applying each delta to base_df in order'''
+    df = base_df
+    for delta in deltas:
+        df = apply_delta(df, delta)
+    return df
+
+#function to measure how much memory a step takes
+
+def delta_nbytes(delta):
+    '''return the approximate number of bytes held by a delta'''
+    if delta['kind'] == 'rows':
+        return delta['mask'].nbytes
+    if delta['kind'] == 'steps':
+        return sum(delta_nbytes(part) for part in delta['deltas'])
+    total = 0
+    for positions, values in delta['patches'].values():
+        total += (positions.nbytes if positions is not None else 0) + int(values.memory_usage(deep=True))
+    return total
@@ -0,0 +1,111 @@
+# ------Description: This file contains functions for running slow operations as background jobs------
+
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = min(4, os.cpu_count() or 1)   # jobs running at the same time, across all sessions
+
+_executor = None
+_executor_lock = threading.Lock()
+
+#--------------------------------JOBS--------------------------------
+
+class JobCancelled(Exception):
+    '''raised inside a job when it has been asked to stop'''
+
+class Job:
+    """
+    A slow operation running on the shared worker pool
+
+    The operation receives the job as its first argument and calls
+    job.report() as it goes, which records its progress and stops it with
+    JobCancelled once cancel() has been called.
+
+    Attributes:
+        id (str): Short unique id of the job
+        key (tuple): The parameters the job was submitted with, used to merge duplicate submissions
+        description (str): Label shown while the job runs
+        status (str): "queued", "running", "done", "failed" or "cancelled"
+        progress (float): Fraction of the work done, between 0 and 1
+        result: The return value of the operation once it is done
+        error (Exception): The exception raised by the operation if it failed
+    """
+
+    def __init__(self, key, description):
+        self.id = uuid.uuid4().hex[:8]
+        self.key = key
+        self.description = description
+        self.status = "queued"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self._cancel_requested = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def report(self, progress):
+        '''record the fraction of work done and stop the job if it was cancelled'''
+        self.progress = min(max(float(progress), 0.0), 1.0)
+        if self._cancel_requested.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        '''ask the job to stop at its next progress report'''
+        self._cancel_requested.set()
+        if self.status == "queued":
+            self.status = "cancelled"
+
+#function to get the worker pool shared by every session
+
+def get_executor():
+    '''return the process-wide worker pool, creating it on first use'''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="tada-job")
+        return _executor
+
+#function to start a job, or join an identical one that is already running
+
+def submit_job(jobs, key, operation, *args, description=None):
+    """
+    Run operation(job, *args) on the worker pool
+
+    If jobs already holds an unfinished job with the same key, that job is
+    returned instead of starting the same work twice.
+
+    Args:
+        jobs (dict): The session's jobs by id
+        key (tuple): Hashable description of the work, e.g. (dataset version, parameters)
+        operation (callable): The work to run, called with the job and args
+        description (str, optional): Label shown while the job runs
+
+    Returns:
+        Job: The new or the already running job
+    """
+    for job in jobs.values():
+        if job.key == key and not job.finished:
+            return job
+    job = Job(key, description or getattr(operation, "__name__", "job"))
+    jobs[job.id] = job
+    get_executor().submit(_run_job, job, operation, args)
+    return job
+
+def _run_job(job, operation, args):
+    '''run a job on a worker thread, recording its result or error'''
+    if job.status == "cancelled":
+        return
+    job.status = "running"
+    try:
+        job.result = operation(job, *args)
+        job.progress = 1.0
+        job.status = "done"
+    except JobCancelled:
+        job.status = "cancelled"
+    except Exception as e:
+        job.error = e
+        job.status = "failed"
@@ -0,0 +1,208 @@
+# ------Description: This file contains functions for tracking the memory held by sessions and spilling idle ones to disk------
+
+import os
+import pickle
+import sys
+import threading
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+
+MEMORY_BUDGET_BYTES = int(os.environ.get("TADA_MEMORY_BUDGET_MB", 1024)) * 1024 * 1024   # bytes all sessions may keep in memory
+
+_session_caches = weakref.WeakValueDictionary()   # every live session's cache by session id
+_registry_lock = threading.Lock()
+
+#--------------------------------SESSION CACHES--------------------------------
+
+class SessionCache:
+    """
+    The results a session keeps in memory that can be rebuilt or reloaded
+
+    Entries can be written to a file on disk (spilled) when the server needs
+    memory, and are loaded back the next time the session reads one of them.
+    Their size is measured when it is asked for, so entries changed in place
+    (such as the row hashes a row index adds as they are asked for) are counted
+    as they are now.
+
+    Attributes:
+        session_id (str): The session the cache belongs to
+        spill_path (str): The file the entries are spilled to
+        last_active (float): When the session last used the cache (time.time())
+        dataset: The session's current DatasetHandle, counted while its frame is loaded
+    """
+
+    def __init__(self, session_id, spill_path):
+        self.session_id = session_id
+        self.spill_path = spill_path
+        self.last_active = time.time()
+        self.dataset = None
+        self._entries = {}
+        self._spilled = False
+        self._lock = threading.RLock()
+
+    @property
+    def spilled(self):
+        return self._spilled
+
+    def get(self, name, default=None):
+        '''return an entry, loading the spilled entries back first'''
+        with self._lock:
+            self.last_active = time.time()
+            if self._spilled:
+                self._reload()
+            return self._entries.get(name, default)
+
+    def set(self, name, value):
+        '''store an entry'''
+        with self._lock:
+            self.last_active = time.time()
+            if self._spilled:
+                self._reload()
+            self._entries[name] = value
+
+    def nbytes(self, include_dataset=True, seen=None):
+        """
+        Measure the bytes held in memory by the entries and the loaded dataset
+
+        Args:
+            include_dataset (bool): Count the loaded dataset
+            seen (set, optional): Ids of objects already counted, skipped and
+                extended with the ones counted here (see estimate_nbytes)
+
+        Returns:
+            int: The bytes held
+        """
+        with self._lock:
+            cached = 0 if self._spilled else estimate_nbytes(self._entries, seen)
+        dataset = self.dataset
+        return cached + (dataset.nbytes if include_dataset and dataset is not None and dataset.loaded else 0)
+
+    def spill(self):
+        """
+        Write the entries to spill_path and drop them from memory
+
+        Returns:
+            int: The bytes released
+        """
+        with self._lock:
+            if self._spilled or not self._entries:
+                return 0
+            released = estimate_nbytes(self._entries)
+            with open(self.spill_path + ".partial", "wb") as f:
+                pickle.dump(self._entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self.spill_path + ".partial", self.spill_path)
+            self._entries = {}
+            self._spilled = True
+            return released
+
+    def _reload(self):
+        '''load the spilled entries back into memory'''
+        try:
+            with open(self.spill_path, "rb") as f:
+                self._entries = pickle.load(f)
+            os.remove(self.spill_path)
+        except FileNotFoundError:
+            # the session's folder was cleaned up, the entries are rebuilt on demand
+            self._entries = {}
+        self._spilled = False
+
+#function to make a session cache known to the memory governor
+
+def register_session_cache(cache):
+    '''track a session's cache in the process-wide registry until the session ends'''
+    with _registry_lock:
+        _session_caches[cache.session_id] = cache
+
+#--------------------------------MEMORY GOVERNOR--------------------------------
+
+#function to report the memory held by every session
+
+def get_memory_usage():
+    """
+    Report the memory held by each live session
+
+    Returns:
+        dict: 'total' (bytes held by all sessions, a dataset shared by several
+        sessions counted once), 'budget' (MEMORY_BUDGET_BYTES) and 'sessions'
+        (one dict per session with 'session_id', 'bytes', 'idle_seconds' and 'spilled')
+    """
+    with _registry_lock:
+        caches = list(_session_caches.values())
+    now = time.time()
+    sessions = [{'session_id': cache.session_id, 'bytes': cache.nbytes(),
+                 'idle_seconds': now - cache.last_active, 'spilled': cache.spilled} for cache in caches]
+    return {'total': _total_nbytes(caches), 'budget': MEMORY_BUDGET_BYTES, 'sessions': sessions}
+
+def _total_nbytes(caches):
+    '''return the bytes held by the caches, counting a loaded dataset frame or a cached object shared by several sessions once'''
+    frames, seen = {}, set()
+    for cache in caches:
+        dataset = cache.dataset
+        if dataset is not None and dataset.loaded:
+            frames[dataset.frame_key] = dataset.nbytes
+    return sum(cache.nbytes(include_dataset=False, seen=seen) for cache in caches) + sum(frames.values())
+
+#function to spill the least recently active sessions until memory use is within the budget
+
+def enforce_memory_budget(budget=MEMORY_BUDGET_BYTES, keep=None):
+    """
+    Spill the caches of the least recently active sessions until the total fits in budget
+
+    Args:
+        budget (int): Bytes all sessions may keep in memory
+        keep (SessionCache, optional): A cache that is never spilled, usually the calling session's
+
+    Returns:
+        list: The ids of the sessions that were spilled
+    """
+    with _registry_lock:
+        caches = list(_session_caches.values())
+    total = _total_nbytes(caches)
+    spilled = []
+    for cache in sorted(caches, key=lambda cache: cache.last_active):
+        if total <= budget:
+            break
+        if cache is keep or cache.spilled:
+            continue
+        released = cache.spill()
+        if released:
+            total -= released
+            spilled.append(cache.session_id)
+    return spilled
+
+#--------------------------------SIZE ESTIMATES--------------------------------
+
+#function to estimate how much memory a cached value holds
+
+def estimate_nbytes(value, seen=None):
+    """
+    Estimate the bytes held by arrays, frames and containers of them
+
+    An object reached more than once (the same array in two entries, or in
+    the caches of two sessions) is only counted the first time.
+
+    Args:
+        value: The value to measure
+        seen (set, optional): Ids of the objects already counted, extended with
+            the ones counted here
+
+    Returns:
+        int: The approximate bytes held
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = value.memory_usage(deep=False)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(item, seen) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(item, seen) for item in value)
+    return sys.getsizeof(value)
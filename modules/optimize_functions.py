@@ -0,0 +1,121 @@
+# ------Description: This file contains functions for shrinking the memory used by a dataset's column types------
+
+import numpy as np
+import pandas as pd
+
+from modules.preproc_functions import get_categorical_features
+from modules.timing_functions import timed
+from modules.upload_functions import CATEGORY_MAX_RATIO
+
+ARROW_STRING = "string[pyarrow]"
+
+#--------------------------------OPTIMIZING--------------------------------
+
+#function to store every column in the smallest type that holds its values exactly
+
+@timed()
+def optimize_dtypes(df):
+    """
+    Store every column in the smallest type that still holds its values exactly
+
+    Integer columns are downcast to the narrowest integer type covering their
+    range, and float columns to float32 when every value survives the round
+    trip unchanged. Text columns with few distinct values become categoricals
+    and the other text columns are stored as Arrow-backed strings. Columns
+    mixing text with other values are left alone.
+
+    Args:
+        df (pandas.DataFrame): The dataset
+
+    Returns:
+        tuple: The optimized DataFrame and a report DataFrame with one row per
+        changed column ('column', 'dtype', 'optimized dtype', 'bytes before',
+        'bytes after', 'bytes saved'), sorted by the bytes saved
+    """
+    text_columns = set(get_categorical_features(df))
+    optimized = {}
+    for col in df.columns:
+        series = df[col]
+        if col in text_columns:
+            new_series = _optimize_text(series)
+        elif pd.api.types.is_integer_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            new_series = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            new_series = _optimize_float(series)
+        else:
+            new_series = None
+        if new_series is not None and new_series.dtype != series.dtype:
+            optimized[col] = new_series
+
+    rows = []
+    for col, new_series in optimized.items():
+        before = int(df[col].memory_usage(index=False, deep=True))
+        after = int(new_series.memory_usage(index=False, deep=True))
+        if after >= before:
+            continue
+        rows.append({'column': col, 'dtype': str(df[col].dtype), 'optimized dtype': _dtype_name(new_series.dtype),
+                     'bytes before': before, 'bytes after': after, 'bytes saved': before - after})
+    report = pd.DataFrame(rows, columns=['column', 'dtype', 'optimized dtype', 'bytes before', 'bytes after', 'bytes saved'])
+    report = report.sort_values('bytes saved', ascending=False, ignore_index=True)
+
+    new_df = df.copy(deep=False)  # only the optimized columns are replaced
+    for col in report['column']:
+        new_df[col] = optimized[col]
+    return new_df, report
+
+def _dtype_name(dtype):
+    '''return the name of a dtype, naming the storage of string columns'''
+    return f"string[{dtype.storage}]" if isinstance(dtype, pd.StringDtype) else str(dtype)
+
+def _optimize_text(series):
+    '''return a text column as a categorical or Arrow-backed strings, or None if it holds other values too'''
+    if pd.api.types.infer_dtype(series, skipna=True) != 'string':
+        return None
+    non_null = series.count()
+    if non_null and series.nunique() / non_null <= CATEGORY_MAX_RATIO:
+        return series.astype('category')
+    return series.astype(ARROW_STRING)
+
+def _optimize_float(series):
+    '''return a float column as float32 when no value changes, otherwise None'''
+    values = series.to_numpy()
+    narrowed = values.astype(np.float32)
+    with np.errstate(over='ignore', invalid='ignore'):
+        exact = (narrowed.astype(values.dtype) == values) | np.isnan(values)
+    return series.astype(np.float32) if exact.all() else None
+
+#--------------------------------RESTORING--------------------------------
+
+#function to cast optimized columns back to the types they had before
+
+@timed()
+def restore_dtypes(df, dtypes):
+    """
+    Cast columns back to the types they had before optimize_dtypes
+
+    Columns that were removed since, or whose values no longer fit their old
+    type, are left as they are.
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        dtypes (dict): Mapping of column name to its original dtype string
+
+    Returns:
+        tuple: The restored DataFrame and the list of restored columns
+    """
+    new_df = df.copy(deep=False)
+    restored = []
+    for col, dtype in dtypes.items():
+        if col not in df.columns or str(df[col].dtype) == dtype:
+            continue
+        try:
+            if dtype == 'object':
+                # Arrow strings turn missing values into pd.NA, object columns hold NaN
+                values = df[col].astype(object)
+                new_df[col] = values.where(df[col].notna(), np.nan)
+            else:
+                new_df[col] = df[col].astype(dtype)
+        except (TypeError, ValueError):
+            continue
+        restored.append(col)
+    return new_df, restored
@@ -0,0 +1,173 @@
+# ------Description: This file contains functions for running per-column computations on blocks of columns in parallel and for starting worker processes------
+
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+PARALLEL_WORKERS = int(os.environ.get("TADA_PARALLEL_WORKERS", os.cpu_count() or 1))        # threads sharing the column blocks
+PARALLEL_MIN_CELLS = int(os.environ.get("TADA_PARALLEL_MIN_CELLS", 1_000_000))              # smaller frames run on the calling thread
+BLOCKS_PER_WORKER = 2             # blocks queued per thread, so a slow block does not leave the other threads idle
+
+_column_executor = None
+_column_executor_lock = threading.Lock()
+_main_module_lock = threading.Lock()
+
+#--------------------------------COLUMN BLOCKS--------------------------------
+
+#function to split a range of columns into contiguous blocks
+
+def column_blocks(n_columns, n_blocks):
+    '''return (start, stop) ranges splitting n_columns columns into at most n_blocks blocks of nearly equal size'''
+    n_blocks = max(1, min(n_blocks, n_columns))
+    size, extra = divmod(n_columns, n_blocks)
+    blocks, start = [], 0
+    for number in range(n_blocks):
+        stop = start + size + (number < extra)
+        blocks.append((start, stop))
+        start = stop
+    return blocks
+
+#function to get the thread pool the column blocks run on
+
+def get_column_executor():
+    '''return the process-wide column pool, creating it on first use'''
+    global _column_executor
+    with _column_executor_lock:
+        if _column_executor is None:
+            # separate from the job pool, so a job waiting on its blocks never waits for a free job thread
+            _column_executor = ThreadPoolExecutor(max_workers=PARALLEL_WORKERS, thread_name_prefix="tada-column")
+        return _column_executor
+
+#function to run a per-column kernel on blocks of columns, in parallel when the frame is large
+
+def map_column_blocks(kernel, n_rows, n_columns, workers=None, min_cells=None, progress_callback=None):
+    """
+    Run kernel(start, stop) on contiguous blocks of columns and collect the results
+
+    NumPy and most pandas reductions release the GIL while they work on a
+    block, so the blocks of a wide frame run at the same time on the column
+    pool. Frames with fewer than min_cells cells, or a single worker, run as
+    one block on the calling thread, where starting threads would cost more
+    than it saves.
+
+    Args:
+        kernel (callable): Called with the start and stop position of a block of
+            columns, must only read shared data or write its own columns
+        n_rows (int): Rows of the frame, used to decide whether to go parallel
+        n_columns (int): Columns to split into blocks
+        workers (int, optional): Threads the blocks are meant for, PARALLEL_WORKERS by default (the
+            pool never runs more than PARALLEL_WORKERS blocks at once)
+        min_cells (int, optional): Smallest frame run in parallel, PARALLEL_MIN_CELLS by default
+        progress_callback (callable, optional): Called on the calling thread with the
+            fraction of blocks done (0 to 1) as they finish. If it raises (a cancelled
+            job), the blocks that have not started are cancelled and the error propagates
+
+    Returns:
+        list: The kernel's results, one per block in column order
+    """
+    workers = PARALLEL_WORKERS if workers is None else workers
+    min_cells = PARALLEL_MIN_CELLS if min_cells is None else min_cells
+    if workers <= 1 or n_columns < 2 or n_rows * n_columns < min_cells:
+        results = [kernel(0, n_columns)]
+        if progress_callback is not None:
+            progress_callback(1.0)
+        return results
+    blocks = column_blocks(n_columns, workers * BLOCKS_PER_WORKER)
+    futures = [get_column_executor().submit(kernel, start, stop) for start, stop in blocks]
+    try:
+        results = []
+        for future in futures:
+            results.append(future.result())
+            if progress_callback is not None:
+                progress_callback(len(results) / len(futures))
+        return results
+    finally:
+        for future in futures:
+            future.cancel()  # no-op for finished blocks, frees the pool when a block or the callback failed
+
+#function to report the progress of one part of a longer computation
+
+def progress_range(progress_callback, start, stop):
+    '''return a callback mapping a part's progress (0 to 1) onto [start, stop] of progress_callback, None without a callback'''
+    if progress_callback is None:
+        return None
+    return lambda fraction: progress_callback(start + (stop - start) * fraction)
+
+#--------------------------------PROCESS POOLS--------------------------------
+
+#function to get a multiprocessing context whose children do not import the page running the app
+
+def clean_main_context(method):
+    '''return a "spawn" or "forkserver" context whose processes start without the parent's __main__ module'''
+    return _ForkServerContext() if method == "forkserver" else _SpawnContext()
+
+class _CleanMainProcess:
+    '''process mixin starting the child without the parent's __main__ module'''
+    # Streamlit runs every page as __main__, and forkserver and spawn children
+    # (and the fork server itself) import the parent's __main__ again, which
+    # would run the page outside Streamlit. The workers import the modules of
+    # the functions they run themselves.
+    def start(self):
+        with _main_module_lock:
+            main, clean = sys.modules.get('__main__'), types.ModuleType('__main__')
+            sys.modules['__main__'] = clean
+            try:
+                super().start()
+            finally:
+                if sys.modules.get('__main__') is clean:  # a page started since then keeps its own
+                    sys.modules['__main__'] = main
+
+class _SpawnProcess(_CleanMainProcess, multiprocessing.context.SpawnProcess):
+    pass
+
+class _SpawnContext(multiprocessing.context.SpawnContext):
+    Process = _SpawnProcess
+
+if "forkserver" in multiprocessing.get_all_start_methods():
+    class _ForkServerProcess(_CleanMainProcess, multiprocessing.context.ForkServerProcess):
+        pass
+
+    class _ForkServerContext(multiprocessing.context.ForkServerContext):
+        Process = _ForkServerProcess
+
+#--------------------------------NAN-AWARE STATISTICS--------------------------------
+
+# Kernels run on several threads at once, and warnings.catch_warnings() is not
+# thread-safe (it swaps the process-wide filters). NumPy's nan-reductions warn
+# on all-missing columns, so kernels use these versions, which give NaN for
+# those columns without warning.
+
+#function to compute the mean and standard deviation of every column of a block
+
+def nan_mean_std(block, ddof=0):
+    '''return the mean and standard deviation of every column of a 2D float array, ignoring NaNs, NaN for columns without enough values'''
+    present = ~np.isnan(block)
+    count = present.sum(axis=0)
+    mean = np.divide(np.where(present, block, 0.0).sum(axis=0), count, out=np.full(block.shape[1], np.nan), where=count > 0)
+    deviations = np.where(present, block - mean, 0.0)
+    variance = np.divide((deviations * deviations).sum(axis=0), count - ddof, out=np.full(block.shape[1], np.nan),
+                         where=count > ddof)
+    return mean, np.sqrt(variance)
+
+#function to compute percentiles of every column of a block
+
+def nan_percentiles(block, q):
+    '''return np.nanpercentile(block, q, axis=0), with NaN for all-missing columns instead of a warning'''
+    result = np.full((len(q), block.shape[1]), np.nan)
+    present = ~np.isnan(block).all(axis=0) if len(block) else np.zeros(block.shape[1], dtype=bool)
+    if present.any():
+        result[:, present] = np.nanpercentile(block[:, present], q, axis=0)
+    return result
+
+#function to compute the minimum and maximum of every column of a block
+
+def nan_min_max(block):
+    '''return the minimum and maximum of every column of a 2D float array, ignoring NaNs, NaN for all-missing columns'''
+    if not len(block):
+        return np.full(block.shape[1], np.nan), np.full(block.shape[1], np.nan)
+    return np.fmin.reduce(block, axis=0), np.fmax.reduce(block, axis=0)
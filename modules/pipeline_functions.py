@@ -0,0 +1,324 @@
+# ------Description: This file contains functions for recording preprocessing steps as a plan and running it------
+
+import json
+
+import numpy as np
+
+from modules.preproc_functions import (build_row_index, duplicate_mask, compute_outlier_scores, outlier_mask,
+                                      impute_missing_values, GROUP_FILL_METHODS)
+from modules.encoding_functions import (fit_encoder, apply_encoder, fit_scaler, apply_scaler, transform_code,
+                                        ENCODING_METHODS, SCALING_METHODS)
+from modules.reduction_functions import fit_reduction, apply_reduction, reduction_code
+from modules.parallel_functions import progress_range
+from modules.timing_functions import timed
+
+# A plan is a list of steps. Each step is a dict with an 'op' and its parameters:
+#   {'op': 'drop_duplicates', 'subset': [...] or None}
+#   {'op': 'remove_outliers', 'columns': [...], 'method': 'zscore' or 'iqr', 'threshold': float}
+#   {'op': 'fill', 'column': str, 'method': "Fill with mean" / "Fill with median" / "Fill with mode" / "Fill with custom value", 'value': any,
+#    'by': key column or None (mean and median only, computed within the key's groups)}
+#   {'op': 'encode', ...} and {'op': 'scale', ...}, see encoding_functions, fitted on the data entering them
+#   {'op': 'reduce', ...}, see reduction_functions, fitted on the data entering it
+#   {'op': 'drop_columns', 'columns': [...]}
+
+FILTER_OPS = ('drop_duplicates', 'remove_outliers')
+TRANSFORM_OPS = ('encode', 'scale', 'reduce')   # steps fitted on the data entering them, each runs as its own group
+PREVIEW_ROWS = 5000               # size of the fixed sample used to preview a plan
+MAX_DESCRIBED_FILLS = 3           # longer runs of fills are described by their number of columns
+TRANSFORMS = {                    # fit and apply functions of every transform step
+    'encode': (fit_encoder, apply_encoder),
+    'scale': (fit_scaler, apply_scaler),
+    'reduce': (fit_reduction, apply_reduction),
+}
+
+#--------------------------------PLAN STEPS--------------------------------
+
+#function to describe a step for display
+
+def describe_step(step):
+    '''return a short human readable description of a plan step'''
+    if step['op'] == 'drop_duplicates':
+        on = f" on {', '.join(map(str, step['subset']))}" if step.get('subset') else ""
+        return f"Remove duplicate rows{on}"
+    if step['op'] == 'remove_outliers':
+        method = "Z-score" if step['method'] == 'zscore' else "IQR"
+        return f"Remove outliers in {', '.join(map(str, step['columns']))} ({method} > {step['threshold']})"
+    if step['op'] == 'fill':
+        by = f" by {step['by']}" if step.get('by') else ""
+        return f"{step['method']}{by} in {step['column']}"
+    if step['op'] == 'encode':
+        method = {key: label for label, key in ENCODING_METHODS.items()}[step['method']]
+        target = f" of {step['target']}" if step['method'] == 'target' else ""
+        return f"{method} encode {', '.join(map(str, step['columns']))}{target}"
+    if step['op'] == 'scale':
+        method = {key: label for label, key in SCALING_METHODS.items()}[step['method']]
+        return f"{method} scale {', '.join(map(str, step['columns']))}"
+    if step['op'] == 'reduce':
+        return f"PCA of {len(step['columns'])} features to {step['n_components']} components"
+    if step['op'] == 'drop_columns':
+        return f"Drop {', '.join(map(str, step['columns']))}"
+    return step['op']
+
+#function to describe a whole plan for display
+
+def describe_plan(plan):
+    '''return a short description of a plan, summarizing groups of more than MAX_DESCRIBED_FILLS fills'''
+    descriptions = []
+    for group in fuse_plan(plan):
+        if group[0]['op'] == 'fill' and len(group) > MAX_DESCRIBED_FILLS:
+            descriptions.append(f"Fill missing values in {len(group)} columns")
+        else:
+            descriptions.extend(describe_step(step) for step in group)
+    return "; ".join(descriptions)
+
+#function to split a plan into groups of adjacent steps that can run in one pass
+
+def fuse_plan(plan):
+    """
+    Group adjacent compatible steps so each group runs as a single pass
+
+    Adjacent fills are combined into one column update, unless a fill's group
+    key was filled earlier in the group, and adjacent column drops into one
+    drop. Row filters are combined into one row mask only when
+    evaluating them all on the data entering the group gives the same rows as
+    running them in order (see _fuses_with), other filters start a new group.
+    Encoders, scalers and PCA are fitted on the data entering them, so each
+    one is a group of its own.
+
+    Args:
+        plan (list): The plan steps
+
+    Returns:
+        list: Groups of steps, each a list of steps of the same kind
+    """
+    groups = []
+    for step in plan:
+        kind = 'filter' if step['op'] in FILTER_OPS else step['op']
+        if groups and groups[-1][0] == kind and kind not in TRANSFORM_OPS \
+                and (kind not in ('filter', 'fill') or _fuses_with(groups[-1][1], step)):
+            groups[-1][1].append(step)
+        else:
+            groups.append((kind, [step]))
+    return [steps for _, steps in groups]
+
+def _fuses_with(group, step):
+    '''return True if a filter or fill step gives the same result whether or not the earlier steps of its group ran first'''
+    # the fills of a group are all computed on the data entering it, so a key filled earlier in the group would not be seen
+    if step['op'] == 'fill':
+        return not step.get('by') or all(earlier['column'] != step['by'] for earlier in group)
+    # outlier statistics and the first row of a duplicate group depend on the rows left by earlier filters
+    if step['op'] != 'drop_duplicates':
+        return False
+    subset = step.get('subset') or None
+    # identical rows are removed together by every filter, except for their first copy, so a full-row check is unaffected
+    if subset is None:
+        return True
+    # rows sharing an earlier, wider subset share this one, so the earlier filter keeps the first of each of its groups
+    return all(earlier['op'] == 'drop_duplicates' and (not earlier.get('subset') or set(subset) <= set(earlier['subset']))
+               for earlier in group)
+
+#--------------------------------RUNNING A PLAN--------------------------------
+
+#function to run a plan on a dataframe
+
+@timed()
+def apply_plan(df, plan, progress_callback=None, row_index=None, outlier_scores=None):
+    """
+    Run a plan on a DataFrame, one pass per fused group of steps
+
+    Args:
+        df (pandas.DataFrame): The data to transform
+        plan (list): The plan steps
+        progress_callback (callable, optional): Called with the fraction of the
+            plan done (0 to 1), by each group's kernels as they work through their
+            columns, blocks or chunks, so a callback that raises (a cancelled job)
+            stops the plan inside a long step rather than after it
+        row_index (dict, optional): The row index of df (see build_row_index),
+            used by filters at the start of the plan instead of rehashing df
+        outlier_scores (dict, optional): The outlier scores of df (see
+            compute_outlier_scores), used the same way
+
+    Returns:
+        tuple: (transformed DataFrame, boolean mask of the input rows that were
+        kept or None if no row was dropped, list of the columns that were filled,
+        encoded, scaled, reduced or dropped, the plan with every encoder, scaler
+        and PCA fitted)
+    """
+    input_rows = len(df)
+    kept_positions = None
+    changed_columns = []
+    fitted_plan = []
+    groups = fuse_plan(plan)
+    for number, group in enumerate(groups):
+        if progress_callback is not None:
+            progress_callback(number / len(groups))
+        group_progress = progress_range(progress_callback, number / len(groups), (number + 1) / len(groups))
+        if group[0]['op'] in FILTER_OPS:
+            # the given index and scores describe the input, so only the first group can use them
+            keep = _filter_mask(df, group, *((row_index, outlier_scores) if number == 0 else (None, None)),
+                                progress_callback=group_progress)
+            df = df[keep]  # one copy for every filter in the group
+            positions = np.flatnonzero(keep)
+            kept_positions = positions if kept_positions is None else kept_positions[positions]
+        elif group[0]['op'] in TRANSFORM_OPS:
+            step = group[0]
+            fit, apply = TRANSFORMS[step['op']]
+            fitted = 0.0
+            if 'params' not in step:
+                # fitted once, a replayed step transforms new data with the same parameters
+                fitted = 0.5
+                step = fit(df, step, progress_callback=progress_range(group_progress, 0.0, fitted))
+            df, columns = apply(df, step, progress_callback=progress_range(group_progress, fitted, 1.0))
+            changed_columns.extend(col for col in [*step['columns'], *columns] if col not in changed_columns)
+            group = [step]
+        elif group[0]['op'] == 'drop_columns':
+            columns = [col for step in group for col in step['columns']]
+            df = df.drop(columns=[col for col in dict.fromkeys(columns) if col in df.columns])
+            changed_columns.extend(col for col in columns if col not in changed_columns)
+        else:
+            df = _fill_columns(df, group, progress_callback=group_progress)
+            changed_columns.extend(step['column'] for step in group if step['column'] not in changed_columns)
+        fitted_plan.extend(group)
+    if progress_callback is not None:
+        progress_callback(1.0)
+
+    kept_rows = None
+    if kept_positions is not None and len(kept_positions) < input_rows:
+        kept_rows = np.zeros(input_rows, dtype=bool)
+        kept_rows[kept_positions] = True
+    return df, kept_rows, changed_columns, fitted_plan
+
+def _filter_mask(df, steps, row_index=None, scores=None, progress_callback=None):
+    '''return the combined mask of rows kept by every filter step, all evaluated on df,
+    with the row index and outlier scores of df computed only when they are not given'''
+    # hashing the rows and scoring the features are the long parts, each gets the share of its steps
+    hashing = sum(step['op'] == 'drop_duplicates' for step in steps) / len(steps)
+    keep = np.ones(len(df), dtype=bool)
+    outlier_columns = {col for s in steps if s['op'] == 'remove_outliers' for col in s['columns']}
+    if scores is not None and not outlier_columns <= set(scores['columns']):
+        scores = None
+    for step in steps:
+        if step['op'] == 'drop_duplicates':
+            row_index = row_index if row_index is not None else build_row_index(df, progress_range(progress_callback, 0.0, hashing))
+            keep &= ~duplicate_mask(row_index, step.get('subset') or None)
+        else:
+            if scores is None:
+                scores = compute_outlier_scores(df, sorted(outlier_columns, key=list(df.columns).index),
+                                                progress_callback=progress_range(progress_callback, hashing, 1.0))
+            keep &= ~outlier_mask(scores, step['threshold'], step['method'], step['columns']).any(axis=1)
+    return keep
+
+def _fill_columns(df, steps, progress_callback=None):
+    '''fill missing values of several columns, computing each statistic once for all columns'''
+    strategies = {}
+    for step in steps:
+        # a column filled twice in a row keeps the first fill, the second finds nothing missing
+        strategies.setdefault(step['column'], {'method': step['method'], 'value': step.get('value'), 'by': step.get('by')})
+    return impute_missing_values(df, strategies, progress_callback)
+
+#--------------------------------SAVING A PLAN--------------------------------
+
+#function to write a plan as json
+
+def plan_to_json(plan):
+    '''return a plan as JSON text, with NumPy values of fitted steps written as plain numbers'''
+    return json.dumps(plan, indent=2, default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+
+#function to read a plan written by plan_to_json
+
+def load_plan(text):
+    """
+    Read a plan from JSON text and check its steps
+
+    Args:
+        text (str): A JSON list of steps, or an object with a "steps" list
+
+    Returns:
+        list: The plan steps
+
+    Raises:
+        ValueError: If the text is not a plan or a step has an unknown op
+    """
+    plan = json.loads(text)
+    if isinstance(plan, dict):
+        plan = plan.get('steps')
+    if not isinstance(plan, list) or not all(isinstance(step, dict) for step in plan):
+        raise ValueError("a plan is a list of steps")
+    known = (*FILTER_OPS, *TRANSFORM_OPS, 'fill', 'drop_columns')
+    for number, step in enumerate(plan, 1):
+        if step.get('op') not in known:
+            raise ValueError(f"step {number} has an unknown op {step.get('op')!r}. Must be one of {list(known)}")
+    return plan
+
+#--------------------------------PREVIEW--------------------------------
+
+#function to take the fixed sample a plan is previewed on
+
+def get_preview_sample(df, n=PREVIEW_ROWS):
+    '''return a fixed uniform sample of at most n rows, in the original row order'''
+    if len(df) <= n:
+        return df
+    positions = np.sort(np.random.default_rng(0).choice(len(df), size=n, replace=False))
+    return df.iloc[positions]
+
+#--------------------------------NOTEBOOK EXPORT--------------------------------
+
+#function to turn a plan into code cells that reproduce it with pandas
+
+def plan_to_code(plan, source_file="your_data.csv"):
+    """
+    Write a plan as pandas code, one cell per fused group of steps
+
+    Args:
+        plan (list): The plan steps
+        source_file (str): The file the first cell loads
+
+    Returns:
+        list: Code strings, ready for convert_actions_to_pnyb
+    """
+    cells = [f"import numpy as np\nimport pandas as pd\n\ndf = pd.read_csv({source_file!r})"]
+    for group in fuse_plan(plan):
+        lines = [f"# {describe_step(step)}" for step in group]
+        if group[0]['op'] == 'reduce':
+            lines.extend(reduction_code(group[0]))
+        elif group[0]['op'] in TRANSFORM_OPS:
+            lines.extend(transform_code(group[0]))
+        elif group[0]['op'] == 'drop_columns':
+            for step in group:
+                lines.extend(reduction_code(step))
+        elif group[0]['op'] in FILTER_OPS:
+            lines.append("keep = pd.Series(True, index=df.index)")
+            for step in group:
+                lines.extend(_filter_code(step))
+            lines.append("df = df[keep].copy()")
+        else:
+            for step in group:
+                lines.append(_fill_code(step))
+        cells.append("\n".join(lines))
+    return cells
+
+def _filter_code(step):
+    '''return the lines that narrow the keep mask for a filter step'''
+    if step['op'] == 'drop_duplicates':
+        return [f"keep &= ~df.duplicated(subset={step.get('subset') or None!r})"]
+    cols = step['columns']
+    if step['method'] == 'zscore':
+        return [f"z = (df[{cols!r}] - df[{cols!r}].mean()).abs() / df[{cols!r}].std()",
+                f"keep &= ~(z > {step['threshold']!r}).any(axis=1)"]
+    return [f"q1, q3 = df[{cols!r}].quantile(0.25), df[{cols!r}].quantile(0.75)",
+            "iqr = q3 - q1",
+            f"keep &= ~((df[{cols!r}] < q1 - {step['threshold']!r} * iqr) | (df[{cols!r}] > q3 + {step['threshold']!r} * iqr)).any(axis=1)"]
+
+def _fill_code(step):
+    '''return the line that fills the missing values of one column'''
+    col = step['column']
+    statistic = {
+        "Fill with mean": f"df[{col!r}].mean()",
+        "Fill with median": f"df[{col!r}].median()",
+        "Fill with mode": f"df[{col!r}].mode()[0]",
+    }.get(step['method'], repr(step.get('value')))
+    if step.get('by') and step['method'] in GROUP_FILL_METHODS:
+        within_groups = f"df.groupby({step['by']!r})[{col!r}].transform({GROUP_FILL_METHODS[step['method']]!r})"
+        return f"df[{col!r}] = df[{col!r}].fillna({within_groups}).fillna({statistic})"
+    return f"df[{col!r}] = df[{col!r}].fillna({statistic})"
+
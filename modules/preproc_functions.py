@@ -1,107 +1,541 @@
 
 # ------Description: This file contains functions for data preprocessing------
 
+import numpy as np
+import pandas as pd
+
+from modules.parallel_functions import map_column_blocks, progress_range, nan_mean_std, nan_percentiles
+from modules.timing_functions import timed
+
+FILL_METHODS = ["Fill with mean", "Fill with median", "Fill with mode", "Fill with custom value"]
+GROUP_FILL_METHODS = {"Fill with mean": "mean", "Fill with median": "median"}   # methods that can be computed within groups
+
+#--------------------------------DUPLICATE HANDLING--------------------------------
+
+#function to hash every row of a dataframe once, so duplicate queries do not rescan the data
+
+@timed()
+def build_row_index(df, progress_callback=None):
+    """
+    Build a row-hash index of a DataFrame
+
+    Every column is hashed once with ``hash_pandas_object``. Row hashes for
+    any subset of columns are combined from these column hashes, so duplicate
+    counts and removals never have to compare the rows themselves again.
+    Rows with equal 64-bit hashes are treated as duplicates.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame to index
+        progress_callback (callable, optional): Called with the fraction of
+            columns hashed (0 to 1) after each column
+
+    Returns:
+        dict: 'column_hashes' (column name -> uint64 array) and 'row_hashes'
+        (combined hashes per subset of columns, filled lazily)
+    """
+    column_hashes = {}
+    for col in df.columns:
+        column_hashes[col] = _hash_column(df[col])
+        if progress_callback is not None:
+            progress_callback(len(column_hashes) / len(df.columns))
+    return {'column_hashes': column_hashes, 'row_hashes': {}}
+
+#function to keep a row index in sync after rows were dropped
+
+@timed()
+def filter_row_index(index, keep):
+    '''return the row index of a DataFrame after only the rows where keep is True were kept'''
+    return {
+        'column_hashes': {col: hashes[keep] for col, hashes in index['column_hashes'].items()},
+        'row_hashes': {subset: hashes[keep] for subset, hashes in index['row_hashes'].items()},
+    }
+
+#function to keep a row index in sync after some columns were changed
+
+@timed()
+def refresh_row_index(index, df, changed_columns):
+    '''return the row index of a DataFrame after only the changed columns were modified'''
+    column_hashes = {col: index['column_hashes'][col] for col in df.columns if col in index['column_hashes']}
+    for col in df.columns:
+        if col in changed_columns or col not in column_hashes:
+            column_hashes[col] = _hash_column(df[col])
+    row_hashes = {subset: hashes for subset, hashes in index['row_hashes'].items()
+                  if not set(subset) & set(changed_columns) and set(subset) <= set(column_hashes)}
+    return {'column_hashes': column_hashes, 'row_hashes': row_hashes}
+
+#function to flag duplicate rows using a row index
+
+@timed()
+def duplicate_mask(index, subset=None, keep='first'):
+    """
+    Flag duplicate rows using a row-hash index
+
+    Args:
+        index (dict): The result of build_row_index
+        subset (list, optional): Only compare these columns (defaults to all columns)
+        keep (str): Which occurrence is not flagged, 'first' or 'last'
+
+    Returns:
+        numpy.ndarray: Boolean array, True for rows that duplicate another row
+    """
+    subset = tuple(index['column_hashes']) if subset is None else tuple(subset)
+    if subset not in index['row_hashes']:
+        index['row_hashes'][subset] = _combine_hashes([index['column_hashes'][col] for col in subset])
+    return pd.Series(index['row_hashes'][subset]).duplicated(keep=keep).to_numpy()
+
 #function to count number of duplicate rows in dataframe
 
-def count_duplicate_rows(df):
+@timed()
+def count_duplicate_rows(df, subset=None, index=None):
     """
     Count the number of duplicate rows in a DataFrame
 
     Args:
         df (pandas.DataFrame): The DataFrame to analyze
+        subset (list, optional): Only compare these columns
+        index (dict, optional): A row index of df from build_row_index
 
     Returns:
         int: The number of duplicate rows
     """
-    return df.duplicated().sum()
+    index = index if index is not None else build_row_index(df if subset is None else df[subset])
+    return int(duplicate_mask(index, subset).sum())
 
 #function to remove duplicate rows from dataframe
 
-def remove_duplicate_rows(df):
+@timed()
+def remove_duplicate_rows(df, subset=None, index=None):
     """
     Remove duplicate rows from a DataFrame
 
     Args:
         df (pandas.DataFrame): The DataFrame to clean
+        subset (list, optional): Only compare these columns
+        index (dict, optional): A row index of df from build_row_index
 
     Returns:
         pandas.DataFrame: The DataFrame with duplicate rows removed
     """
-    df_clean = df.copy()  # Create a copy of the DataFrame
-    df_clean.drop_duplicates(inplace=True)
-    return df_clean
+    index = index if index is not None else build_row_index(df if subset is None else df[subset])
+    return df[~duplicate_mask(index, subset)]  # boolean indexing makes the only copy
+
+def _hash_column(series):
+    '''hash the values of a column, ignoring the index'''
+    if pd.api.types.is_float_dtype(series):
+        series = series + 0.0  # -0.0 and 0.0 are equal values but hash differently
+    return pd.util.hash_pandas_object(series, index=False).to_numpy()
+
+def _combine_hashes(column_hashes):
+    '''combine per-column hashes into one hash per row (same scheme as pandas)'''
+    if not column_hashes:
+        return np.zeros(0, dtype='uint64')
+    combined = np.full(len(column_hashes[0]), 0x345678, dtype='uint64')
+    multiplier = np.uint64(1000003)
+    for position, hashes in enumerate(column_hashes):
+        combined = (combined ^ hashes) * multiplier
+        multiplier += np.uint64(82520 + 2 * (len(column_hashes) - position))
+    return combined + np.uint64(97531)
 
 #function to count number of missing values in dataframe
 
+@timed()
 def get_total_missing_values(df):
     '''return the number of missing values in the data set'''
-    return df.isna().sum().sum()
+    return get_missing_values_by_feature(df).sum()
 
 #function to count number of missing values in each column of dataframe
 
+@timed()
 def get_missing_values_by_feature(df):
-    '''return the number of missing values in each column of the data set'''
-    return df.isna().sum()
+    '''return the number of missing values in each column of the data set, counted on blocks of columns in parallel'''
+    counts = map_column_blocks(lambda start, stop: df.iloc[:, start:stop].isna().sum(), len(df), df.shape[1])
+    return pd.concat(counts) if len(counts) > 1 else counts[0]
 
+@timed()
 def fill_missing_values(df, fill_method, fill_feature, fill_value):
     '''fill missing values in the data set'''
-    if fill_method == "Fill with mean":
-        df[fill_feature] = df[fill_feature].fillna(df[fill_feature].mean())
-    elif fill_method == "Fill with median":
-        df[fill_feature] = df[fill_feature].fillna(df[fill_feature].median())
-    elif fill_method == "Fill with mode":
-        df[fill_feature] = df[fill_feature].fillna(df[fill_feature].mode()[0])
-    elif fill_method == "Fill with custom value":
-        df[fill_feature] = df[fill_feature].fillna(fill_value)
+    df[fill_feature] = impute_missing_values(df, {fill_feature: {'method': fill_method, 'value': fill_value}})[fill_feature]
     return df
 
+#function to fill the missing values of many columns in one pass
+
+@timed()
+def impute_missing_values(df, strategies, progress_callback=None):
+    """
+    Fill the missing values of several columns at once
+
+    Each kind of statistic is computed once for all the columns that need it
+    (one grouped pass per group key), and the float columns are filled on
+    blocks of columns instead of with one fillna per column. The blocks of
+    wide frames are filled in parallel.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame to fill
+        strategies (dict): Mapping of column name to a strategy, a dict with
+            'method' (one of FILL_METHODS), 'value' (the custom value) and
+            optionally 'by', a key column whose groups the mean or median is
+            computed within. Missing values in groups that have no statistic
+            (or rows without a key) get the whole column's statistic.
+        progress_callback (callable, optional): Called with the fraction done
+            (0 to 1) after each statistic and each block of filled columns
+
+    Returns:
+        pandas.DataFrame: A copy of df with the columns filled (only the filled
+        columns are copied)
+    """
+    scalars, grouped = compute_fill_values(df, strategies, progress_range(progress_callback, 0.0, 0.5))
+    new_df = df.copy(deep=False)
+    floats = {}
+    for col in scalars:
+        # float columns filled with a number are filled on a block, anything else goes through fillna
+        if isinstance(df[col].dtype, np.dtype) and df[col].dtype.kind == 'f' and pd.api.types.is_number(scalars[col]):
+            floats.setdefault(df[col].dtype, []).append(col)
+
+    for number, columns in enumerate(floats.values()):
+        def fill_block(start, stop, columns=columns):
+            block_columns = columns[start:stop]
+            block = df[block_columns].to_numpy().T.copy()  # one row per column, so every column is contiguous
+            missing = np.isnan(block)
+            np.copyto(block, np.array([[scalars[col]] for col in block_columns], dtype=block.dtype), where=missing)
+            for by, (positions, table) in grouped.items():
+                at = [position for position, col in enumerate(block_columns) if col in table.columns]
+                if not at:
+                    continue
+                # only the missing cells of the grouped columns are looked up
+                cols, rows = np.nonzero(missing[at])
+                values = table[[block_columns[position] for position in at]].to_numpy(dtype=block.dtype)[positions[rows], cols]
+                found = ~np.isnan(values)  # cells whose group has no statistic keep the column's statistic
+                block[np.asarray(at)[cols[found]], rows[found]] = values[found]
+            return block
+
+        fill_progress = progress_range(progress_callback, 0.5 + 0.5 * number / len(floats), 0.5 + 0.5 * (number + 1) / len(floats))
+        filled = [values for block in map_column_blocks(fill_block, len(df), len(columns), progress_callback=fill_progress)
+                  for values in block]
+        for col, values in zip(columns, filled):
+            new_df[col] = values
+
+    other = [col for col in scalars if not any(col in columns for columns in floats.values())]
+    if other:
+        block = {}
+        for col in other:
+            series = df[col]
+            for by, (positions, table) in grouped.items():
+                if col in table.columns:
+                    series = series.fillna(pd.Series(table[col].to_numpy()[positions], index=df.index))
+            if isinstance(series.dtype, pd.CategoricalDtype) and scalars[col] not in series.cat.categories:
+                series = series.cat.add_categories([scalars[col]])  # a categorical can only be filled with one of its categories
+            block[col] = series
+        new_df[other] = pd.DataFrame(block, index=df.index).fillna(scalars)
+    return new_df
+
+#function to work out the value each missing value is filled with
+
+def compute_fill_values(df, strategies, progress_callback=None):
+    """
+    Compute the fill values of several columns, one call per kind of statistic
+
+    Args:
+        df (pandas.DataFrame): The DataFrame to fill
+        strategies (dict): Mapping of column name to a strategy (see impute_missing_values)
+        progress_callback (callable, optional): Called with the fraction of kinds
+            of statistic done (0 to 1) after each one
+
+    Returns:
+        tuple: A dict of column name to its fill value, and a dict of group key to
+        (position of each row's group, DataFrame of the group statistics with
+        one row per group and a last row of NaN for rows without a group)
+    """
+    by_kind = {}
+    for col, strategy in strategies.items():
+        if col not in df.columns:
+            continue
+        method, by = strategy['method'], strategy.get('by')
+        if method not in FILL_METHODS:
+            raise ValueError(f"unknown fill method: {method}")
+        if method in GROUP_FILL_METHODS and not (pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])):
+            raise ValueError(f"{method} needs a numeric column, {col} is {df[col].dtype}")
+        by = by if method in GROUP_FILL_METHODS and by in df.columns and by != col else None
+        by_kind.setdefault((method, by), []).append(col)
+
+    scalars, grouped = {}, {}
+    for number, ((method, by), columns) in enumerate(by_kind.items()):
+        if method == "Fill with custom value":
+            scalars.update({col: strategies[col]['value'] for col in columns if pd.notna(strategies[col].get('value'))})
+        elif method == "Fill with mode":
+            for col in columns:
+                mode = df[col].mode()
+                if len(mode):
+                    scalars[col] = mode.iloc[0]
+        else:
+            statistic = GROUP_FILL_METHODS[method]
+            # one reduction per block of columns, the blocks of wide frames run in parallel
+            overall = pd.concat(map_column_blocks(lambda start, stop: _column_statistic(df[columns[start:stop]], statistic),
+                                                  len(df), len(columns),
+                                                  progress_callback=progress_range(progress_callback, number / len(by_kind),
+                                                                                   (number + 1) / len(by_kind))))
+            scalars.update(overall.dropna())
+            if by is not None:
+                # one grouped pass for every column filled by the same key and statistic
+                table = getattr(df[columns].groupby(df[by], sort=False, observed=True), statistic)()
+                positions = table.index.get_indexer(df[by])
+                table = pd.concat([table.reset_index(drop=True), pd.DataFrame(np.nan, index=[len(table)], columns=columns)])
+                positions[positions < 0] = len(table) - 1
+                if by in grouped:
+                    table = pd.concat([grouped[by][1], table], axis=1)
+                grouped[by] = (positions, table)
+        if progress_callback is not None:
+            progress_callback((number + 1) / len(by_kind))
+    return scalars, grouped
+
+def _column_statistic(df, statistic):
+    '''return the mean (on a float block, as in profile_columns) or median of every column'''
+    if statistic == "median":
+        return df.median()
+    block = df.to_numpy(dtype='float64', na_value=np.nan)
+    missing = np.isnan(block)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.Series(np.where(missing, 0.0, block).sum(axis=0) / (~missing).sum(axis=0), index=df.columns)
+
 #--------------------------------OUTLIER HANDLING--------------------------------
 
+#function to compute outlier scores for all numeric features at once
+
+@timed()
+def compute_outlier_scores(df, columns=None, stats=None, progress_callback=None):
+    """
+    Score every value of the numeric features for both outlier methods in one pass
+
+    The scores are threshold-independent, so they can be cached and compared
+    against any threshold without scanning the data again:
+
+    * z-score: ``|x - mean| / std``
+    * IQR: how many interquartile ranges ``x`` lies outside ``[Q1, Q3]`` (0 inside)
+
+    Args:
+        df (pandas.DataFrame): The DataFrame to score
+        columns (list, optional): The features to score (defaults to all numerical features)
+        stats (pandas.DataFrame, optional): Per-column statistics with 'mean' and
+            'std' (such as the dataset profile), reused instead of recomputed
+        progress_callback (callable, optional): Called with the fraction of
+            blocks of features scored (0 to 1)
+
+    Returns:
+        dict: 'columns' (scored features), 'zscore' and 'iqr' (float32 arrays of
+        shape rows x features, NaN for missing values), 'lower' and 'upper'
+        (the Q1 and Q3 of each feature)
+    """
+    columns = get_numerical_features(df) if columns is None else list(columns)
+    zscore = np.empty((len(df), len(columns)), dtype='float32')
+    iqr_score = np.empty((len(df), len(columns)), dtype='float32')
+    q1 = np.full(len(columns), np.nan)
+    q3 = np.full(len(columns), np.nan)
+    if stats is not None:
+        mean = stats.loc[columns, 'mean'].to_numpy(dtype='float64')
+        std = stats.loc[columns, 'std'].to_numpy(dtype='float64')
+    else:
+        mean = std = None
+
+    def score_block(start, stop):
+        # every block writes its own columns of the score arrays
+        block = df[columns[start:stop]].to_numpy(dtype='float64', na_value=np.nan)
+        # all-NaN features just get NaN scores, the nan_ statistics do not warn (see parallel_functions)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if mean is not None:
+                block_mean, block_std = mean[start:stop], std[start:stop]
+            else:
+                block_mean, block_std = nan_mean_std(block, ddof=1)
+            zscore[:, start:stop] = np.abs(block - block_mean) / block_std
+
+            q1[start:stop], q3[start:stop] = nan_percentiles(block, [25, 75])
+            iqr = q3[start:stop] - q1[start:stop]
+            distance = np.maximum(q1[start:stop] - block, block - q3[start:stop])
+            iqr_score[:, start:stop] = np.where(np.isnan(block), np.nan, np.where(distance > 0, distance / iqr, 0.0))
+
+    map_column_blocks(score_block, len(df), len(columns), progress_callback=progress_callback)
+    return {'columns': columns, 'zscore': zscore, 'iqr': iqr_score, 'lower': q1, 'upper': q3}
+
+#function to flag outliers from precomputed scores
+
+@timed()
+def outlier_mask(scores, threshold, method="zscore", features=None):
+    """
+    Flag outliers by comparing cached scores against a threshold
+
+    Args:
+        scores (dict): The result of compute_outlier_scores
+        threshold (float): z-score threshold, or IQR multiplier (usually 1.5)
+        method (str): "zscore" or "iqr"
+        features (list, optional): Only flag outliers in these features
+
+    Returns:
+        numpy.ndarray: Boolean array of shape rows x features, True for outlying values
+    """
+    matrix = scores[method]
+    if features is not None:
+        matrix = matrix[:, [scores['columns'].index(feature) for feature in features]]
+    return matrix > threshold
+
 #function to count number of outliers in dataframe feature
 
-def count_outliers(df, feature, threshold):
+@timed()
+def count_outliers(df, feature, threshold, method="zscore", scores=None):
     '''return the number of outliers in the data set'''
-    z_scores = (df[feature] - df[feature].mean()) / df[feature].std()
-    return (z_scores > threshold).sum()
+    scores = scores if scores is not None else compute_outlier_scores(df, [feature])
+    return int(outlier_mask(scores, threshold, method, [feature]).sum())
 
 #function to remove outliers from dataframe feature
 
-def remove_outliers(df, feature, threshold):
-    '''remove outliers from the data set'''
-    z_scores = (df[feature] - df[feature].mean()) / df[feature].std()
-    df_clean = df.copy()  # Create a copy of the DataFrame
-    df_clean = df_clean[z_scores <= threshold]
-    return df_clean
+@timed()
+def remove_outliers(df, feature, threshold, method="zscore", scores=None):
+    '''remove outliers from the data set, a feature can be a single column or a list of columns'''
+    features = [feature] if isinstance(feature, str) else list(feature)
+    scores = scores if scores is not None else compute_outlier_scores(df, features)
+    rows = outlier_mask(scores, threshold, method, features).any(axis=1)
+    return df[~rows]  # boolean indexing makes the only copy
 
 #function to copy rows with outliers to a new dataframe
 
-def get_outliers(df, feature, threshold):
+@timed()
+def get_outliers(df, feature, threshold, method="zscore", scores=None):
     '''return the rows with outliers in the data set'''
-    z_scores = (df[feature] - df[feature].mean()) / df[feature].std()
-    return df[z_scores > threshold]
+    scores = scores if scores is not None else compute_outlier_scores(df, [feature])
+    return df[outlier_mask(scores, threshold, method, [feature])[:, 0]]
 
 #function that returns the location of the outliers in the dataframe, their value and their z-scores
 #as a table for display
 
-def get_outliers_table(df, feature, threshold):
+@timed()
+def get_outliers_table(df, feature, threshold, method="zscore", scores=None):
     '''return the location of the outliers in the data set, their value and their z-scores'''
-    z_scores = (df[feature] - df[feature].mean()) / df[feature].std()
-    outliers = df[z_scores > threshold]
-    outliers_table = outliers.assign(z_score=z_scores[z_scores > threshold])
-    return outliers_table
+    scores = scores if scores is not None else compute_outlier_scores(df, [feature])
+    rows = outlier_mask(scores, threshold, method, [feature])[:, 0]
+    position = scores['columns'].index(feature)
+    return df[rows].assign(z_score=scores['zscore'][rows, position],
+                           iqr_score=scores['iqr'][rows, position])
 
 #get all numerical features in the dataframe
 
+@timed()
 def get_numerical_features(df):
     '''return the numerical features in the data set'''
     return df.select_dtypes(include=[np.number]).columns.tolist()   
 
 #get all categorical features in the dataframe
 
+@timed()
 def get_categorical_features(df):
     '''return the categorical features in the data set'''
-    return df.select_dtypes(include=['object']).columns.tolist()
+    return df.select_dtypes(include=['object', 'category', 'string']).columns.tolist()
+
+#--------------------------------DATA PROFILE--------------------------------
 
+PROFILE_STATS = ['missing', 'mean', 'std', 'min', 'max', 'unique']
+
+#function to compute the statistics of several columns at once
+
+@timed()
+def profile_columns(df, columns=None):
+    """
+    Compute per-column statistics for a DataFrame in a single pass
 
+    The numeric columns are pulled into float64 blocks of columns and every
+    statistic is computed on those blocks, instead of scanning the frame once
+    per statistic. The blocks of wide frames are profiled in parallel.
 
+    Args:
+        df (pandas.DataFrame): The DataFrame to profile
+        columns (list, optional): Only profile these columns (defaults to all columns)
+
+    Returns:
+        pandas.DataFrame: One row per column with the missing count, mean, std,
+        min, max and number of unique values (mean/std/min/max are NaN for
+        non-numeric columns)
+    """
+    columns = df.columns.tolist() if columns is None else [col for col in columns if col in df.columns]
+    profile = pd.DataFrame(np.nan, index=pd.Index(columns, dtype=object), columns=PROFILE_STATS)
+    numeric = [col for col in columns
+               if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])]
+
+    if numeric:
+        stats = np.vstack(map_column_blocks(lambda start, stop: _numeric_stats(df[numeric[start:stop]]),
+                                            len(df), len(numeric)))
+        for position, stat in enumerate(['missing', 'mean', 'std', 'min', 'max']):
+            profile.loc[numeric, stat] = stats[:, position]
+
+    other = [col for col in columns if col not in numeric]
+    if other:
+        profile.loc[other, 'missing'] = df[other].isna().sum().to_numpy()
+    profile['unique'] = [df[col].nunique() for col in columns]
+    profile['missing'] = profile['missing'].astype('int64')
+    return profile
+
+def _numeric_stats(df):
+    '''return the missing count, mean, std, min and max of numeric columns, one row per column'''
+    block = df.to_numpy(dtype='float64', na_value=np.nan)
+    missing = np.isnan(block)
+    count = len(block) - missing.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(missing, 0.0, block).sum(axis=0) / count
+        centered = np.where(missing, 0.0, block - mean)
+        std = np.sqrt((centered * centered).sum(axis=0) / (count - 1))
+    return np.column_stack([
+        len(block) - count,
+        mean,
+        np.where(count > 1, std, np.nan),
+        np.where(count > 0, np.where(missing, np.inf, block).min(axis=0, initial=np.inf), np.nan),
+        np.where(count > 0, np.where(missing, -np.inf, block).max(axis=0, initial=-np.inf), np.nan),
+    ])
+
+#function to build the full profile of a dataframe
+
+@timed()
+def profile_dataframe(df, row_index=None):
+    """
+    Build the profile shown on the preprocessing page
+
+    Args:
+        df (pandas.DataFrame): The DataFrame to profile
+        row_index (dict, optional): A row index of df, used to count duplicates
+
+    Returns:
+        dict: 'columns' (per-column statistics from profile_columns),
+        'duplicates' (number of duplicate rows) and 'rows' (number of rows)
+    """
+    return {
+        'columns': profile_columns(df),
+        'duplicates': count_duplicate_rows(df, index=row_index),
+        'rows': len(df),
+    }
+
+#function to update a profile after some columns of the dataframe were changed
+
+@timed()
+def refresh_profile(df, profile, changed_columns, row_index=None):
+    """
+    Update a profile after a transformation that only changed some columns
+
+    Statistics of untouched columns are reused. The duplicate count depends on
+    every column, so it is always recomputed.
+
+    Args:
+        df (pandas.DataFrame): The transformed DataFrame
+        profile (dict): The profile of the DataFrame before the transformation
+        changed_columns (list): The columns the transformation touched
+        row_index (dict, optional): A row index of df, used to count duplicates
+
+    Returns:
+        dict: The updated profile
+    """
+    if len(df) != profile['rows'] or list(df.columns) != profile['columns'].index.tolist():
+        return profile_dataframe(df, row_index)
+    stats = profile['columns'].copy()
+    changed = [col for col in changed_columns if col in df.columns]
+    if changed:
+        stats.loc[changed] = profile_columns(df, changed)
+    stats['missing'] = stats['missing'].astype('int64')
+    return {
+        'columns': stats,
+        'duplicates': count_duplicate_rows(df, index=row_index),
+        'rows': len(df),
+    }
 
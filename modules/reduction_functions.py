@@ -0,0 +1,307 @@
+# ------Description: This file contains functions for finding redundant features and reducing the number of features with PCA------
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from modules.parallel_functions import map_column_blocks, progress_range, nan_mean_std
+from modules.timing_functions import timed
+
+CORR_THRESHOLD = 0.98             # features correlated at least this much are near-duplicates
+CORR_SAMPLE_ROWS = 20_000         # rows of the sample every pair of features is screened on
+CORR_SCREEN_MARGIN = 0.05         # pairs below threshold - margin on the sample are never checked on the full data
+CORR_BLOCK_COLUMNS = 256          # features correlated against all the others at a time, bounds the memory to 256 x features
+PCA_CHUNK_ROWS = 50_000           # rows standardized and multiplied at a time
+PCA_EXACT_MAX_COLUMNS = 500       # up to this many features the covariance matrix is built, above it PCA is randomized
+PCA_OVERSAMPLING = 10             # extra random directions of the randomized PCA
+PCA_POWER_ITERATIONS = 2          # passes sharpening the randomized PCA when the spectrum decays slowly
+
+# PCA and dropping features are plan steps (see pipeline_functions). PCA is
+# fitted on the data entering it, so it can be replayed on new data:
+#   {'op': 'drop_columns', 'columns': [...]}
+#   {'op': 'reduce', 'method': 'pca', 'columns': [...], 'n_components': int,
+#    'params': {'mean': [...], 'scale': [...], 'components': [[...], ...]}}
+
+#--------------------------------CORRELATION SCREENING--------------------------------
+
+#function to find pairs of features that are near-duplicates of each other
+
+@timed()
+def find_correlated_features(df, columns=None, threshold=CORR_THRESHOLD, sample_rows=CORR_SAMPLE_ROWS,
+                             margin=CORR_SCREEN_MARGIN):
+    """
+    Find pairs of numeric features whose correlation is at least threshold
+
+    Instead of a full df.corr(), every pair is first screened on a fixed row
+    sample, one block of features against all later features at a time (in
+    parallel for wide data). Constant features are pruned before the
+    screening, and only the pairs that come within margin of the threshold on
+    the sample get their exact correlation on the full data (on the rows where
+    both are present, as df.corr() does).
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        columns (list, optional): The features to screen, all numeric features by default
+        threshold (float): Smallest absolute correlation reported
+        sample_rows (int): Rows of the screening sample
+        margin (float): How far below threshold a pair may be on the sample and still be checked
+
+    Returns:
+        pandas.DataFrame: One row per correlated pair with 'feature', 'duplicate of'
+        and 'correlation', ordered by the position of the features
+    """
+    if columns is None:
+        columns = [col for col in df.columns
+                   if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])]
+    positions = np.sort(np.random.default_rng(0).choice(len(df), size=min(len(df), sample_rows), replace=False))
+    sample = df.iloc[positions][columns].to_numpy(dtype='float64', na_value=np.nan)
+    present = ~np.isnan(sample)
+    mean, std = nan_mean_std(sample)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # standardized so that Z.T @ Z / rows is the correlation matrix of the sample, missing values count as 0
+        sample = np.nan_to_num((sample - mean) / std)
+    varying = np.flatnonzero(np.isfinite(std) & (std > 0))  # constant features correlate with nothing
+    sample = np.ascontiguousarray(sample[:, varying], dtype='float32')
+    present = np.ascontiguousarray(present[:, varying], dtype='float32') if not present.all() else None
+
+    def screen_block(start, stop):
+        pairs = []
+        for block_start in range(start, stop, CORR_BLOCK_COLUMNS):
+            block_stop = min(block_start + CORR_BLOCK_COLUMNS, stop)
+            correlations = sample[:, block_start:block_stop].T @ sample[:, block_start:]
+            if present is None:
+                correlations /= len(sample)
+            else:
+                # divide by the rows where both features are present, not all rows
+                correlations /= np.maximum(present[:, block_start:block_stop].T @ present[:, block_start:], 1)
+            rows, cols = np.nonzero(np.abs(correlations) >= threshold - margin)
+            later = rows < cols  # each pair once, never a feature with itself
+            pairs.extend(zip(block_start + rows[later], block_start + cols[later]))
+        return pairs
+
+    candidates = [pair for block in map_column_blocks(screen_block, len(sample), len(varying)) for pair in block]
+    found = []
+    for first, second in candidates:
+        a, b = columns[varying[first]], columns[varying[second]]
+        correlation = _pair_correlation(df[a], df[b])
+        if abs(correlation) >= threshold:
+            found.append({'feature': b, 'duplicate of': a, 'correlation': correlation})
+    return pd.DataFrame(found, columns=['feature', 'duplicate of', 'correlation'])
+
+#function to pick the features to drop so no near-duplicate pair is left
+
+def suggest_drops(pairs):
+    '''return the features to drop, keeping the first feature of every group of near-duplicates'''
+    dropped = []
+    for feature, duplicate_of in zip(pairs['feature'], pairs['duplicate of']):
+        if duplicate_of not in dropped and feature not in dropped:
+            dropped.append(feature)
+    return dropped
+
+def _pair_correlation(x, y):
+    '''return the Pearson correlation of two columns on the rows where both are present'''
+    x = x.to_numpy(dtype='float64', na_value=np.nan)
+    y = y.to_numpy(dtype='float64', na_value=np.nan)
+    present = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[present] - x[present].mean(), y[present] - y[present].mean()
+    denominator = np.sqrt((x * x).sum() * (y * y).sum())
+    return float((x * y).sum() / denominator) if denominator > 0 else 0.0
+
+#--------------------------------PCA--------------------------------
+
+#function to fit a principal component analysis one chunk of rows at a time
+
+@timed()
+def fit_pca(df, columns, n_components, method="auto", chunk_rows=PCA_CHUNK_ROWS, random_state=0, progress_callback=None):
+    """
+    Fit a PCA of standardized features without holding the standardized data in memory
+
+    The data is read in chunks of rows. With the "incremental" method the
+    covariance matrix is accumulated chunk by chunk and decomposed exactly,
+    which needs features x features memory. With the "randomized" method
+    (Halko et al.) the data is multiplied by a few random directions per pass,
+    which needs rows x (n_components + PCA_OVERSAMPLING) memory and suits
+    thousands of features. "auto" picks incremental up to PCA_EXACT_MAX_COLUMNS
+    features. Missing values count as the mean of their feature.
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        columns (list): The numeric features to reduce
+        n_components (int): Number of principal components to keep
+        method (str): "auto", "incremental" or "randomized"
+        chunk_rows (int): Rows read at a time
+        random_state (int): Seed of the random directions
+        progress_callback (callable, optional): Called with the fraction of
+            chunks read (0 to 1) before each chunk of every pass
+
+    Returns:
+        dict: 'mean' and 'scale' (the standardization), 'components' (one list of
+        feature weights per component), 'explained_variance' and
+        'explained_variance_ratio' (one value per component)
+    """
+    n_components = max(1, min(n_components, len(columns), len(df)))
+    exact = method == "incremental" or (method == "auto" and len(columns) <= PCA_EXACT_MAX_COLUMNS)
+    # passes over the data: two for the standardization, one for the total variance, then the method's own
+    n_passes = 3 + (1 if exact else 2 + 2 * PCA_POWER_ITERATIONS)
+    n_chunks = max(1, -(-len(df) // chunk_rows))
+    mean, scale = _standardization(df, columns, chunk_rows, progress_range(progress_callback, 0.0, 2 / n_passes))
+    read = [2 * n_chunks]
+
+    def chunks():
+        for chunk in _standardized_chunks(df, columns, mean, scale, chunk_rows):
+            if progress_callback is not None:
+                progress_callback(min(read[0] / (n_passes * n_chunks), 1.0))
+            read[0] += 1
+            yield chunk
+
+    total_variance = sum(float((chunk * chunk).sum()) for chunk in chunks()) / max(len(df) - 1, 1)
+
+    if exact:
+        covariance = np.zeros((len(columns), len(columns)))
+        for chunk in chunks():
+            covariance += chunk.T @ chunk
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:n_components]
+        components = eigenvectors[:, order].T
+        variance = np.maximum(eigenvalues[order], 0.0) / max(len(df) - 1, 1)
+    else:
+        rng = np.random.default_rng(random_state)
+        directions = rng.standard_normal((len(columns), min(n_components + PCA_OVERSAMPLING, len(columns))))
+        basis = _orthonormal(np.vstack([chunk @ directions for chunk in chunks()]))
+        for _ in range(PCA_POWER_ITERATIONS):
+            # X.T @ Q and X @ (X.T @ Q), both one pass over the chunks
+            directions = _orthonormal(_chunked_transpose_product(chunks(), basis, chunk_rows))
+            basis = _orthonormal(np.vstack([chunk @ directions for chunk in chunks()]))
+        projection = _chunked_transpose_product(chunks(), basis, chunk_rows).T  # Q.T @ X, small
+        _, singular_values, components = np.linalg.svd(projection, full_matrices=False)
+        components = components[:n_components]
+        variance = singular_values[:n_components] ** 2 / max(len(df) - 1, 1)
+
+    # the sign of a component is arbitrary, make its largest weight positive so refits agree
+    signs = np.sign(components[np.arange(len(components)), np.abs(components).argmax(axis=1)])
+    components = components * np.where(signs == 0, 1.0, signs)[:, None]
+    return {'mean': mean.tolist(), 'scale': scale.tolist(), 'components': components.tolist(),
+            'explained_variance': variance.tolist(),
+            'explained_variance_ratio': (variance / total_variance if total_variance > 0 else variance * 0).tolist()}
+
+#function to project features onto fitted principal components
+
+def pca_scores(df, columns, params, chunk_rows=PCA_CHUNK_ROWS, progress_callback=None):
+    '''return the float32 principal component scores of every row, computed one chunk of rows at a time,
+    calling progress_callback (if given) with the fraction of rows done after each chunk'''
+    components = np.asarray(params['components']).T
+    mean, scale = np.asarray(params['mean']), np.asarray(params['scale'])
+    scores = np.empty((len(df), components.shape[1]), dtype='float32')
+    for start, chunk in zip(range(0, len(df), chunk_rows), _standardized_chunks(df, columns, mean, scale, chunk_rows)):
+        scores[start:start + len(chunk)] = chunk @ components
+        if progress_callback is not None:
+            progress_callback((start + len(chunk)) / len(df))
+    return scores
+
+def _standardization(df, columns, chunk_rows, progress_callback=None):
+    '''return the mean and standard deviation of every feature, accumulated over chunks of rows
+    (two passes, progress_callback is called with the fraction of both done after each chunk)'''
+    positions = df.columns.get_indexer(columns)
+    count = np.zeros(len(columns))
+    total = np.zeros(len(columns))
+    squares = np.zeros(len(columns))
+    for start in range(0, len(df), chunk_rows):
+        chunk = _row_chunk(df, positions, start, chunk_rows)
+        present = ~np.isnan(chunk)
+        count += present.sum(axis=0)
+        total += np.where(present, chunk, 0.0).sum(axis=0)
+        if progress_callback is not None:
+            progress_callback(min(start + chunk_rows, len(df)) / (2 * len(df)))
+    mean = np.divide(total, count, out=np.zeros(len(columns)), where=count > 0)
+    for start in range(0, len(df), chunk_rows):
+        chunk = _row_chunk(df, positions, start, chunk_rows)
+        deviations = np.nan_to_num(chunk - mean)
+        squares += (deviations * deviations).sum(axis=0)
+        if progress_callback is not None:
+            progress_callback(0.5 + min(start + chunk_rows, len(df)) / (2 * len(df)))
+    std = np.sqrt(np.divide(squares, count - 1, out=np.zeros(len(columns)), where=count > 1))
+    return mean, np.where(std > 0, std, 1.0)
+
+def _standardized_chunks(df, columns, mean, scale, chunk_rows):
+    '''yield chunks of standardized rows, missing values as 0 (the mean)'''
+    positions = df.columns.get_indexer(columns)
+    for start in range(0, len(df), chunk_rows):
+        chunk = _row_chunk(df, positions, start, chunk_rows)
+        yield np.nan_to_num((chunk - mean) / scale)
+
+def _row_chunk(df, positions, start, chunk_rows):
+    '''return rows start to start + chunk_rows of the columns at positions as float64, missing values as NaN'''
+    # the row slice is a view, so only the chunk is copied, df[columns] or iloc[rows, positions] copy whole columns
+    return df.iloc[start:start + chunk_rows].iloc[:, positions].to_numpy(dtype='float64', na_value=np.nan)
+
+def _chunked_transpose_product(chunks, basis, chunk_rows):
+    '''return X.T @ basis, accumulated over the chunks of X and the matching rows of basis'''
+    product = None
+    for start, chunk in zip(range(0, len(basis), chunk_rows), chunks):
+        part = chunk.T @ basis[start:start + len(chunk)]
+        product = part if product is None else product + part
+    return product
+
+def _orthonormal(matrix):
+    '''return an orthonormal basis of the columns of matrix'''
+    return np.linalg.qr(matrix)[0]
+
+#--------------------------------PLAN STEPS--------------------------------
+
+#function to fit a reduce step on the data entering it
+
+def fit_reduction(df, step, progress_callback=None):
+    '''return the reduce step with the PCA fitted on df and the names of its components'''
+    params = fit_pca(df, step['columns'], step['n_components'], progress_callback=progress_callback)
+    names = component_names([col for col in df.columns if col not in step['columns']], len(params['components']))
+    return {**step, 'params': {**{key: params[key] for key in ('mean', 'scale', 'components')}, 'names': names}}
+
+#function to name the components of a PCA without reusing a column name
+
+def component_names(existing, n_components):
+    '''return PC1..PCn, or PCA2_PC1.. (PCA3_, ...) when one of them is already a column of existing'''
+    existing = set(existing)
+    for number in itertools.count(1):
+        prefix = "PC" if number == 1 else f"PCA{number}_PC"
+        names = [f"{prefix}{component}" for component in range(1, n_components + 1)]
+        if existing.isdisjoint(names):
+            return names
+
+#function to replace features by their principal components
+
+@timed()
+def apply_reduction(df, step, progress_callback=None):
+    """
+    Replace the features of a fitted reduce step by their principal components
+
+    Args:
+        df (pandas.DataFrame): The data to reduce
+        step (dict): A fitted reduce step
+        progress_callback (callable, optional): Called with the fraction of
+            rows projected (0 to 1) after each chunk of rows
+
+    Returns:
+        tuple: The reduced DataFrame, with float32 columns named by the step
+        (PC1, PC2, ... unless taken) in place of the features, and the list of the new columns
+    """
+    scores = pca_scores(df, step['columns'], step['params'], progress_callback=progress_callback)
+    names = step['params'].get('names') or [f"PC{number}" for number in range(1, scores.shape[1] + 1)]
+    new_df = df.drop(columns=step['columns'])
+    for position, name in enumerate(names):
+        new_df[name] = scores[:, position]
+    return new_df, names
+
+#function to write a reduce or drop step as pandas code
+
+def reduction_code(step):
+    '''return the lines that replay a fitted reduce step or a drop step with pandas'''
+    if step['op'] == 'drop_columns':
+        return [f"df = df.drop(columns={step['columns']!r})"]
+    columns, params = step['columns'], step['params']
+    names = params.get('names') or [f"PC{number}" for number in range(1, len(params['components']) + 1)]
+    return [f"X = ((df[{columns!r}].astype('float64') - np.array({params['mean']!r})) / np.array({params['scale']!r})).fillna(0.0)",
+            f"scores = X.to_numpy() @ np.array({params['components']!r}).T",
+            f"df = df.drop(columns={columns!r})",
+            f"for number, name in enumerate({names!r}):",
+            "    df[name] = scores[:, number].astype('float32')"]
@@ -35,18 +35,13 @@ def switch_page(page_name: str):
 
 #------------------Download Functions--------------------------------
 
-#Function to prepare modified data frame for download
-
-def convert_df(df):
-# IMPORTANT: Cache the conversion to prevent computation on every rerun
-    return df.to_csv().encode('utf-8')
-
 #Function to prepare pynb notebook for download
 
-def convert_actions_to_pnyb(actions):
+def convert_actions_to_pnyb(actions, pnyb_file="actions.pnyb"):
     """
     Convert a list of actions to a .pnyb file
     """
+    import nbformat as nbf
     # Create a new notebook
     nb = nbf.v4.new_notebook()
     # Add a markdown cell
@@ -55,7 +50,6 @@ def convert_actions_to_pnyb(actions):
     for action in actions:
         nb['cells'].append(nbf.v4.new_code_cell(action))
     # Write to a .pnyb file
-    pnyb_file = "actions.pnyb"
     nbf.write(nb, pnyb_file)
     return pnyb_file
 
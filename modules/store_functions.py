@@ -0,0 +1,884 @@
+# ------Description: This file contains functions for storing the session's dataset on local disk------
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+import streamlit as st
+from streamlit.logger import get_logger
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from modules.preproc_functions import (profile_dataframe, refresh_profile, compute_outlier_scores,
+                                       build_row_index, filter_row_index, refresh_row_index)
+from modules.history_functions import make_delta, delta_changes, apply_delta, replay_deltas, delta_nbytes
+from modules.pipeline_functions import apply_plan, describe_plan, get_preview_sample
+from modules.export_functions import export_dataframe, EXPORT_FORMATS
+from modules.job_functions import submit_job
+from modules.training_functions import run_training, remove_training_arrays, describe_candidate
+from modules.memory_functions import SessionCache, register_session_cache, enforce_memory_budget
+from modules.timing_functions import timer, timed
+
+STORE_ROOT = os.environ.get("TADA_STORE_DIR", os.path.join(tempfile.gettempdir(), "tada_store"))
+STORE_MAX_AGE_HOURS = 12          # session folders untouched for longer than this are removed
+MAX_TRACKED_CHANGES = 50          # number of versions whose changed columns are remembered
+SHARED_CACHE_DIR = "shared"       # folder in STORE_ROOT for caches shared by all sessions
+UPLOAD_CACHE_MAX_BYTES = int(os.environ.get("TADA_UPLOAD_CACHE_MB", 2048)) * 1024 * 1024   # budget of the shared upload and workbook caches
+
+_shared_frames = {}               # read-only frame loaded from each cached upload and the number of session copies of it alive
+_shared_frames_lock = threading.RLock()   # reentrant, a copy can be collected (and released) while the lock is held
+_upload_cache_lock = threading.Lock()
+
+LOGGER = get_logger(__name__)
+
+#--------------------------------DATASET HANDLE--------------------------------
+
+class DatasetHandle:
+    """
+    Lightweight reference to one version of the session's dataset
+
+    The data itself lives in an uncompressed Arrow (Feather v2) file that is
+    memory-mapped when loaded, so numeric columns are read straight from the
+    page cache and shared between reruns instead of being copied into every
+    session's state. Sessions that uploaded the same file hold hard links to
+    one cached file and share the arrays of the frame loaded from it.
+    """
+
+    def __init__(self, path, version, shape, columns, nbytes, shared_key=None):
+        self.path = path
+        self.version = version
+        self.shape = shape
+        self.columns = columns
+        self.nbytes = nbytes
+        self.shared_key = shared_key
+        self._frame_ref = None
+
+    @property
+    def empty(self):
+        return self.shape[0] == 0 or self.shape[1] == 0
+
+    @property
+    def loaded(self):
+        '''True while a frame loaded from the file is still held somewhere'''
+        return self._frame_ref is not None and self._frame_ref() is not None
+
+    @property
+    def frame_key(self):
+        '''identifies the memory of the loaded frame, the same for every session sharing a cached upload'''
+        return self.shared_key or self.path
+
+    def load(self):
+        """
+        Return the dataset as a DataFrame backed by the memory-mapped file
+
+        While a caller still holds the returned frame, later calls hand back the
+        same object instead of mapping the file again. Handles of a shared
+        upload get their own shallow copy of the frame another session loaded
+        from it: adding or replacing columns only changes the session's copy,
+        and the shared arrays are read-only, so writing into them raises.
+
+        Returns:
+            pandas.DataFrame: The dataset (columns without nulls are read-only views)
+        """
+        df = self._frame_ref() if self._frame_ref is not None else None
+        if df is None:
+            df = self._load_shared() if self.shared_key is not None else self._read()
+            self._frame_ref = weakref.ref(df)
+        return df
+
+    def _read(self):
+        '''return a new frame memory-mapped from the file'''
+        with timer("load dataset", rows=self.shape[0]):
+            table = feather.read_table(self.path, memory_map=True)
+            return _arrow_strings(table, table.to_pandas(split_blocks=True))
+
+    def _load_shared(self):
+        '''return a shallow copy of the shared frame of the cached upload, loading it if no session holds it'''
+        with _shared_frames_lock:
+            entry = _shared_frames.get(self.shared_key)
+            if entry is None:
+                entry = _shared_frames[self.shared_key] = [_read_only(self._read()), 0]
+            entry[1] += 1
+            df = entry[0].copy(deep=False)
+        # the shared frame is kept while any session's copy of it is alive
+        weakref.finalize(df, _release_shared_frame, self.shared_key, entry)
+        return df
+
+def _read_only(df):
+    '''make the NumPy arrays behind df read-only (memory-mapped columns already are) and return df'''
+    for values in df._mgr.arrays:  # the block arrays themselves, views of them keep their own flag
+        if isinstance(values, np.ndarray):
+            values.flags.writeable = False
+    return df
+
+def _release_shared_frame(key, entry):
+    '''forget a session's copy of a shared frame, dropping the frame when it was the last one'''
+    with _shared_frames_lock:
+        entry[1] -= 1
+        if entry[1] == 0 and _shared_frames.get(key) is entry:
+            del _shared_frames[key]
+
+def _arrow_strings(table, df):
+    '''turn the string columns back into Arrow-backed strings, pandas reads them as Python strings'''
+    for position, column in enumerate((table.schema.pandas_metadata or {}).get('columns', [])[:df.shape[1]]):
+        if column.get('numpy_type') == 'string':
+            # wraps the memory-mapped column instead of copying every string into a Python object
+            df.isetitem(position, pd.arrays.ArrowStringArray(table.column(position)))
+    return df
+
+#--------------------------------SESSION STORE--------------------------------
+
+#function to get the id of the current session
+
+def get_session_id():
+    '''return the id of the session running the script, or "local" outside a Streamlit session'''
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "local"
+
+#function to get (and create) the folder holding the current session's dataset
+
+def get_store_dir():
+    '''return the folder used to store the current session's dataset'''
+    store_dir = os.path.join(STORE_ROOT, get_session_id())
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir, exist_ok=True)
+        remove_stale_sessions()
+    return store_dir
+
+#function to remove the folders of sessions that have not been touched for a while
+
+def remove_stale_sessions(max_age_hours=STORE_MAX_AGE_HOURS):
+    '''delete stored datasets of sessions, and shared cache entries, that have been idle for longer than max_age_hours'''
+    cutoff = time.time() - max_age_hours * 3600
+    for entry in os.scandir(STORE_ROOT):
+        if entry.name == SHARED_CACHE_DIR:
+            stale = [item for cache in os.scandir(entry.path) if cache.is_dir() for item in os.scandir(cache.path)
+                     if item.stat().st_mtime < cutoff]
+        else:
+            stale = [entry] if entry.is_dir() and entry.stat().st_mtime < cutoff else []
+        for item in stale:
+            if item.is_dir():
+                shutil.rmtree(item.path, ignore_errors=True)
+            else:
+                _remove_file(item.path)
+
+#function to get (and create) a folder for a cache shared by all sessions
+
+def get_shared_cache_dir(name):
+    '''return the folder of the shared cache called name, whose entries expire like idle sessions'''
+    cache_dir = os.path.join(STORE_ROOT, SHARED_CACHE_DIR, name)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+#function to write a dataframe to the session store
+
+@timed()
+def write_dataset(df, version):
+    """
+    Write a DataFrame to the session store as an uncompressed Arrow file
+
+    Args:
+        df (pandas.DataFrame): The DataFrame to store
+        version (int): The dataset version, used in the file name
+
+    Returns:
+        DatasetHandle: A handle to the stored dataset
+    """
+    path = os.path.join(get_store_dir(), f"v{version}.arrow")
+    feather.write_feather(df, path, compression="uncompressed")
+    return DatasetHandle(path, version, df.shape, df.columns.tolist(),
+                         int(df.memory_usage(deep=False).sum()))
+
+#--------------------------------SESSION STATE ACCESS--------------------------------
+
+#function to save a new version of the session's dataset
+
+@timed()
+def update_dataframe(new_df, changed_columns=None, kept_rows=None, description=None, steps=None):
+    """
+    Store a new version of the session's dataset and make it the current one
+
+    The previous version's file is removed. Frames that were loaded from it
+    stay valid because the mapping outlives the file.
+
+    Args:
+        new_df (pandas.DataFrame): The new version of the dataset
+        changed_columns (list, optional): The only columns that differ from the
+            previous version
+        kept_rows (numpy.ndarray, optional): Boolean mask over the previous
+            version's rows, when the new version dropped rows. If changed_columns
+            is given too, the columns were changed after the rows were dropped.
+        description (str, optional): Label of the step in the undo history
+        steps (list, optional): The plan steps that produced the new version,
+            exported with the notebook
+
+    Leave changed_columns and kept_rows as None when the change cannot be
+    described either way, so cached results are rebuilt from scratch and the
+    undo history restarts from the new version. A described change that
+    turns out to change nothing is not stored and adds no history step.
+
+    Returns:
+        pandas.DataFrame: The stored dataset, loaded back from disk
+    """
+    history = st.session_state.get('history')
+    if history is None or (changed_columns is None and kept_rows is None):
+        df = _store_version(new_df, None, None)
+        _reset_history()
+        return df
+
+    delta = make_delta(get_dataframe(), new_df, changed_columns, kept_rows, description)
+    if delta is None:
+        return get_dataframe()  # no rows dropped and the changed columns are equal, keep the current version
+    delta['steps'] = steps or []
+    # a new step discards the steps that were undone
+    del history['deltas'][history['position']:]
+    history['deltas'].append(delta)
+    history['position'] += 1
+    return _store_version(new_df, changed_columns, kept_rows)
+
+#function to write a new version and record what changed
+
+def _store_version(new_df, changed_columns, kept_rows):
+    '''write new_df as the next version, log the change and remove the previous version's file'''
+    handle = write_dataset(new_df, get_dataset_version() + 1)
+    return _set_current_version(handle, changed_columns, kept_rows)
+
+def _set_current_version(handle, changed_columns, kept_rows):
+    '''make a stored version the current one, log the change and remove the previous version's file'''
+    old_handle = st.session_state.get('dataset')
+    version = handle.version
+    st.session_state['dataset'] = handle
+    st.session_state['dataset_version'] = version
+    get_session_cache().dataset = handle
+    changes = st.session_state.setdefault('dataset_changes', {})
+    changes[version] = {
+        'columns': None if changed_columns is None else list(changed_columns),
+        'kept_rows': kept_rows,
+    }
+    for old_version in [v for v in changes if v <= version - MAX_TRACKED_CHANGES]:
+        del changes[old_version]
+    st.session_state['last_updated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if old_handle is not None and not _is_history_base(old_handle):
+        _remove_file(old_handle.path)
+    return handle.load()
+
+#function to get the session's current dataset
+
+def get_dataframe():
+    '''return the current dataset, or an empty DataFrame if nothing has been uploaded'''
+    handle = st.session_state.get('dataset')
+    if handle is None:
+        return pd.DataFrame()
+    return handle.load()
+
+#function to check whether the session has a non-empty dataset
+
+def has_dataframe():
+    '''return True if the session has a non-empty dataset, without loading it'''
+    handle = st.session_state.get('dataset')
+    return handle is not None and not handle.empty
+
+#function to get the version number of the current dataset
+
+def get_dataset_version():
+    '''return the version of the current dataset, which changes every time it is updated'''
+    return st.session_state.get('dataset_version', 0)
+
+#function to list the recorded changes between a past version and the current one
+
+def get_changes_since(version):
+    '''return the changes made after the given version in order, or None if any of them was not recorded'''
+    changes = st.session_state.get('dataset_changes', {})
+    versions = range(version + 1, get_dataset_version() + 1)
+    if any(v not in changes for v in versions):
+        return None
+    return [changes[v] for v in versions]
+
+#--------------------------------SHARED UPLOAD CACHE--------------------------------
+
+# Parsed uploads are cached as Arrow files named after a hash of the uploaded
+# bytes and the loading options. Sessions get a hard link to the cached file,
+# so one parsed copy is shared on disk, in the page cache and (through
+# DatasetHandle.load) in memory. Every change writes a new file in the
+# session's own folder, which is where a session's copy starts. A cached file
+# that sessions link to stays on disk whether or not the cache keeps it, so
+# it counts against the cache's budget and is only evicted once unused.
+
+#function to make an uploaded file the session's dataset, parsing it only if it is not cached
+
+@timed()
+def load_uploaded_dataset(digest, options, parse):
+    """
+    Make a parsed upload the session's dataset, sharing one parsed copy between sessions
+
+    Args:
+        digest (str): Hash of the uploaded bytes (see hash_file)
+        options (tuple): Hashable loading options that change the parsed result
+        parse (callable): Parses the upload into a DataFrame when it is not cached
+
+    Returns:
+        pandas.DataFrame: The session's new dataset
+    """
+    key = hashlib.blake2b(repr((digest, options)).encode(), digest_size=20).hexdigest()
+    cache_dir = get_shared_cache_dir("uploads")
+    cache_path = os.path.join(cache_dir, f"{key}.arrow")
+    version = get_dataset_version() + 1
+    path = os.path.join(get_store_dir(), f"v{version}.arrow")
+    while True:
+        try:
+            with _upload_cache_lock:
+                os.utime(cache_path)  # most recently used
+                _link_or_copy(cache_path, path)
+                evict_upload_cache()
+            break
+        except FileNotFoundError:
+            # not cached, or evicted (possibly by another server process) since it was looked up
+            partial_path = os.path.join(cache_dir, f"{key}.{uuid.uuid4().hex}.partial")
+            feather.write_feather(parse(), partial_path, compression="uncompressed")
+            os.replace(partial_path, cache_path)
+    handle = DatasetHandle(path, version, (0, 0), [], 0, shared_key=key)
+    df = handle.load()
+    handle.shape, handle.columns = df.shape, df.columns.tolist()
+    handle.nbytes = int(df.memory_usage(deep=False).sum())
+    df = _set_current_version(handle, None, None)
+    _reset_history()
+    return df
+
+#function to keep the shared upload cache within its byte budget
+
+def evict_upload_cache(max_bytes=UPLOAD_CACHE_MAX_BYTES):
+    """
+    Remove the least recently used unused uploads until the cache fits in max_bytes
+
+    The cache holds the parsed uploads and the workbooks copied for their
+    sheets (with the sheets converted so far), which count against the same
+    budget. An upload that sessions hold a hard link to keeps its disk space
+    when the cache's own link is removed, so it counts against max_bytes and
+    is kept (new sessions share it instead of parsing another copy). Uploads
+    no session links to and workbooks are removed, least recently used first.
+
+    Returns:
+        int: Bytes held by the cached uploads and workbooks after eviction
+    """
+    entries = []  # (path, bytes, last used, removable)
+    for entry in os.scandir(get_shared_cache_dir("uploads")):
+        if entry.name.endswith(".arrow"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # removed by another server process
+            entries.append((entry.path, stat.st_size, stat.st_mtime, stat.st_nlink == 1))
+    for entry in os.scandir(get_shared_cache_dir("excel")):
+        # a workbook's folder changes whenever a sheet is converted and is touched when the workbook is used again
+        if entry.is_dir() and "." not in entry.name:
+            try:
+                size = sum(item.stat().st_size for item in os.scandir(entry.path))
+                entries.append((entry.path, size, entry.stat().st_mtime, True))
+            except FileNotFoundError:
+                continue
+    total = sum(size for _, size, _, _ in entries)
+    for path, size, _, removable in sorted(entries, key=lambda item: item[2]):
+        if total <= max_bytes:
+            break
+        if removable:
+            _remove_cache_entry(path)
+            total -= size
+    return total
+
+def _remove_cache_entry(path):
+    '''delete a cached upload, or a workbook's folder after moving it aside so it is never seen half removed'''
+    if not os.path.isdir(path):
+        _remove_file(path)
+        return
+    removing = f"{path}.{uuid.uuid4().hex}.removing"
+    try:
+        os.rename(path, removing)
+    except FileNotFoundError:
+        return  # removed by another server process
+    shutil.rmtree(removing, ignore_errors=True)
+
+def _link_or_copy(source, destination):
+    '''hard link source to destination, copying it when the two are on different file systems'''
+    _remove_file(destination)  # a leftover file of an earlier session with the same id
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+#--------------------------------UNDO HISTORY--------------------------------
+
+# The history keeps the file of the version the session started from (the base)
+# and every later step as a delta, so it grows with the size of the changes
+# rather than with the number of steps times the size of the dataset.
+
+def _reset_history():
+    '''make the current version the base of a new, empty history'''
+    old = st.session_state.get('history')
+    current = st.session_state['dataset']
+    if old is not None and old['base'].path != current.path:
+        _remove_file(old['base'].path)
+    st.session_state['history'] = {'base': current, 'deltas': [], 'position': 0}
+
+def _is_history_base(handle):
+    '''return True if the handle's file is the base of the undo history'''
+    history = st.session_state.get('history')
+    return history is not None and history['base'].path == handle.path
+
+def _remove_file(path):
+    '''delete a stored version, ignoring files that are already gone'''
+    if os.path.exists(path):
+        os.remove(path)
+
+#function to list the steps in the undo history
+
+def get_history():
+    """
+    Describe the steps in the undo history
+
+    Returns:
+        tuple: (list of step descriptions, number of steps currently applied,
+        bytes held by the recorded deltas)
+    """
+    history = st.session_state.get('history')
+    if history is None:
+        return [], 0, 0
+    descriptions = [delta['description'] for delta in history['deltas']]
+    return descriptions, history['position'], sum(delta_nbytes(delta) for delta in history['deltas'])
+
+#function to rebuild the dataset as it was after a given step
+
+def get_dataframe_at_step(step):
+    '''return the dataset after the first step steps of the history (0 is the uploaded data)'''
+    history = st.session_state['history']
+    return replay_deltas(history['base'].load(), history['deltas'][:step])
+
+#function to undo the last applied step
+
+def undo_last_change():
+    '''go back one step in the history, rebuilding the dataset from the base'''
+    history = st.session_state.get('history')
+    if history is None or history['position'] == 0:
+        return
+    history['position'] -= 1
+    _store_version(get_dataframe_at_step(history['position']), None, None)
+
+#function to redo the last undone step
+
+def redo_last_change():
+    '''re-apply the next step in the history to the current dataset'''
+    history = st.session_state.get('history')
+    if history is None or history['position'] == len(history['deltas']):
+        return
+    delta = history['deltas'][history['position']]
+    history['position'] += 1
+    changed_columns, kept_rows = delta_changes(delta)
+    _store_version(apply_delta(get_dataframe(), delta), changed_columns, kept_rows)
+
+#--------------------------------PLANS--------------------------------
+
+#function to run plan steps on the full dataset
+
+def apply_steps(plan):
+    """
+    Run plan steps on the full dataset and store the result as one new version
+
+    Adjacent compatible steps are fused (see fuse_plan), so the data is
+    scanned once per group of fills or filters instead of once per step.
+
+    Args:
+        plan (list): The plan steps
+
+    Returns:
+        pandas.DataFrame: The new version of the dataset
+    """
+    return _store_plan_result(*apply_plan(get_dataframe(), plan, **_cached_filter_inputs()))
+
+def _store_plan_result(new_df, kept_rows, changed_columns, plan):
+    '''store the result of apply_plan as one new version with its fitted plan, unless the plan changed nothing'''
+    if kept_rows is None and not changed_columns:
+        return get_dataframe()
+    return update_dataframe(new_df, changed_columns=changed_columns, kept_rows=kept_rows,
+                            description=describe_plan(plan), steps=plan)
+
+def _cached_filter_inputs():
+    '''return the row index and outlier scores cached for the current version, for apply_plan to reuse'''
+    version = get_dataset_version()
+    cache = get_session_cache()
+    row_index, scores = cache.get('row_index'), cache.get('outlier_scores')
+    return {'row_index': row_index['index'] if row_index is not None and row_index['version'] == version else None,
+            'outlier_scores': scores if scores is not None and scores['version'] == version else None}
+
+#function to list the plan steps behind the current version
+
+def get_applied_plan():
+    '''return the plan steps that turned the uploaded data into the current version'''
+    history = st.session_state.get('history')
+    if history is None:
+        return []
+    return [step for delta in history['deltas'][:history['position']] for step in delta.get('steps', [])]
+
+#function to preview plan steps on a fixed sample of the current dataset
+
+def get_plan_preview(plan):
+    '''return the result of running plan on a fixed sample of the current dataset, cached per version'''
+    version = get_dataset_version()
+    cached = get_session_cache().get('preview_sample')
+    if cached is None or cached['version'] != version:
+        cached = {'version': version, 'sample': get_preview_sample(get_dataframe())}
+        _set_cached('preview_sample', cached)
+    return apply_plan(cached['sample'], plan)[0]
+
+#--------------------------------BACKGROUND JOBS--------------------------------
+
+#function to run plan steps on the full dataset without blocking the page
+
+def submit_steps(plan):
+    """
+    Start running plan steps on the full dataset in the background
+
+    Submitting the same steps again for the same dataset version joins the
+    job that is already running. The result is stored by
+    collect_finished_jobs once the job is done.
+
+    Args:
+        plan (list): The plan steps
+
+    Returns:
+        Job: The job running the steps
+    """
+    jobs = st.session_state.setdefault('jobs', {})
+    return submit_job(jobs, (get_dataset_version(), repr(plan)), _run_plan, get_dataframe(), plan,
+                      _cached_filter_inputs(), description=describe_plan(plan))
+
+def _run_plan(job, df, plan, cached_inputs):
+    '''run plan on df in a worker thread, reporting progress per fused group'''
+    return apply_plan(df, plan, progress_callback=job.report, **cached_inputs)
+
+#function to list the session's jobs that have not finished yet
+
+def get_running_jobs():
+    '''return the session's queued and running jobs'''
+    return [job for job in st.session_state.get('jobs', {}).values() if not job.finished]
+
+#function to store the results of the jobs that finished since the last run
+
+def collect_finished_jobs():
+    """
+    Store the results of finished jobs and remove them from the session
+
+    A job whose dataset version is no longer current (because another change
+    was stored while it ran) is discarded and gets the status "stale".
+
+    Returns:
+        list: The jobs that finished, with status "done", "failed",
+        "cancelled" or "stale"
+    """
+    jobs = st.session_state.get('jobs', {})
+    finished = [job for job in jobs.values() if job.finished]
+    for job in finished:
+        del jobs[job.id]
+        if job.status != "done":
+            continue
+        if job.key[0] != get_dataset_version():
+            job.status = "stale"
+            continue
+        _store_plan_result(*job.result)
+    return finished
+
+#function to stop the session's running jobs
+
+def cancel_jobs():
+    '''ask every running job of the session to stop'''
+    for job in get_running_jobs():
+        job.cancel()
+
+#--------------------------------MODEL TRAINING--------------------------------
+
+# Training runs as a background job of its own. Cross-validation scores are
+# cached per candidate and fitted models per best candidate, both keyed by the
+# dataset version, so a rerun only trains the candidates it has not seen.
+
+#function to start cross-validating model candidates in the background
+
+def submit_training(features, target, candidates, n_folds):
+    """
+    Start cross-validating candidates on the current dataset and fitting the best one
+
+    Args:
+        features (list): The feature columns
+        target (str): The target column
+        candidates (list): (model, params) candidates
+        n_folds (int): Number of folds
+
+    Returns:
+        Job: The job running the training
+    """
+    version = get_dataset_version()
+    features = tuple(features)
+    digest = hashlib.sha1(repr((features, target)).encode()).hexdigest()[:12]
+    directory = os.path.join(get_store_dir(), f"training_v{version}_{digest}")
+    known_scores = get_training_scores(features, target, candidates, n_folds)
+    jobs = st.session_state.setdefault('training_jobs', {})
+    description = f"Train {', '.join(map(describe_candidate, candidates[:2]))}" + (f" and {len(candidates) - 2} more" if len(candidates) > 2 else "")
+    return submit_job(jobs, (version, features, target, tuple(candidates), n_folds), _run_training, get_dataframe(),
+                      list(features), target, candidates, n_folds, directory, known_scores, description=description)
+
+def _run_training(job, df, features, target, candidates, n_folds, directory, known_scores):
+    '''run the training in a worker thread, the folds themselves run on the process pool'''
+    return run_training(df, features, target, candidates, n_folds, directory, known_scores, progress_callback=job.report)
+
+#function to list the session's training jobs that have not finished yet
+
+def get_running_training():
+    '''return the session's queued and running training jobs'''
+    return [job for job in st.session_state.get('training_jobs', {}).values() if not job.finished]
+
+#function to cache the results of the training jobs that finished since the last run
+
+def collect_finished_training():
+    """
+    Cache the scores and models of finished training jobs and remove them from the session
+
+    Returns:
+        list: The jobs that finished, with status "done", "failed", "cancelled"
+        or "stale" (the data changed while they ran)
+    """
+    jobs = st.session_state.get('training_jobs', {})
+    finished = [job for job in jobs.values() if job.finished]
+    for job in finished:
+        del jobs[job.id]
+        if job.status != "done":
+            continue
+        version, features, target, _, n_folds = job.key
+        if version != get_dataset_version():
+            job.status = "stale"
+            continue
+        for candidate, score in job.result['scores'].items():
+            set_cached_result("cv_scores", (features, target, n_folds, candidate), score, max_entries=64)
+        set_cached_result("trained_model", (features, target, n_folds, job.result['best']),
+                          {key: job.result[key] for key in ('model', 'meta', 'sparse')}, max_entries=4)
+        if not get_running_training():
+            remove_training_arrays(get_store_dir(), version)
+    return finished
+
+#function to look up the cached cross-validation scores of candidates
+
+def get_training_scores(features, target, candidates, n_folds):
+    '''return the cached scores of the candidates that have been cross-validated on the current version'''
+    scores = {}
+    for candidate in candidates:
+        score = peek_cached_result("cv_scores", (tuple(features), target, n_folds, candidate))
+        if score is not None:
+            scores[candidate] = score
+    return scores
+
+#function to look up a model fitted on the current version
+
+def get_trained_model(features, target, n_folds, candidate):
+    '''return the cached {'model', 'meta', 'sparse'} of a candidate fitted on every row of the current version, or None'''
+    return peek_cached_result("trained_model", (tuple(features), target, n_folds, candidate))
+
+#--------------------------------EXPORTS--------------------------------
+
+#function to prepare a deferred download of the current version
+
+def get_export(export_format):
+    """
+    Return a function that produces the current version as a downloadable file
+
+    The file is only written when the function is first called (when the
+    download button is clicked) and is kept per dataset version and format,
+    so repeated downloads of the same version reuse it.
+
+    Args:
+        export_format (str): One of the keys of EXPORT_FORMATS
+
+    Returns:
+        callable: Returns the contents of the export file, which Streamlit
+        holds in memory while the download is served
+    """
+    handle = st.session_state['dataset']
+    export_dir = os.path.join(get_store_dir(), "exports")
+    path = os.path.join(export_dir, f"v{handle.version}.{EXPORT_FORMATS[export_format]['extension']}")
+
+    def export():
+        if not os.path.exists(path):
+            # exports of older versions are no longer downloadable, so drop them first
+            for entry in os.scandir(export_dir) if os.path.isdir(export_dir) else []:
+                if not entry.name.startswith(f"v{handle.version}."):
+                    _remove_file(entry.path)
+            export_dataframe(handle.load(), path, export_format)
+        with open(path, "rb") as file:
+            return file.read()
+    return export
+
+#--------------------------------CACHED DATASET STATISTICS--------------------------------
+
+# Results computed from the dataset are kept in the session's SessionCache
+# rather than directly in the session state, so the memory governor can spill
+# them to disk when the session is idle and the server needs memory.
+
+#function to get the session's cache of computed results
+
+def get_session_cache():
+    '''return the session's SessionCache, creating and registering it on first use'''
+    cache = st.session_state.get('session_cache')
+    if cache is None:
+        cache = SessionCache(get_session_id(), os.path.join(get_store_dir(), "spilled_cache.pkl"))
+        cache.dataset = st.session_state.get('dataset')
+        st.session_state['session_cache'] = cache
+    register_session_cache(cache)
+    return cache
+
+def _set_cached(name, value):
+    '''store a computed result in the session's cache and spill idle sessions if memory is short'''
+    cache = get_session_cache()
+    cache.set(name, value)
+    spilled = enforce_memory_budget(keep=cache)
+    if spilled:
+        LOGGER.info("Memory budget exceeded, spilled the caches of %d idle sessions", len(spilled))
+
+#function to cache a result computed from the current dataset for the current version
+
+def get_cached_result(name, params, compute, max_entries=16):
+    """
+    Return a result computed from the current dataset, cached per version and parameters
+
+    Results for older versions are dropped as soon as the dataset changes, and
+    at most max_entries results are kept per name (oldest first out).
+
+    Args:
+        name (str): Name of the cache (for example "chart_data")
+        params (tuple): Hashable parameters the result depends on
+        compute (callable): Computes the result when it is not cached
+
+    Returns:
+        The cached or freshly computed result
+    """
+    results = _cached_results(name)
+    if params in results:
+        results[params] = results.pop(params)  # mark as most recently used
+        return results[params]
+    with timer(f"compute {name}"):
+        result = compute()
+    return set_cached_result(name, params, result, max_entries)
+
+#function to look up a cached result without computing it
+
+def peek_cached_result(name, params):
+    '''return the result cached for the current version and params, or None'''
+    return _cached_results(name).get(params)
+
+#function to cache a result computed elsewhere, for example by a background job
+
+def set_cached_result(name, params, result, max_entries=16):
+    '''cache result for the current version and params, dropping the oldest results past max_entries, and return it'''
+    version = get_dataset_version()
+    cache = get_session_cache().get(f"cache_{name}")
+    if cache is None or cache['version'] != version:
+        cache = {'version': version, 'results': {}}
+    results = cache['results']
+    results.pop(params, None)
+    results[params] = result
+    while len(results) > max_entries:
+        del results[next(iter(results))]
+    _set_cached(f"cache_{name}", cache)
+    return result
+
+def _cached_results(name):
+    '''return the results cached under name for the current version'''
+    cache = get_session_cache().get(f"cache_{name}")
+    return cache['results'] if cache is not None and cache['version'] == get_dataset_version() else {}
+
+#function to get the row-hash index of the current dataset, updating it incrementally when possible
+
+@timed()
+def get_row_index():
+    """
+    Return the row-hash index of the current dataset (see build_row_index)
+
+    When the dataset only had rows dropped or some columns changed since the
+    cached index was built, the index is updated instead of rebuilt.
+
+    Returns:
+        dict: The row index of the current dataset
+    """
+    version = get_dataset_version()
+    cached = get_session_cache().get('row_index')
+    if cached is not None and cached['version'] == version:
+        return cached['index']
+
+    changes = get_changes_since(cached['version']) if cached is not None else None
+    if changes is not None and all(change['columns'] is not None or change['kept_rows'] is not None
+                                   for change in changes):
+        # drop rows first, then rehash the changed columns from the current data
+        index = cached['index']
+        for change in changes:
+            if change['kept_rows'] is not None:
+                index = filter_row_index(index, change['kept_rows'])
+        changed_columns = set().union(*(change['columns'] or [] for change in changes))
+        index = refresh_row_index(index, get_dataframe(), changed_columns)
+    else:
+        index = build_row_index(get_dataframe())
+    _set_cached('row_index', {'version': version, 'index': index})
+    return index
+
+#function to get the profile of the current dataset, computing it only when the dataset changed
+
+@timed()
+def get_dataset_profile():
+    """
+    Return the profile of the current dataset (see profile_dataframe)
+
+    The profile is cached against the dataset version. When every version since
+    the cached one only changed some columns, just those columns are profiled again.
+
+    Returns:
+        dict: The profile of the current dataset
+    """
+    version = get_dataset_version()
+    cached = get_session_cache().get('dataset_profile')
+    if cached is not None and cached['version'] == version:
+        return cached
+
+    df = get_dataframe()
+    changes = get_changes_since(cached['version']) if cached is not None else None
+    if changes is not None and all(change['columns'] is not None for change in changes):
+        changed_columns = set().union(*(change['columns'] for change in changes))
+        profile = refresh_profile(df, cached, list(changed_columns), get_row_index())
+    else:
+        profile = profile_dataframe(df, get_row_index())
+    profile['version'] = version
+    _set_cached('dataset_profile', profile)
+    return profile
+
+#function to get the outlier scores of the current dataset, computing them only when the dataset changed
+
+@timed()
+def get_outlier_scores():
+    """
+    Return the outlier scores of every numeric feature (see compute_outlier_scores)
+
+    The scores are cached against the dataset version and reuse the mean and std
+    of the cached profile, so changing the threshold is only a comparison.
+
+    Returns:
+        dict: The outlier scores of the current dataset
+    """
+    version = get_dataset_version()
+    cached = get_session_cache().get('outlier_scores')
+    if cached is not None and cached['version'] == version:
+        return cached
+    scores = compute_outlier_scores(get_dataframe(), stats=get_dataset_profile()['columns'])
+    scores['version'] = version
+    _set_cached('outlier_scores', scores)
+    return scores
+
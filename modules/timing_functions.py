@@ -0,0 +1,260 @@
+# ------Description: This file contains functions for timing page reruns, callbacks and data functions------
+
+import functools
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+from modules.memory_functions import get_memory_usage
+
+METRICS_DIR = os.environ.get("TADA_METRICS_DIR", os.path.join(tempfile.gettempdir(), "tada_metrics"))
+TIMING_LOG = "timings.jsonl"       # one JSON line per rerun
+METRICS_FILE = "metrics.prom"      # Prometheus text format, rewritten after every rerun
+TRACE_MEMORY = os.environ.get("TADA_TRACE_MEMORY", "0") == "1"   # record bytes allocated (slows everything down)
+MAX_SPANS = 1000                   # spans kept per rerun, threads that never finish a rerun (such as job workers) stop recording
+
+_local = threading.local()         # spans of the rerun running on this thread
+_totals = {}                       # process-wide totals per span name, for the metrics file
+_reruns = {}                       # process-wide rerun counts and seconds per page
+_totals_lock = threading.Lock()
+_log_queue = queue.SimpleQueue()   # reruns waiting to be written by the log writer thread
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+if TRACE_MEMORY:
+    tracemalloc.start()
+
+#--------------------------------SPANS--------------------------------
+
+#context manager to time a block of code
+
+@contextmanager
+def timer(name, rows=None):
+    """
+    Time a block and record it as a span of the current rerun
+
+    Spans record wall time, the number of rows processed (when known) and,
+    with TADA_TRACE_MEMORY=1, the net bytes allocated. Nested timers are
+    recorded with their depth.
+
+    Args:
+        name (str): Label of the span
+        rows (int, optional): Rows processed, can also be set on the yielded span
+
+    Yields:
+        dict: The span, whose 'rows' can be filled in inside the block
+    """
+    spans = _get_spans()
+    span = {'name': name, 'depth': _local.depth, 'seconds': 0.0, 'rows': rows, 'bytes': None}
+    if len(spans) < MAX_SPANS:
+        spans.append(span)
+    _local.depth = span['depth'] + 1
+    memory_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span['seconds'] = time.perf_counter() - start
+        if memory_before is not None:
+            span['bytes'] = tracemalloc.get_traced_memory()[0] - memory_before
+        _local.depth = span['depth']
+
+#decorator to time every call of a function
+
+def timed(name=None):
+    """
+    Record every call of the decorated function as a span
+
+    The rows processed are taken from the first DataFrame argument.
+
+    Args:
+        name (str, optional): Label of the spans, the function name by default
+    """
+    def decorator(function):
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            frame = next((arg for arg in args if isinstance(arg, pd.DataFrame)), None)
+            with timer(label, rows=len(frame) if frame is not None else None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _get_spans():
+    '''return the list collecting the spans of this thread's rerun'''
+    if not hasattr(_local, 'spans'):
+        _local.spans = []
+        _local.depth = 0
+    return _local.spans
+
+#--------------------------------RERUNS--------------------------------
+
+# A rerun is closed by finish_rerun at the end of the page, or by rerun() and
+# stop() in place of st.rerun() and st.stop(). A rerun left open any other way
+# (an exception, a page switch) is closed, marked as interrupted, when the
+# thread starts its next rerun, so its spans never count towards another one.
+
+#function to mark the start of a page rerun
+
+def start_rerun(page, session_id=None):
+    '''remember when the page script started, spans recorded since the last rerun (e.g. by callbacks) are kept'''
+    if getattr(_local, 'open', False):
+        finish_rerun(interrupted=True)
+    _get_spans()
+    _local.page = page
+    _local.session_id = session_id
+    _local.started = time.perf_counter()
+    _local.open = True
+
+#function to close the current rerun and start a new one
+
+def rerun():
+    '''record the current rerun, then rerun the page with st.rerun()'''
+    import streamlit as st
+
+    if getattr(_local, 'open', False):  # a fragment's own reruns are not page reruns
+        finish_rerun()
+    st.rerun()
+
+#function to close the current rerun and stop the page
+
+def stop():
+    '''record the current rerun, then stop the page with st.stop()'''
+    import streamlit as st
+
+    if getattr(_local, 'open', False):  # a fragment's own reruns are not page reruns
+        finish_rerun()
+    st.stop()
+
+#function to close the current rerun and write it to the log and metrics files
+
+def finish_rerun(session_id=None, interrupted=False):
+    """
+    Close the rerun started with start_rerun and record it
+
+    The process-wide totals are updated here. Appending the rerun to the
+    JSON-lines log and rewriting the Prometheus metrics file is left to a
+    background thread, so reruns never wait on file I/O or on each other.
+
+    Args:
+        session_id (str, optional): The session written to the log, the one
+            given to start_rerun by default
+        interrupted (bool): The page did not reach its end (see start_rerun)
+
+    Returns:
+        dict: The rerun with 'page', 'seconds' (whole rerun) and 'spans'
+    """
+    spans = _get_spans()
+    page = getattr(_local, 'page', None)
+    seconds = time.perf_counter() - getattr(_local, 'started', time.perf_counter())
+    record = {'time': datetime.now().isoformat(timespec="milliseconds"),
+              'session': session_id if session_id is not None else getattr(_local, 'session_id', None), 'page': page,
+              'seconds': seconds, 'spans': spans}
+    if interrupted:
+        record['interrupted'] = True
+    _local.spans = []
+    _local.depth = 0
+    _local.open = False
+
+    with _totals_lock:
+        reruns = _reruns.setdefault(page, {'count': 0, 'seconds': 0.0})
+        reruns['count'] += 1
+        reruns['seconds'] += seconds
+        for span in spans:
+            totals = _totals.setdefault(span['name'], {'count': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0})
+            totals['count'] += 1
+            totals['seconds'] += span['seconds']
+            totals['rows'] += span['rows'] or 0
+            totals['bytes'] += max(span['bytes'] or 0, 0)
+    _log_rerun(record)
+    return record
+
+def _log_rerun(record):
+    '''queue a rerun for the log writer thread, starting the thread on first use'''
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None:
+            _log_writer = threading.Thread(target=_write_log, name="tada-timing-log", daemon=True)
+            _log_writer.start()
+    _log_queue.put(record)
+
+def _write_log():
+    '''append queued reruns to the log and rewrite the metrics file, once per batch of reruns (runs on the writer thread)'''
+    while True:
+        records = [_log_queue.get()]
+        while not _log_queue.empty():
+            records.append(_log_queue.get())
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with open(os.path.join(METRICS_DIR, TIMING_LOG), "a") as f:
+                f.writelines(json.dumps(record, default=str) + "\n" for record in records)
+            _write_metrics()
+        except OSError:
+            continue  # a full or missing disk loses these reruns' lines, the totals are written with the next batch
+
+def _write_metrics():
+    '''rewrite the Prometheus text file from the process-wide totals'''
+    with _totals_lock:
+        reruns = {page: dict(totals) for page, totals in _reruns.items()}
+        spans = {name: dict(totals) for name, totals in _totals.items()}
+    lines = [
+        "# HELP tada_reruns_total Page reruns.", "# TYPE tada_reruns_total counter",
+        *[f'tada_reruns_total{{page="{_escape(page)}"}} {totals["count"]}' for page, totals in reruns.items()],
+        "# HELP tada_rerun_seconds_total Wall time spent in page reruns.", "# TYPE tada_rerun_seconds_total counter",
+        *[f'tada_rerun_seconds_total{{page="{_escape(page)}"}} {totals["seconds"]:.6f}' for page, totals in reruns.items()],
+    ]
+    for metric, field, description in (("calls_total", "count", "Timed calls."),
+                                        ("seconds_total", "seconds", "Wall time spent in timed calls."),
+                                        ("rows_total", "rows", "Rows processed by timed calls."),
+                                        ("allocated_bytes_total", "bytes", "Net bytes allocated by timed calls.")):
+        lines += [f"# HELP tada_span_{metric} {description}", f"# TYPE tada_span_{metric} counter"]
+        for name, totals in spans.items():
+            value = f"{totals[field]:.6f}" if field == "seconds" else totals[field]
+            lines.append(f'tada_span_{metric}{{name="{_escape(name)}"}} {value}')
+
+    usage = get_memory_usage()
+    lines += ["# HELP tada_session_memory_bytes Bytes held in memory by all sessions.", "# TYPE tada_session_memory_bytes gauge",
+              f"tada_session_memory_bytes {usage['total']}",
+              "# HELP tada_session_memory_budget_bytes Memory budget of all sessions.", "# TYPE tada_session_memory_budget_bytes gauge",
+              f"tada_session_memory_budget_bytes {usage['budget']}",
+              "# HELP tada_sessions Live sessions.", "# TYPE tada_sessions gauge",
+              f"tada_sessions {len(usage['sessions'])}"]
+
+    path = os.path.join(METRICS_DIR, METRICS_FILE)
+    with open(path + ".partial", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".partial", path)  # scrapers never see a half-written file
+
+def _escape(value):
+    '''escape a Prometheus label value'''
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+#--------------------------------TIMING PANEL--------------------------------
+
+#function to show the spans of the latest rerun in the sidebar
+
+def show_timing_panel(record):
+    '''show a sidebar table of where the rerun spent its time, when the user turned the panel on'''
+    import streamlit as st
+
+    st.sidebar.divider()
+    if not st.sidebar.toggle("Show timings", key="show_timings", help="Where the last rerun of this page spent its time"):
+        return
+    st.sidebar.caption(f"Last rerun took {record['seconds'] * 1000:.0f} ms")
+    if record['spans']:
+        table = pd.DataFrame({
+            'step': ["  " * span['depth'] + span['name'] for span in record['spans']],
+            'ms': [span['seconds'] * 1000 for span in record['spans']],
+            'rows': [span['rows'] for span in record['spans']],
+            'MB': [span['bytes'] / 1024**2 if span['bytes'] is not None else None for span in record['spans']],
+        })
+        st.sidebar.dataframe(table, hide_index=True)
@@ -0,0 +1,466 @@
+# ------Description: This file contains functions for training models with cross-validation on a pool of processes------
+
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from modules.encoding_functions import encode_sparse
+from modules.parallel_functions import clean_main_context, nan_mean_std
+from modules.timing_functions import timed
+
+TRAINING_WORKERS = int(os.environ.get("TADA_TRAINING_WORKERS", os.cpu_count() or 1))   # processes fitting folds at the same time
+TRAINING_CHUNK_ROWS = 100_000     # rows written, scored and fed to out-of-core learners at a time
+TRAINING_MEMORY_BYTES = int(os.environ.get("TADA_TRAINING_MEMORY_MB", 2048)) * 1024 * 1024   # training rows copied by the in-memory folds at once
+OUT_OF_CORE_EPOCHS = 5            # passes over the training rows of a mini-batch learner
+FOLD_KEYS = 2520                  # rows get a random key below this, key % folds is their fold (balanced for 2 to 10 folds)
+CLASSIFICATION_MAX_CLASSES = 20   # integer targets with at most this many values are treated as classes
+CV_FOLDS = 5                      # folds when none are given
+
+# Models are given by the import path of their estimator so the worker
+# processes import them themselves. 'params' are fixed, 'grid' lists the
+# hyperparameter candidates tried when tuning, and out-of-core models are
+# trained with partial_fit one chunk of rows at a time. Sparse models get their
+# text features one-hot encoded as a sparse matrix instead of as category codes.
+MODELS = {
+    "Ridge regression": {'task': 'regression', 'estimator': "sklearn.linear_model.Ridge",
+                         'grid': {'alpha': [0.1, 1.0, 10.0]}, 'sparse': True},
+    "Random forest regressor": {'task': 'regression', 'estimator': "sklearn.ensemble.RandomForestRegressor",
+                                'params': {'n_estimators': 100, 'n_jobs': 1, 'random_state': 0},
+                                'grid': {'max_depth': [None, 8, 16]}},
+    "SGD regressor (out-of-core)": {'task': 'regression', 'estimator': "sklearn.linear_model.SGDRegressor",
+                                    'params': {'random_state': 0}, 'grid': {'alpha': [1e-5, 1e-4, 1e-3]},
+                                    'out_of_core': True, 'sparse': True},
+    "Logistic regression": {'task': 'classification', 'estimator': "sklearn.linear_model.LogisticRegression",
+                            'params': {'max_iter': 1000}, 'grid': {'C': [0.1, 1.0, 10.0]}, 'sparse': True},
+    "Random forest classifier": {'task': 'classification', 'estimator': "sklearn.ensemble.RandomForestClassifier",
+                                 'params': {'n_estimators': 100, 'n_jobs': 1, 'random_state': 0},
+                                 'grid': {'max_depth': [None, 8, 16]}},
+    "SGD classifier (out-of-core)": {'task': 'classification', 'estimator': "sklearn.linear_model.SGDClassifier",
+                                     'params': {'loss': 'log_loss', 'random_state': 0},
+                                     'grid': {'alpha': [1e-5, 1e-4, 1e-3]}, 'out_of_core': True, 'sparse': True},
+}
+METRICS = {'regression': "R²", 'classification': "accuracy"}
+
+_training_executor = None
+_training_executor_lock = threading.Lock()
+
+#--------------------------------MODELS--------------------------------
+
+#function to decide whether a target is predicted as a class or a number
+
+def infer_task(target):
+    '''return "classification" for text, boolean and few-valued integer targets, otherwise "regression"'''
+    if not pd.api.types.is_numeric_dtype(target) or pd.api.types.is_bool_dtype(target):
+        return 'classification'
+    values = target.dropna()
+    if (values == values.round()).all() and values.nunique() <= CLASSIFICATION_MAX_CLASSES:
+        return 'classification'
+    return 'regression'
+
+#function to list the hyperparameter candidates of a model
+
+def model_candidates(model, tune=False):
+    '''return the (model, params) candidates of a model, one per grid point when tuning, otherwise just the defaults'''
+    grid = MODELS[model].get('grid', {}) if tune else {}
+    return [(model, tuple(zip(grid, values))) for values in itertools.product(*grid.values())]
+
+def make_estimator(model, params=()):
+    '''return a new estimator of a model with its fixed params and the candidate's params'''
+    spec = MODELS[model]
+    module, name = spec['estimator'].rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)(**{**spec.get('params', {}), **dict(params)})
+
+#--------------------------------TRAINING ARRAYS--------------------------------
+
+#function to write the features and target as memory-mapped arrays the worker processes share
+
+@timed()
+def write_training_arrays(df, features, target, directory, chunk_rows=TRAINING_CHUNK_ROWS):
+    """
+    Write the features and target of the rows with a target as .npy files
+
+    The workers open the files memory-mapped instead of receiving pickled
+    copies, so every process shares the same pages and only touches the rows
+    it reads. The files are written one chunk of rows at a time. Features are
+    stored as standardized float32 (text features as their category code,
+    missing values as 0, the mean), classes as integer codes. Text features
+    are also written one-hot encoded as the data, indices and row offsets of
+    a CSR matrix, for the sparse models. Every row gets a random fold key. A
+    directory that already holds the arrays is reused.
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        features (list): The feature columns
+        target (str): The target column
+        directory (str): Folder the arrays are written to
+        chunk_rows (int): Rows converted at a time
+
+    Returns:
+        dict: The array paths ('X', 'y', 'keys', and 'onehot' with text
+        features) and how the features and target were encoded ('task',
+        'classes', 'categories', 'mean', 'scale', 'rows')
+    """
+    meta_path = os.path.join(directory, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            return json.load(f)
+    os.makedirs(directory, exist_ok=True)
+    labels = df[target]
+    has_target = labels.notna().to_numpy()
+    task = infer_task(labels)
+    meta = {'features': list(features), 'target': target, 'task': task, 'rows': int(has_target.sum()),
+            'classes': None, 'categories': {},
+            'X': os.path.join(directory, "X.npy"), 'y': os.path.join(directory, "y.npy"),
+            'keys': os.path.join(directory, "keys.npy")}
+    if task == 'classification':
+        meta['classes'] = sorted(labels.dropna().unique().tolist(), key=str)
+    for col in features:
+        if not pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_bool_dtype(df[col]):
+            meta['categories'][col] = sorted(map(str, df[col].dropna().unique()))
+    chunks = lambda: (df.iloc[start:start + chunk_rows][has_target[start:start + chunk_rows]]
+                      for start in range(0, len(df), chunk_rows))
+    meta['mean'], meta['scale'] = _feature_statistics(chunks(), meta)
+
+    X = np.lib.format.open_memmap(meta['X'], mode='w+', dtype='float32', shape=(meta['rows'], len(features)))
+    y = np.lib.format.open_memmap(meta['y'], mode='w+', dtype='int32' if task == 'classification' else 'float64',
+                                  shape=(meta['rows'],))
+    keys = np.lib.format.open_memmap(meta['keys'], mode='w+', dtype='uint16', shape=(meta['rows'],))
+    arrays = [X, y, keys]
+    if meta['categories']:
+        # every present text value is one entry of the one-hot matrix, the categories cover all of them
+        entries = int(df.loc[has_target, list(meta['categories'])].notna().sum().sum())
+        meta['onehot'] = {name: os.path.join(directory, f"onehot_{name}.npy") for name in ('data', 'indices', 'indptr')}
+        onehot = {name: np.lib.format.open_memmap(meta['onehot'][name], mode='w+', dtype=dtype, shape=(size,))
+                  for name, dtype, size in (('data', 'uint8', entries), ('indices', 'int32', entries),
+                                            ('indptr', 'int64', meta['rows'] + 1))}
+        onehot['indptr'][0] = 0
+        arrays.extend(onehot.values())
+    rng = np.random.default_rng(0)
+    row = entry = 0
+    for chunk in chunks():
+        stop = row + len(chunk)
+        X[row:stop] = prepare_features(chunk, meta)
+        if meta['categories']:
+            matrix = _onehot_matrix(chunk, meta)
+            onehot['data'][entry:entry + matrix.nnz] = matrix.data
+            onehot['indices'][entry:entry + matrix.nnz] = matrix.indices
+            onehot['indptr'][row + 1:stop + 1] = matrix.indptr[1:] + entry
+            entry += matrix.nnz
+        if task == 'classification':
+            y[row:stop] = pd.Categorical(chunk[target], categories=meta['classes']).codes
+        else:
+            y[row:stop] = chunk[target].to_numpy(dtype='float64')
+        keys[row:stop] = rng.integers(0, FOLD_KEYS, len(chunk))
+        row = stop
+    for array in arrays:
+        array.flush()
+    with open(meta_path, "w") as f:  # written last, a folder without it is incomplete
+        json.dump(meta, f)
+    return meta
+
+#function to encode rows of features the way the training arrays were written
+
+def prepare_features(df, meta, sparse=False):
+    """
+    Encode rows of features the way the training arrays were written
+
+    Args:
+        df (pandas.DataFrame): Rows holding the features of meta
+        meta (dict): The training arrays, from write_training_arrays
+        sparse (bool): Encode for a sparse model (see MODELS)
+
+    Returns:
+        numpy.ndarray or scipy.sparse.csr_matrix: The standardized float32
+        features, for a sparse model with the text features one-hot encoded
+    """
+    values = np.nan_to_num((_feature_matrix(df, meta) - np.asarray(meta['mean'])) / np.asarray(meta['scale'])).astype('float32')
+    if not sparse or not meta['categories']:
+        return values
+    import scipy.sparse as sp
+    return sp.hstack([sp.csr_matrix(values[:, _numeric_positions(meta)]), _onehot_matrix(df, meta)], format='csr')
+
+def _numeric_positions(meta):
+    '''return the positions of the features that are not text features'''
+    return [position for position, col in enumerate(meta['features']) if col not in meta['categories']]
+
+def _onehot_matrix(df, meta):
+    '''return the text features of df one-hot encoded as a CSR matrix, with the categories of the training arrays'''
+    text = list(meta['categories'])
+    step = {'op': 'encode', 'method': 'onehot', 'columns': text,
+            'params': {col: {'categories': meta['categories'][col], 'other': False} for col in text}}
+    return encode_sparse(pd.DataFrame({col: df[col].astype(str).where(df[col].notna()) for col in text}), step)[0]
+
+def _feature_matrix(df, meta):
+    '''return the features of df as float64, text features as their category code and missing values as NaN'''
+    columns = []
+    for col in meta['features']:
+        if col in meta['categories']:
+            codes = pd.Categorical(df[col].astype(str).where(df[col].notna()), categories=meta['categories'][col]).codes
+            columns.append(np.where(codes >= 0, codes, np.nan))
+        else:
+            columns.append(df[col].to_numpy(dtype='float64', na_value=np.nan))
+    return np.column_stack(columns) if columns else np.empty((len(df), 0))
+
+def _feature_statistics(chunks, meta):
+    '''return the mean and standard deviation of every feature, accumulated over chunks of rows'''
+    shift = count = total = squares = None
+    for chunk in chunks:
+        values = _feature_matrix(chunk, meta)
+        if shift is None:
+            # sums of values shifted by a first estimate of the mean keep their precision
+            shift = np.nan_to_num(nan_mean_std(values)[0])
+            count, total, squares = (np.zeros(values.shape[1]) for _ in range(3))
+        values = values - shift
+        count += (~np.isnan(values)).sum(axis=0)
+        total += np.nansum(values, axis=0)
+        squares += np.nansum(values * values, axis=0)
+    if shift is None:
+        return [0.0] * len(meta['features']), [1.0] * len(meta['features'])
+    mean = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+    variance = np.divide(squares - count * mean * mean, count - 1, out=np.zeros_like(total), where=count > 1)
+    std = np.sqrt(np.maximum(variance, 0.0))
+    return (shift + mean).tolist(), np.where(std > 0, std, 1.0).tolist()
+
+#function to remove the training arrays of other dataset versions
+
+def remove_training_arrays(store_dir, version):
+    '''delete the training array folders in store_dir written for other dataset versions'''
+    for entry in os.scandir(store_dir):
+        if entry.is_dir() and entry.name.startswith("training_v") and not entry.name.startswith(f"training_v{version}_"):
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+#--------------------------------CROSS-VALIDATION--------------------------------
+
+#function to get the process pool the folds run on
+
+def get_training_executor():
+    '''return the process-wide training pool, creating it on first use'''
+    global _training_executor
+    with _training_executor_lock:
+        if _training_executor is None:
+            # forkserver children start from a clean process, forking the server's threads is unsafe
+            context = clean_main_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+            _training_executor = ProcessPoolExecutor(max_workers=TRAINING_WORKERS, mp_context=context)
+        return _training_executor
+
+def _reset_training_executor():
+    '''drop a broken pool so the next run starts a new one'''
+    global _training_executor
+    with _training_executor_lock:
+        _training_executor = None
+
+#function to cross-validate model candidates on the process pool
+
+@timed()
+def cross_validate(meta, candidates, n_folds=CV_FOLDS, progress_callback=None):
+    """
+    Score every candidate on every fold, one pool task per candidate and fold
+
+    In-memory learners copy the training rows of their fold, so only as many
+    of their tasks are queued at once as have copies fitting in
+    TRAINING_MEMORY_BYTES (at least one), the next starts when one finishes.
+    Out-of-core tasks read a chunk at a time and are all queued at once.
+
+    Args:
+        meta (dict): The training arrays, from write_training_arrays
+        candidates (list): (model, params) candidates, from model_candidates
+        n_folds (int): Number of folds, between 2 and 10
+        progress_callback (callable, optional): Called with the fraction of tasks done,
+            may raise to stop the run (the tasks not started yet are cancelled)
+
+    Returns:
+        dict: For every candidate its 'score' and 'std' over the folds and the mean 'fit seconds'
+    """
+    executor = get_training_executor()
+    tasks = [(model, params, fold) for model, params in candidates for fold in range(n_folds)]
+    streamed = [task for task in tasks if MODELS[task[0]].get('out_of_core')]
+    in_memory = [task for task in tasks if not MODELS[task[0]].get('out_of_core')]
+    largest = max((fold_nbytes(meta, model, n_folds) for model, _, _ in in_memory), default=0)
+    window = max(1, TRAINING_MEMORY_BYTES // max(largest, 1))
+    futures = {}
+    pending = {_submit_fold(executor, futures, meta, task, n_folds) for task in streamed + in_memory[:window]}
+    waiting = in_memory[window:]
+    results = {candidate: [] for candidate in candidates}
+    try:
+        done = 0
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                results[futures[future]].append(future.result())
+                done += 1
+                if progress_callback is not None:
+                    progress_callback(done / len(tasks))
+                if waiting and not MODELS[futures[future][0]].get('out_of_core'):
+                    pending.add(_submit_fold(executor, futures, meta, waiting.pop(0), n_folds))
+    except BrokenProcessPool:
+        _reset_training_executor()
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+    return {candidate: {'score': float(np.mean([score for score, _ in folds])),
+                        'std': float(np.std([score for score, _ in folds])),
+                        'fit seconds': float(np.mean([seconds for _, seconds in folds]))}
+            for candidate, folds in results.items()}
+
+def _submit_fold(executor, futures, meta, task, n_folds):
+    '''submit the (model, params, fold) task to the pool and return its future, recorded in futures with its candidate'''
+    model, params, fold = task
+    future = executor.submit(run_fold, meta, model, params, fold, n_folds)
+    futures[future] = (model, params)
+    return future
+
+#function to estimate the memory an in-memory learner copies its training rows into
+
+def fold_nbytes(meta, model, n_folds):
+    '''return the bytes of the training rows of one fold as run_fold copies them for model'''
+    rows = meta['rows'] * (n_folds - 1) // n_folds
+    if not MODELS[model].get('sparse') or not meta['categories']:
+        return rows * len(meta['features']) * 4
+    # CSR: a float32 value and an int32 column index per numeric feature, one per text feature, and a row offset
+    return rows * (len(_numeric_positions(meta)) * 8 + len(meta['categories']) * 5 + 8)
+
+#function to fit a candidate on all rows in a worker process
+
+@timed()
+def fit_model(meta, model, params):
+    '''return the candidate fitted on every row, trained in a worker process'''
+    return get_training_executor().submit(run_fold, meta, model, params, None, None).result()
+
+#function to fit one candidate on the training rows of a fold and score it on the others
+
+def run_fold(meta, model, params, fold, n_folds):
+    """
+    Fit a candidate on the rows outside a fold and score it on the fold (runs in a worker process)
+
+    In-memory learners are fitted on a copy of the training rows. Out-of-core
+    learners read the memory-mapped rows one chunk at a time, so their memory
+    stays bounded by TRAINING_CHUNK_ROWS whatever the size of the data. Sparse
+    models read the one-hot text features instead of their category codes.
+
+    Args:
+        meta (dict): The training arrays, from write_training_arrays
+        model (str): Key of MODELS
+        params (tuple): The candidate's (name, value) hyperparameters
+        fold (int): The fold scored, None to fit on every row
+        n_folds (int): Number of folds
+
+    Returns:
+        tuple: (score, fit seconds), or the fitted estimator when fold is None
+    """
+    features = _open_features(meta, MODELS[model].get('sparse', False))
+    y, keys = (np.load(meta[name], mmap_mode='r') for name in ('y', 'keys'))
+    estimator = make_estimator(model, params)
+    started = time.perf_counter()
+    if MODELS[model].get('out_of_core'):
+        _partial_fit(estimator, meta, features, y, keys, fold, n_folds)
+    else:
+        train = slice(None) if fold is None else np.flatnonzero(keys % n_folds != fold)
+        estimator.fit(features(train), y[train])
+    fit_seconds = time.perf_counter() - started
+    if fold is None:
+        return estimator
+    return _score(estimator, meta['task'], features, y, keys % n_folds == fold), fit_seconds
+
+def _open_features(meta, sparse):
+    '''return a function giving rows of the memory-mapped features, with the one-hot text features for sparse models'''
+    X = np.load(meta['X'], mmap_mode='r')
+    if not sparse or not meta['categories']:
+        return lambda rows: X[rows]
+    import scipy.sparse as sp
+    numeric = _numeric_positions(meta)
+    data, indices, indptr = (np.load(meta['onehot'][name], mmap_mode='r') for name in ('data', 'indices', 'indptr'))
+    width = sum(len(categories) for categories in meta['categories'].values())
+    onehot = sp.csr_matrix((data, indices, indptr), shape=(meta['rows'], width))
+    return lambda rows: sp.hstack([sp.csr_matrix(X[rows][:, numeric]), onehot[rows]], format='csr')
+
+def _partial_fit(estimator, meta, features, y, keys, fold, n_folds):
+    '''train a mini-batch learner on the rows outside fold, one shuffled chunk at a time'''
+    rng = np.random.default_rng(0)
+    starts = np.arange(0, meta['rows'], TRAINING_CHUNK_ROWS)
+    classes = np.arange(len(meta['classes'])) if meta['task'] == 'classification' else None
+    for _ in range(OUT_OF_CORE_EPOCHS):
+        for start in rng.permutation(starts):
+            rows = slice(start, start + TRAINING_CHUNK_ROWS)
+            train = np.ones(len(keys[rows]), dtype=bool) if fold is None else keys[rows] % n_folds != fold
+            order = rng.permutation(np.flatnonzero(train))
+            if len(order) == 0:
+                continue
+            if classes is None:
+                estimator.partial_fit(features(rows)[order], y[rows][order])
+            else:
+                estimator.partial_fit(features(rows)[order], y[rows][order], classes=classes)
+
+def _score(estimator, task, features, y, test):
+    '''return the R² or accuracy of estimator on the test rows, predicted one chunk at a time'''
+    count = total = squares = errors = 0.0
+    for start in range(0, len(y), TRAINING_CHUNK_ROWS):
+        rows = slice(start, start + TRAINING_CHUNK_ROWS)
+        chunk_test = np.flatnonzero(test[rows])
+        if not len(chunk_test):
+            continue
+        actual, predicted = y[rows][chunk_test], estimator.predict(features(rows)[chunk_test])
+        count += len(actual)
+        if task == 'classification':
+            errors += float((actual != predicted).sum())
+        else:
+            total += float(actual.sum())
+            squares += float((actual * actual).sum())
+            errors += float(((actual - predicted) ** 2).sum())
+    if task == 'classification':
+        return 1.0 - errors / count if count else float('nan')
+    spread = squares - total * total / count if count else 0.0
+    return 1.0 - errors / spread if spread > 0 else float('nan')
+
+#--------------------------------TRAINING RUNS--------------------------------
+
+#function to cross-validate the candidates not scored yet and fit the best one
+
+def run_training(df, features, target, candidates, n_folds, directory, known_scores=None, progress_callback=None):
+    """
+    Cross-validate candidates and fit the best one on every row
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        features (list): The feature columns
+        target (str): The target column
+        candidates (list): (model, params) candidates
+        n_folds (int): Number of folds
+        directory (str): Folder of the memory-mapped training arrays
+        known_scores (dict, optional): Scores of candidates already cross-validated on this data, not run again
+        progress_callback (callable, optional): Called with the fraction of work done
+
+    Returns:
+        dict: 'meta' (the training arrays), 'scores' (the new candidates' scores),
+        'best' (the best candidate), 'model' (the best candidate fitted on every
+        row) and 'sparse' (whether it takes the features of prepare_features as a sparse matrix)
+    """
+    report = progress_callback or (lambda progress: None)
+    known_scores = known_scores or {}
+    report(0.0)
+    meta = write_training_arrays(df, features, target, directory)
+    report(0.1)
+    missing = [candidate for candidate in candidates if candidate not in known_scores]
+    scores = cross_validate(meta, missing, n_folds, lambda done: report(0.1 + 0.8 * done)) if missing else {}
+    everything = {**known_scores, **scores}
+    best = max(candidates, key=lambda candidate: np.nan_to_num(everything[candidate]['score'], nan=-np.inf))
+    model = fit_model(meta, *best)
+    report(1.0)
+    return {'meta': meta, 'scores': scores, 'best': best, 'model': model, 'sparse': MODELS[best[0]].get('sparse', False)}
+
+#function to describe a candidate for display
+
+def describe_candidate(candidate):
+    '''return "model (name=value, ...)" for a (model, params) candidate'''
+    model, params = candidate
+    return f"{model} ({', '.join(f'{name}={value}' for name, value in params)})" if params else model
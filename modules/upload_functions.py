@@ -0,0 +1,417 @@
+# ------Description: This file contains functions for reading uploaded data files------
+
+import hashlib
+import itertools
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+from pandas.api.types import union_categoricals
+
+from modules.parallel_functions import clean_main_context
+
+CSV_CHUNK_ROWS = 100_000          # rows parsed per chunk when streaming a CSV
+CATEGORY_MAX_RATIO = 0.5          # object columns with fewer unique values than this ratio become categoricals
+HASH_BLOCK_BYTES = 1024 * 1024    # bytes read at a time when hashing an upload
+EXCEL_PARALLEL_MIN_BYTES = 8 * 1024 * 1024   # smaller workbooks are parsed in-process, starting workers would take longer
+EXCEL_MAX_WORKERS = 4             # sheets parsed at the same time
+EXCEL_CHUNK_ROWS = 50_000         # rows of a sheet converted to a chunk at a time
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm')   # workbooks openpyxl reads, kept under their own extension
+BOOL_STRINGS = {'True': True, 'TRUE': True, 'true': True, 'False': False, 'FALSE': False, 'false': False}   # text read as booleans
+
+#--------------------------------SCHEMA INFERENCE--------------------------------
+
+#function to infer a fixed column schema from the first chunks of a file
+
+def infer_schema(sample_df):
+    """
+    Infer the dtype every column should be locked to from a sample of the file
+
+    Numeric and boolean columns keep the dtype pandas inferred for them, and
+    low-cardinality text columns are stored as categoricals.
+
+    Args:
+        sample_df (pandas.DataFrame): The first chunk(s) of the file
+
+    Returns:
+        dict: Mapping of column name to dtype string
+    """
+    schema = {}
+    for col in sample_df.columns:
+        series = sample_df[col]
+        if pd.api.types.is_bool_dtype(series):
+            schema[col] = 'bool'
+        elif pd.api.types.is_integer_dtype(series):
+            schema[col] = 'int64'
+        elif pd.api.types.is_float_dtype(series):
+            schema[col] = 'float64'
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            schema[col] = str(series.dtype)
+        else:
+            non_null = series.dropna()
+            if len(non_null) > 0 and non_null.nunique() / len(non_null) <= CATEGORY_MAX_RATIO:
+                schema[col] = 'category'
+            else:
+                schema[col] = 'object'
+    return schema
+
+#function to cast a parsed chunk to the locked schema, widening the schema when a chunk does not fit
+
+def conform_chunk(chunk, schema):
+    """
+    Cast a chunk to the locked schema
+
+    If a column cannot be represented with its locked dtype (for example an
+    integer column that gains missing values, a boolean column that gains
+    other text or a categorical column parsed as numbers), the schema entry is
+    widened in place so that later chunks use the wider dtype too.
+
+    Args:
+        chunk (pandas.DataFrame): A freshly parsed chunk
+        schema (dict): Mapping of column name to dtype string, updated in place
+
+    Returns:
+        pandas.DataFrame: The chunk with its columns cast to the schema
+    """
+    for col, dtype in schema.items():
+        if col not in chunk.columns or str(chunk[col].dtype) == dtype:
+            continue
+        series = chunk[col]
+        # int and bool columns cannot hold missing values, so never cast NaNs into them
+        fits = dtype not in ('int64', 'bool') or not series.isna().any()
+        # and never truncate fractions into them
+        fits = fits and not (dtype == 'int64' and pd.api.types.is_float_dtype(series) and (series % 1 != 0).any())
+        # astype('bool') turns any non-empty text into True, so only real booleans fit a bool column
+        fits = fits and not (dtype == 'bool' and not series.map(type).isin([bool, np.bool_]).all())
+        # a category column's categories must keep one type, so a chunk parsed as numbers does not fit
+        text = pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series) \
+            or isinstance(series.dtype, pd.CategoricalDtype)
+        fits = fits and not (dtype == 'category' and not text and series.notna().any())
+        try:
+            if not fits:
+                raise ValueError(f"column {col} has values that do not fit {dtype}")
+            # an all-missing chunk parses as float, its (empty) categories must be text like the others
+            chunk[col] = series.astype(object).astype(dtype) if dtype == 'category' and not text else series.astype(dtype)
+        except (ValueError, TypeError):
+            if dtype in ('int64', 'float64') and pd.api.types.is_numeric_dtype(chunk[col]):
+                schema[col] = 'float64'
+            else:
+                schema[col] = 'object'
+            chunk[col] = chunk[col].astype(schema[col])
+    return chunk
+
+#function to concatenate chunks while keeping categorical columns categorical
+
+def concat_chunks(chunks, schema):
+    """
+    Concatenate chunks into one DataFrame, merging the categories of categorical columns
+
+    Args:
+        chunks (list): The parsed and conformed chunks
+        schema (dict): The final locked schema
+
+    Returns:
+        pandas.DataFrame: The combined DataFrame
+    """
+    if not chunks:
+        return pd.DataFrame(columns=list(schema))
+    # a widened boolean column holds booleans in its first chunks and text in the others, read that text as booleans too
+    widened_bools = [col for col, dtype in schema.items() if dtype == 'object'
+                     and any(pd.api.types.is_bool_dtype(chunk[col]) for chunk in chunks)]
+    # later chunks may have widened the schema, so cast earlier ones again
+    chunks = [conform_chunk(chunk, schema) for chunk in chunks]
+    for col in widened_bools:
+        chunks = [chunk.assign(**{col: chunk[col].map(lambda value: BOOL_STRINGS.get(value, value) if isinstance(value, str) else value)})
+                  for chunk in chunks]
+    cat_cols = [col for col, dtype in schema.items() if dtype == 'category']
+    for col in list(cat_cols):
+        if len({chunk[col].cat.categories.dtype for chunk in chunks if len(chunk[col].cat.categories)}) > 1:
+            # categories of different types cannot be merged, keep the column as plain values
+            schema[col] = 'object'
+            cat_cols.remove(col)
+            chunks = [chunk.assign(**{col: chunk[col].astype(object)}) for chunk in chunks]
+    df = pd.concat([chunk.drop(columns=cat_cols) for chunk in chunks], ignore_index=True)
+    for col in cat_cols:
+        df[col] = union_categoricals([chunk[col] for chunk in chunks], ignore_order=True)
+    return df[list(chunks[0].columns)]
+
+#--------------------------------CSV STREAMING--------------------------------
+
+#function to read a csv file in chunks with an optional row limit or uniform sample
+
+def read_csv_chunked(file, chunksize=CSV_CHUNK_ROWS, nrows=None, sample_frac=None,
+                     infer_chunks=1, progress_callback=None, random_state=0):
+    """
+    Stream a CSV file into a DataFrame chunk by chunk
+
+    The dtypes of the first ``infer_chunks`` chunks are locked and every later
+    chunk is cast to them, so text columns are parsed straight into
+    categoricals and the result never falls back to a mixed object column.
+
+    Args:
+        file: A path or a binary file-like object (such as a Streamlit UploadedFile)
+        chunksize (int): Number of rows parsed per chunk
+        nrows (int, optional): Only load the first ``nrows`` rows
+        sample_frac (float, optional): Keep a uniform random sample of this fraction of rows
+        infer_chunks (int): Number of leading chunks used to infer the schema
+        progress_callback (callable, optional): Called with a float between 0 and 1 after each chunk
+        random_state (int): Seed for the row sample
+
+    Returns:
+        pandas.DataFrame: The loaded data
+    """
+    total_bytes = _file_size(file)
+    rng = np.random.default_rng(random_state)
+    reader = pd.read_csv(file, chunksize=chunksize, nrows=nrows, low_memory=False)
+
+    schema = None
+    head, chunks = [], []
+    rows_read = 0
+    with reader:
+        for chunk in reader:
+            rows_read += len(chunk)
+            if sample_frac is not None and sample_frac < 1:
+                chunk = chunk[rng.random(len(chunk)) < sample_frac]
+
+            if schema is None:
+                head.append(chunk)
+                if len(head) < infer_chunks:
+                    continue
+                schema = infer_schema(pd.concat(head, ignore_index=True))
+                chunks.extend(conform_chunk(c, schema) for c in head)
+                head = []
+            else:
+                chunks.append(conform_chunk(chunk, schema))
+
+            if progress_callback is not None:
+                progress_callback(_progress(file, total_bytes, rows_read, nrows))
+
+    if schema is None:
+        # the file was shorter than the inference window
+        sample = pd.concat(head, ignore_index=True) if head else pd.DataFrame()
+        schema = infer_schema(sample)
+        chunks = [conform_chunk(c, schema) for c in head]
+
+    if progress_callback is not None:
+        progress_callback(1.0)
+    return concat_chunks(chunks, schema)
+
+def _file_size(file):
+    '''return the size of a file-like object or path in bytes, or None if unknown'''
+    size = getattr(file, 'size', None)
+    if size is not None:
+        return size
+    try:
+        return os.path.getsize(file)
+    except (TypeError, OSError):
+        return None
+
+def _progress(file, total_bytes, rows_read, nrows):
+    '''estimate read progress from the row limit or the position in the file'''
+    if nrows:
+        return min(rows_read / nrows, 1.0)
+    if total_bytes and hasattr(file, 'tell'):
+        try:
+            return min(file.tell() / total_bytes, 1.0)
+        except (OSError, ValueError):
+            pass
+    return 0.0
+
+#--------------------------------EXCEL--------------------------------
+
+#function to hash the content of an uploaded file
+
+def hash_file(file):
+    '''return the hex blake2b digest of a path or binary file-like object, leaving the file at its start'''
+    digest = hashlib.blake2b(digest_size=20)
+    f = open(file, "rb") if isinstance(file, (str, os.PathLike)) else file
+    try:
+        f.seek(0)
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+        f.seek(0)
+    finally:
+        if f is not file:
+            f.close()
+    return digest.hexdigest()
+
+#function to list the sheets of a workbook, caching the workbook under its content hash
+
+def get_excel_sheets(file, cache_dir):
+    """
+    List the sheets of an uploaded workbook without parsing them
+
+    The workbook is copied to cache_dir under its content hash, keeping its
+    extension (openpyxl reads .xlsx and .xlsm by their extension), so its
+    sheets can be loaded later (by read_excel_sheets) without the upload, and
+    the sheet names are cached next to it.
+
+    Args:
+        file: A path or a binary file-like object (such as a Streamlit UploadedFile)
+        cache_dir (str): The folder holding converted workbooks
+
+    Returns:
+        tuple: (content hash of the workbook, list of sheet names)
+    """
+    from openpyxl import load_workbook
+
+    digest = hash_file(file)
+    workbook_dir = os.path.join(cache_dir, digest)
+    sheets_path = os.path.join(workbook_dir, "sheets.json")
+    if os.path.exists(sheets_path):
+        os.utime(workbook_dir)  # keep recently used workbooks in the cache
+        with open(sheets_path) as f:
+            return digest, json.load(f)
+
+    os.makedirs(workbook_dir, exist_ok=True)
+    extension = os.path.splitext(str(file) if isinstance(file, (str, os.PathLike)) else getattr(file, 'name', ""))[1].lower()
+    workbook_path = os.path.join(workbook_dir, f"workbook{extension if extension in EXCEL_EXTENSIONS else '.xlsx'}")
+    if isinstance(file, (str, os.PathLike)):
+        shutil.copyfile(file, workbook_path)
+    else:
+        with open(workbook_path, "wb") as f:
+            shutil.copyfileobj(file, f)
+        file.seek(0)
+    # read-only mode only reads the workbook's index, not the sheets
+    workbook = load_workbook(workbook_path, read_only=True)
+    sheet_names = workbook.sheetnames
+    workbook.close()
+    with open(sheets_path, "w") as f:
+        json.dump(sheet_names, f)
+    return digest, sheet_names
+
+#function to parse one sheet of a workbook
+
+def read_excel_sheet(path, sheet_name):
+    """
+    Parse one sheet of a workbook by streaming its rows
+
+    The first row holds the column names. The rows are converted
+    EXCEL_CHUNK_ROWS at a time, and the chunks get the same schema rules as
+    CSV uploads: the schema is inferred from the first chunk (see
+    infer_schema), widened by later chunks that do not fit it (see
+    conform_chunk) and the chunks are combined by concat_chunks. Cells of
+    text columns that hold numbers or dates too are stored as text.
+
+    Args:
+        path (str): The workbook file
+        sheet_name (str): The sheet to parse
+
+    Returns:
+        pandas.DataFrame: The sheet's data
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows, ())
+        names, chunks, schema = _column_names(header, len(header)), [], {}
+        for batch in iter(lambda: list(itertools.islice(rows, EXCEL_CHUNK_ROWS)), []):
+            width = max(len(record) for record in batch)
+            if width > len(names):
+                # a row longer than the ones before adds columns, empty in the earlier chunks
+                names = _column_names(header, width)
+                chunks = [chunk.reindex(columns=names) for chunk in chunks]
+            chunk = pd.DataFrame.from_records(batch, columns=range(len(names)))
+            chunk.columns = names
+            chunk = _text_cells(chunk.dropna(how="all"))  # formatting can make read-only mode report empty trailing rows
+            # a column is locked by the first chunk it has values in, read-only mode pads rows with empty cells
+            schema.update({col: dtype for col, dtype in infer_schema(chunk).items() if col not in schema and chunk[col].notna().any()})
+            chunks.append(conform_chunk(chunk, schema))
+    finally:
+        workbook.close()
+    if not chunks:
+        return pd.DataFrame(columns=names)
+    schema.update({col: 'object' for col in names if col not in schema})
+    # columns widened to text after their first chunks hold numbers or dates in those chunks
+    return _text_cells(concat_chunks(chunks, schema))
+
+def _text_cells(df):
+    '''store the cells of text (object) columns that hold numbers or dates as text, leaving missing cells missing'''
+    for col in df.columns:
+        if pd.api.types.is_object_dtype(df[col]):
+            df[col] = df[col].map(lambda value: value if isinstance(value, str) or pd.isna(value) else str(value))
+    return df
+
+#function to load sheets of a workbook from the converted cache or by parsing them in parallel
+
+def read_excel_sheets(digest, sheet_names, cache_dir, progress_callback=None):
+    """
+    Load sheets of a workbook listed by get_excel_sheets
+
+    Sheets converted before are read back from their Arrow file in the
+    cache. The others are parsed, in parallel worker processes when there
+    are several of them and the workbook is large, and then cached.
+    Workbooks are evicted from the cache with the uploads (see
+    evict_upload_cache in store_functions), so get_excel_sheets may have to
+    copy the workbook again.
+
+    Args:
+        digest (str): The content hash returned by get_excel_sheets
+        sheet_names (list): The sheets to load
+        cache_dir (str): The folder holding converted workbooks
+        progress_callback (callable, optional): Called with a float between 0 and 1 after each sheet
+
+    Returns:
+        dict: Mapping of sheet name to DataFrame, in the order of sheet_names
+
+    Raises:
+        FileNotFoundError: If the workbook is no longer in the cache
+    """
+    workbook_dir = os.path.join(cache_dir, digest)
+    os.utime(workbook_dir)  # keep recently used workbooks in the cache
+    workbook_path = next((os.path.join(workbook_dir, f"workbook{extension}") for extension in EXCEL_EXTENSIONS
+                          if os.path.exists(os.path.join(workbook_dir, f"workbook{extension}"))), None)
+    if workbook_path is None:
+        raise FileNotFoundError(f"the workbook {digest} is not in the cache")
+    with open(os.path.join(workbook_dir, "sheets.json")) as f:
+        all_sheets = json.load(f)
+    arrow_paths = {name: os.path.join(workbook_dir, f"sheet{all_sheets.index(name)}.arrow") for name in sheet_names}
+
+    frames = {name: feather.read_feather(path) for name, path in arrow_paths.items() if os.path.exists(path)}
+    missing = [name for name in sheet_names if name not in frames]
+
+    def sheet_done(name, df):
+        feather.write_feather(df, arrow_paths[name] + ".partial")
+        os.replace(arrow_paths[name] + ".partial", arrow_paths[name])
+        frames[name] = df
+        if progress_callback is not None:
+            progress_callback(len(frames) / len(sheet_names))
+
+    workers = min(len(missing), EXCEL_MAX_WORKERS, os.cpu_count() or 1)
+    if workers > 1 and os.path.getsize(workbook_path) >= EXCEL_PARALLEL_MIN_BYTES:
+        # openpyxl is pure Python, so sheets only parse in parallel in separate processes
+        with ProcessPoolExecutor(workers, mp_context=clean_main_context("spawn")) as pool:
+            futures = {pool.submit(read_excel_sheet, workbook_path, name): name for name in missing}
+            for future in as_completed(futures):
+                sheet_done(futures[future], future.result())
+    else:
+        for name in missing:
+            sheet_done(name, read_excel_sheet(workbook_path, name))
+    return {name: frames[name] for name in sheet_names}
+
+#function to combine several sheets into one dataset
+
+def combine_sheets(frames):
+    '''return the only sheet as it is, or stack several sheets with a "sheet" column naming their source'''
+    if len(frames) == 1:
+        return next(iter(frames.values()))
+    return pd.concat([df.assign(sheet=name) for name, df in frames.items()], ignore_index=True)
+
+def _column_names(header, n_columns):
+    '''return unique text column names from a header row, naming blank ones like pandas does'''
+    names = []
+    for position in range(n_columns):
+        name = header[position] if position < len(header) else None
+        name = f"Unnamed: {position}" if name is None or str(name).strip() == "" else str(name)
+        unique, copy = name, 0
+        while unique in names:
+            copy += 1
+            unique = f"{name}.{copy}"
+        names.append(unique)
+    return names
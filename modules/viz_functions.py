@@ -0,0 +1,317 @@
+# ------Description: This file contains functions that prepare small chart-ready data for the visualization page------
+
+import numpy as np
+import pandas as pd
+
+from modules.timing_functions import timed
+
+MAX_LINE_POINTS = 2000            # points kept per line after downsampling
+MAX_SCATTER_POINTS = 5000         # above this many rows scatter plots are binned
+SCATTER_BINS = 100                # bins per axis for binned scatter plots
+MAX_HUE_GROUPS = 10               # hue groups kept, numeric hues with more values are binned into this many ranges
+MAX_AXIS_CATEGORIES = 50          # categories kept on a text histogram axis, the rest are counted as "other"
+OTHER_LABEL = "other"
+
+#--------------------------------LINE CHARTS--------------------------------
+
+#function to pick the rows that best preserve the shape of a line (Largest-Triangle-Three-Buckets)
+
+def lttb_indices(x, y, n_out):
+    """
+    Downsample a line with the Largest-Triangle-Three-Buckets algorithm
+
+    The first and last points are always kept. The other points are split into
+    n_out - 2 buckets, and from each bucket the point forming the largest
+    triangle with the previously kept point and the average of the next bucket
+    is kept, which preserves peaks and troughs.
+
+    Args:
+        x (numpy.ndarray): Sorted x values (float)
+        y (numpy.ndarray): y values (float)
+        n_out (int): Number of points to keep
+
+    Returns:
+        numpy.ndarray: Positions of the kept points
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        area = np.abs((x[previous] - avg_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        kept[bucket + 1] = previous
+    return kept
+
+#function to prepare line chart data, downsampled per group
+
+@timed()
+def line_chart_data(df, x, y, group=None, max_points=MAX_LINE_POINTS):
+    """
+    Prepare the rows for a line chart, keeping at most max_points per line
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        x (str): The x-axis column
+        y (str): The y-axis column (numeric)
+        group (str, optional): Draw one line per value of this column
+        max_points (int): Points kept per line
+
+    Returns:
+        pandas.DataFrame: The rows to plot, sorted by x
+    """
+    columns = list(dict.fromkeys(col for col in (x, y, group) if col is not None))
+    data = df[columns].dropna(subset=list(dict.fromkeys([x, y])))
+    data = data.sort_values(x, kind="stable")
+    groups = [data] if group is None else [part for _, part in data.groupby(group, observed=True, sort=False)]
+    parts = []
+    for part in groups:
+        if len(part) > max_points:
+            x_values = _as_float(part[x])
+            part = part.iloc[lttb_indices(x_values, _as_float(part[y]), max_points)]
+        parts.append(part)
+    return pd.concat(parts) if parts else data
+
+#--------------------------------SCATTER PLOTS--------------------------------
+
+#function to prepare scatter plot data, binning large datasets into a density grid
+
+@timed()
+def scatter_chart_data(df, x, y, hue=None, max_points=MAX_SCATTER_POINTS, bins=SCATTER_BINS):
+    """
+    Prepare the points for a scatter plot
+
+    Small datasets are returned as they are. Larger ones are binned into a
+    bins x bins grid per hue group with numpy.histogramdd, and every non-empty
+    cell becomes one point at its centre with the number of rows it holds.
+    Numeric hues with more than MAX_HUE_GROUPS values are binned into ranges.
+    Text hues with more values, and text axes, are plotted as a uniform sample.
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        x (str): The x-axis column
+        y (str): The y-axis column
+        hue (str, optional): Color points by this column
+        max_points (int): Largest number of rows plotted without binning
+        bins (int): Bins per axis when binning
+
+    Returns:
+        tuple: (DataFrame to plot, name of the column holding the row count per
+        point or None when the rows were not binned)
+    """
+    columns = list(dict.fromkeys(col for col in (x, y, hue) if col is not None))
+    data = df[columns].dropna(subset=list(dict.fromkeys([x, y])))
+    if len(data) <= max_points:
+        return data, None
+    hue_codes, hue_labels = (np.zeros(len(data), dtype=np.int64), [None]) if hue is None else \
+        _group_codes(data[hue], MAX_HUE_GROUPS, lump=False)
+    if not (_is_continuous(data[x]) and _is_continuous(data[y])) or x == y or hue_codes is None:
+        # text axes and ID-like hues cannot be binned, so plot a uniform sample instead
+        return data.sample(max_points, random_state=0), None
+
+    x_values, y_values = _as_float(data[x]), _as_float(data[y])
+    x_edges = np.linspace(x_values.min(), x_values.max(), bins + 1)
+    y_edges = np.linspace(y_values.min(), y_values.max(), bins + 1)
+    x_centres = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centres = (y_edges[:-1] + y_edges[1:]) / 2
+    # one pass over the rows bins every hue group at once, rows without a hue (code -1) fall outside the edges
+    counts, _ = np.histogramdd((x_values, y_values, hue_codes),
+                               bins=[x_edges, y_edges, np.arange(len(hue_labels) + 1) - 0.5])
+    x_bin, y_bin, group = np.nonzero(counts)
+    result = pd.DataFrame({x: _from_float(x_centres[x_bin], data[x]), y: _from_float(y_centres[y_bin], data[y]),
+                           "rows": counts[x_bin, y_bin, group].astype(int)})
+    if hue is not None:
+        result[hue] = pd.Series(hue_labels, dtype=object).to_numpy()[group]
+    return result, "rows"
+
+#--------------------------------BAR CHARTS--------------------------------
+
+BAR_AGGREGATIONS = {"Sum": "sum", "Mean": "mean", "Count": "count"}
+
+#function to prepare bar chart data as one row per bar
+
+@timed()
+def bar_chart_data(df, x, y, hue=None, aggregation="Sum"):
+    """
+    Aggregate the dataset to one row per bar (and hue group)
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        x (str): The category column
+        y (str): The value column, counted when it is not numeric
+        hue (str, optional): Split each bar by this column
+        aggregation (str): One of the keys of BAR_AGGREGATIONS
+
+    Returns:
+        pandas.DataFrame: One row per bar with the aggregated y value
+    """
+    keys = list(dict.fromkeys(col for col in (x, hue) if col is not None))
+    how = BAR_AGGREGATIONS[aggregation]
+    if how != "count" and not pd.api.types.is_numeric_dtype(df[y]):
+        how = "count"
+    if y in keys:
+        return df.groupby(keys, observed=True, dropna=False).size().rename("count").reset_index()
+    return df.groupby(keys, observed=True, dropna=False)[y].agg(how).reset_index()
+
+#--------------------------------HISTOGRAMS--------------------------------
+
+#function to count the rows of a bivariate histogram per hue group
+
+@timed()
+def histogram_bins(df, x, y, hue=None, bins=10):
+    """
+    Count rows per (x, y) bin and hue group with numpy.histogram2d
+
+    Numeric and datetime axes get ``bins`` equal-width bins over their range.
+    Text and categorical axes get one bin per category, for their
+    MAX_AXIS_CATEGORIES most frequent categories, the others share an "other"
+    bin. Hues are capped to MAX_HUE_GROUPS groups the same way (numeric hues
+    are binned into ranges).
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        x (str): The x-axis column
+        y (str): The y-axis column
+        hue (str, optional): Count each value of this column separately
+        bins (int): Number of bins for numeric axes
+
+    Returns:
+        dict: 'x_edges' and 'y_edges' (bin edges), 'x_labels' and 'y_labels'
+        (category names, or None for numeric axes) and 'counts' (mapping of hue
+        value, or None without hue, to a 2D array of counts)
+    """
+    columns = list(dict.fromkeys(col for col in (x, y, hue) if col is not None))
+    data = df[columns].dropna(subset=list(dict.fromkeys([x, y])))
+    x_values, x_edges, x_labels = _histogram_axis(data[x], bins)
+    y_values, y_edges, y_labels = _histogram_axis(data[y], bins)
+
+    hue_codes, hue_labels = (np.zeros(len(data), dtype=np.int64), [None]) if hue is None else \
+        _group_codes(data[hue], MAX_HUE_GROUPS)
+    # one pass over the rows counts every hue group at once, rows without a hue (code -1) fall outside the edges
+    grid, _ = np.histogramdd((x_values, y_values, hue_codes),
+                             bins=[x_edges, y_edges, np.arange(len(hue_labels) + 1) - 0.5])
+    counts = {label: grid[:, :, number] for number, label in enumerate(hue_labels)}
+    return {'x_edges': x_edges, 'y_edges': y_edges, 'x_labels': x_labels, 'y_labels': y_labels, 'counts': counts}
+
+#function to draw a bivariate histogram from precomputed counts
+
+@timed()
+def render_histogram(hist, x, y, hue=None):
+    """
+    Draw the counts from histogram_bins as a heatmap and return it as a PNG
+
+    Each hue group is drawn in its own color, with empty bins left transparent.
+
+    Args:
+        hist (dict): The result of histogram_bins
+        x (str): The x-axis label
+        y (str): The y-axis label
+        hue (str, optional): The legend title
+
+    Returns:
+        bytes: The rendered PNG
+    """
+    import io
+    from matplotlib import colormaps
+    from matplotlib.colors import LinearSegmentedColormap, to_rgba
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Patch
+
+    # a Figure outside pyplot renders with the Agg canvas and needs no global backend
+    fig = Figure(figsize=(18, 12))
+    ax = fig.subplots()
+    palette = colormaps["tab10"]
+    handles = []
+    for number, (value, counts) in enumerate(hist['counts'].items()):
+        color = palette(number % 10)
+        cmap = LinearSegmentedColormap.from_list("", [to_rgba(color, 0.1), to_rgba(color, 0.9)])
+        ax.pcolormesh(hist['x_edges'], hist['y_edges'], np.ma.masked_equal(counts.T, 0), cmap=cmap)
+        handles.append(Patch(color=color, label=str(value)))
+    for axis, labels in ((ax.xaxis, hist['x_labels']), (ax.yaxis, hist['y_labels'])):
+        if labels is not None:
+            axis.set_ticks(np.arange(len(labels)), labels=labels)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    if hue is not None:
+        ax.legend(handles=handles, title=hue)
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight", dpi=72)
+    return buffer.getvalue()
+
+def _histogram_axis(series, bins):
+    '''return (values as floats, bin edges, category labels or None) for one histogram axis'''
+    if _is_continuous(series):
+        values = _as_float(series)
+        low, high = (values.min(), values.max()) if len(values) else (0.0, 1.0)
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        edges = np.linspace(low, high, bins + 1)
+        return values, edges, None
+    codes, labels = _group_codes(series, MAX_AXIS_CATEGORIES)
+    return codes.astype(float), np.arange(len(labels) + 1) - 0.5, [str(label) for label in labels]
+
+#--------------------------------HELPERS--------------------------------
+
+#function to number the groups of a column, capping how many there are
+
+def _group_codes(series, max_groups, lump=True):
+    """
+    Factorize a column into group codes, keeping at most max_groups groups
+
+    Numeric and datetime columns with more values are binned into max_groups
+    equal-width ranges. Text columns keep their max_groups - 1 most frequent
+    values and the rest share OTHER_LABEL, or with lump=False are not grouped.
+
+    Args:
+        series (pandas.Series): The column
+        max_groups (int): Largest number of groups
+        lump (bool): Put rare text values in an OTHER_LABEL group
+
+    Returns:
+        tuple: (numpy.ndarray of codes, -1 for missing values, list of group
+        labels), or (None, None) when a text column has too many values and lump is False
+    """
+    codes, labels = pd.factorize(series, sort=True)
+    if len(labels) <= max_groups:
+        return codes, list(labels)
+    if _is_continuous(series):
+        binned = pd.cut(series, max_groups)
+        return binned.cat.codes.to_numpy(dtype=np.int64), [str(interval) for interval in binned.cat.categories]
+    if not lump:
+        return None, None
+    # keep the most frequent values, in sorted order, and renumber the others as the last group
+    counts = np.bincount(codes[codes >= 0], minlength=len(labels))
+    kept = np.sort(np.argsort(-counts, kind="stable")[:max_groups - 1])
+    mapping = np.full(len(labels) + 1, max_groups - 1, dtype=np.int64)
+    mapping[kept] = np.arange(len(kept))
+    mapping[-1] = -1
+    return mapping[codes], [labels[code] for code in kept] + [OTHER_LABEL]
+
+def _is_continuous(series):
+    '''return True for numeric and datetime columns'''
+    return (pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)) \
+        or pd.api.types.is_datetime64_any_dtype(series)
+
+def _as_float(series):
+    '''return the values of a column as floats, using positions for text columns'''
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.to_numpy().astype("datetime64[ns]").astype(np.int64).astype(float)
+    if _is_continuous(series) or pd.api.types.is_bool_dtype(series):
+        return series.to_numpy(dtype=float)
+    return np.arange(len(series), dtype=float)
+
+def _from_float(values, like):
+    '''convert floats from _as_float back to the dtype of the original column'''
+    if pd.api.types.is_datetime64_any_dtype(like):
+        return pd.to_datetime(values.astype(np.int64))
+    return values
+
@@ -1,6 +1,10 @@
 import streamlit as st
 import pandas as pd
-from modules.shared_functions import *
+from modules.shared_functions import switch_page
+from modules.upload_functions import read_csv_chunked, get_excel_sheets, read_excel_sheets, combine_sheets, hash_file
+from modules.store_functions import get_dataframe, has_dataframe, get_shared_cache_dir, load_uploaded_dataset, update_dataframe, get_cached_result
+from modules.grid_functions import show_data_grid
+from modules.optimize_functions import optimize_dtypes, restore_dtypes
 
 # Setup the page
 st.set_page_config(page_title="Upload Your Data", page_icon="📈", layout="wide")
@@ -14,6 +18,42 @@ st.sidebar.write("The maximum file size allowed is 200MB.")
 st.sidebar.write("*Disclaimer - Tada does not store your data. Once you close the app, your data is deleted. Tada is also not responsible for the security of your data*")
 st.sidebar.divider()
 
+# Loading options for large CSV files
+with st.expander("Loading options"):
+    load_mode = st.radio("How much of the file should be loaded?", ["Full file", "First N rows", "Random sample"],
+                         key="load_mode", horizontal=True,
+                         help="Loading only part of a large CSV file makes it available much sooner")
+    if load_mode == "First N rows":
+        st.number_input("Number of rows to load", min_value=1, value=100_000, step=10_000, key="load_nrows")
+    elif load_mode == "Random sample":
+        st.slider("Percentage of rows to sample", min_value=1, max_value=100, value=10, key="load_sample_pct")
+
+EXCEL_TYPES = ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "application/vnd.ms-excel.sheet.macroEnabled.12")
+
+# Load the chosen sheets of the uploaded workbook, converted sheets are cached by the workbook's content
+def load_excel_sheets():
+    workbook = st.session_state['excel_workbook']
+    sheets = st.session_state.get('excel_sheet_choice') or workbook['sheets'][:1]
+    def parse():
+        progress_bar = st.progress(0.0, text="Reading sheets...")
+        def read():
+            return read_excel_sheets(workbook['digest'], sheets, get_shared_cache_dir("excel"),
+                                     progress_callback=lambda done: progress_bar.progress(done, text="Reading sheets..."))
+        try:
+            frames = read()
+        except FileNotFoundError:
+            # the workbook was evicted from the shared cache since it was listed, so it is copied from the upload again
+            get_excel_sheets(st.session_state['uploaded_file'], get_shared_cache_dir("excel"))
+            frames = read()
+        progress_bar.empty()
+        return combine_sheets(frames)
+    try:
+        # a workbook another session already loaded with the same sheets is not read again
+        load_uploaded_dataset(workbook['digest'], ("excel", tuple(sheets)), parse)
+        st.success("File uploaded successfully!")
+    except Exception as e:
+        st.error(f"An error occurred while reading the file: {e}")
+
 # File uploader with callback
 def handle_file_upload():
     uploaded_file = st.session_state['uploaded_file']
@@ -22,12 +62,29 @@ def handle_file_upload():
             st.error("File size exceeds the 200MB limit")
             return
 
+        st.session_state.pop('excel_workbook', None)
+        st.session_state.pop('excel_sheet_choice', None)
+        st.session_state.pop('original_dtypes', None)
+        st.session_state.pop('dtype_report', None)
         try:
-            if uploaded_file.type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" or uploaded_file.type == "application/vnd.ms-excel.sheet.macroEnabled.12":
-                df = pd.read_excel(uploaded_file)
-            else:
-                df = pd.read_csv(uploaded_file)
-            st.session_state['main_df'] = df
+            if uploaded_file.type in EXCEL_TYPES:
+                # only the list of sheets is read here, workbooks with several sheets wait for the user's choice
+                digest, sheets = get_excel_sheets(uploaded_file, get_shared_cache_dir("excel"))
+                st.session_state['excel_workbook'] = {'digest': digest, 'sheets': sheets}
+                if len(sheets) == 1:
+                    load_excel_sheets()
+                return
+            load_mode = st.session_state.get('load_mode', "Full file")
+            nrows = st.session_state.get('load_nrows') if load_mode == "First N rows" else None
+            sample_frac = st.session_state.get('load_sample_pct', 100) / 100 if load_mode == "Random sample" else None
+            def parse():
+                progress_bar = st.progress(0.0, text="Reading file...")
+                df = read_csv_chunked(uploaded_file, nrows=nrows, sample_frac=sample_frac,
+                                      progress_callback=lambda done: progress_bar.progress(done, text="Reading file..."))
+                progress_bar.empty()
+                return df
+            # a file any session already uploaded with the same options is not parsed again
+            load_uploaded_dataset(hash_file(uploaded_file), ("csv", nrows, sample_frac), parse)
             st.success("File uploaded successfully!")
         except Exception as e:
             st.error(f"An error occurred while reading the file: {e}")
@@ -35,14 +92,58 @@ def handle_file_upload():
 st.file_uploader("Choose a CSV, XLSX, or XLSM file", type=["csv", "xlsx", "xlsm"],
                  on_change=handle_file_upload, key="uploaded_file")
 
+# Sheet selection for workbooks with several sheets
+workbook = st.session_state.get('excel_workbook')
+if workbook is not None and len(workbook['sheets']) > 1 and st.session_state.get('uploaded_file') is not None:
+    st.multiselect("Sheets to load", workbook['sheets'], default=workbook['sheets'][:1], key="excel_sheet_choice",
+                   help="Several sheets are stacked into one table, with a 'sheet' column naming the sheet of each row")
+    st.button("Load sheets", on_click=load_excel_sheets)
+
+# Store the columns in smaller types, remembering the original types so they can be restored
+def optimize_memory():
+    new_df, report = optimize_dtypes(get_dataframe())
+    st.session_state['dtype_report'] = report
+    if report.empty:
+        return
+    original_dtypes = st.session_state.setdefault('original_dtypes', {})
+    for col, dtype in zip(report['column'], report['dtype']):
+        original_dtypes.setdefault(col, dtype)  # a column optimized twice is restored to its first type
+    update_dataframe(new_df, changed_columns=report['column'].tolist(), description="Optimize memory")
+
+# Cast the optimized columns back to their original types
+def restore_column_types():
+    new_df, restored = restore_dtypes(get_dataframe(), st.session_state.pop('original_dtypes', {}))
+    st.session_state.pop('dtype_report', None)
+    if restored:
+        update_dataframe(new_df, changed_columns=restored, description="Restore column types")
+
 # Display the current data if it exists
-if 'main_df' in st.session_state and not st.session_state['main_df'].empty:
+if has_dataframe():
     st.write("Current data loaded:")
-    st.dataframe(st.session_state['main_df'])
+    show_data_grid(get_dataframe(), key="upload_grid")
+
+    with st.expander("Optimize memory"):
+        st.write("Store numbers in the smallest type that holds them exactly, text with few distinct values as categories and other text as Arrow strings. The values do not change.")
+        df = get_dataframe()
+        nbytes = get_cached_result("memory_usage", (), lambda: int(df.memory_usage(index=False, deep=True).sum()))
+        st.caption(f"The data currently uses {nbytes / 1024**2:,.1f} MB")
+        optimize_col, restore_col = st.columns(2)
+        with optimize_col:
+            st.button("Optimize memory", on_click=optimize_memory, use_container_width=True)
+        with restore_col:
+            st.button("Restore original types", on_click=restore_column_types, use_container_width=True,
+                      disabled=not st.session_state.get('original_dtypes'))
+        report = st.session_state.get('dtype_report')
+        if report is not None:
+            if report.empty:
+                st.info("Every column already uses its smallest type.")
+            else:
+                st.write(f"Saved {report['bytes saved'].sum() / 1024**2:,.1f} MB:")
+                st.dataframe(report, hide_index=True)
 
 # Navigation button
 col1, col2 = st.columns([18, 1])
 with col2:
     if st.button("Next", key="next_button", help="Move to next step"):
-        if 'main_df' in st.session_state and not st.session_state['main_df'].empty:
+        if has_dataframe():
             switch_page("STEP1-Preprocessing")  # Function to navigate to the next step
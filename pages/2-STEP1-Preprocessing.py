@@ -1,8 +1,19 @@
+import os
 import streamlit as st
 import pandas as pd
-from datetime import datetime
-from modules.shared_functions import *
+from modules.shared_functions import switch_page, convert_actions_to_pnyb
 from modules.preproc_functions import *
+from modules.pipeline_functions import describe_step, plan_to_code, plan_to_json, PREVIEW_ROWS
+from modules.store_functions import (get_dataframe, has_dataframe, get_dataset_profile,
+                                     get_outlier_scores, get_row_index, get_history, get_dataframe_at_step,
+                                     undo_last_change, redo_last_change, get_applied_plan,
+                                     get_plan_preview, get_store_dir, get_export, submit_steps, get_running_jobs,
+                                     collect_finished_jobs, cancel_jobs, get_session_id, get_cached_result)
+from modules.export_functions import EXPORT_FORMATS
+from modules.encoding_functions import ENCODING_METHODS, SCALING_METHODS, ONEHOT_MAX_CATEGORIES, onehot_nbytes
+from modules.reduction_functions import find_correlated_features, suggest_drops, fit_pca, CORR_THRESHOLD
+from modules.timing_functions import timed, start_rerun, finish_rerun, show_timing_panel, rerun, stop
+from modules.grid_functions import show_data_grid
 
 # TODO
 # Implment the rest of the tab methods
@@ -10,194 +21,401 @@ from modules.preproc_functions import *
 # Fix user feedback on each tab
 
 st.set_page_config(page_title="Pre-Process Your Data", page_icon="📈", layout="wide")
+start_rerun("Preprocessing", get_session_id())
 
 st.header("Pre-Processing")
 
 st.sidebar.header("Preprocessing")
 st.sidebar.write("preprocessing is the process of preparing data for analysis. It is the first and crucial step in data analysis. It involves cleaning, transforming, and encoding data to make it ready for machine learning models.")
 
-# Check if the main dataframe is in the session state
-if 'main_df' not in st.session_state:
-    st.session_state.main_df = pd.DataFrame()
-
 # If no data is uploaded yet, prompt the user
-if st.session_state.main_df.empty:
+if not has_dataframe():
     st.error("You haven't uploaded any data yet!")
     button = st.button("UPLOAD DATA NOW")
     if button:
         # Assuming switch_page function exists to handle page switching
         switch_page("UPLOAD")
-else:
-    df = st.session_state.main_df
+    stop()
+
+# slow steps run as background jobs, their results are stored on the first run after they finish
+for job in collect_finished_jobs():
+    if job.status == "done":
+        st.success(f"{job.description}: done")
+    elif job.status == "failed":
+        st.error(f"{job.description} failed: {job.error}")
+    elif job.status == "cancelled":
+        st.info(f"{job.description}: cancelled")
+    else:
+        st.warning(f"{job.description} was discarded because the data changed while it was running")
+
+@st.fragment(run_every=0.5)
+def show_running_jobs():
+    running = get_running_jobs()
+    if not running:
+        rerun()  # rerun the whole page so the result is stored and shown
+    for job in running:
+        st.progress(job.progress, text=f"{job.description}...")
+    st.button("Cancel", on_click=cancel_jobs)
+
+jobs_running = bool(get_running_jobs())
+if jobs_running:
+    show_running_jobs()
+
+df = get_dataframe()
+
+# Undo history: every step is kept as a small delta, so going back and forth is cheap
+st.sidebar.divider()
+st.sidebar.subheader("History")
+history_steps, history_position, history_bytes = get_history()
+undo_col, redo_col = st.sidebar.columns(2)
+with undo_col:
+    # a running job's result is saved over the current data, so the history stays put until it is done
+    st.button("Undo", on_click=undo_last_change, disabled=history_position == 0 or jobs_running, use_container_width=True)
+with redo_col:
+    st.button("Redo", on_click=redo_last_change, disabled=history_position == len(history_steps) or jobs_running,
+              use_container_width=True)
+view_step = st.sidebar.selectbox("View the data after step", range(len(history_steps) + 1), index=history_position,
+                                 format_func=lambda step: "0. Uploaded data" if step == 0 else f"{step}. {history_steps[step - 1]}")
+st.sidebar.caption(f"{history_position} of {len(history_steps)} steps applied, history uses {history_bytes / 1024:.1f} KB")
 
 
 tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["Remove Duplicates", "Handle Missing Data", "Handle Outliers", "Feature Engineering", "Encoding", "Scaling", "Dimensionality Reduction"])
 
 #--------------- Call back functions ----------------------------------
 
-def update_dataframe(new_df):
-    st.session_state['main_df'] = new_df
-    st.session_state['last_updated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+OUTLIER_METHODS = {"Z-score": "zscore", "IQR": "iqr"}
+LEAVE_AS_IS = "Leave as is"
 
+# In preview mode steps are only recorded in a plan and shown on a sample,
+# otherwise they run on the full data straight away
+def run_step(step):
+    run_steps([step])
+
+def run_steps(steps):
+    if st.session_state.get('lazy_mode'):
+        st.session_state['pending_plan'].extend(steps)
+    else:
+        submit_steps(steps)
+
+@timed()
+def apply_pending_plan():
+    submit_steps(st.session_state['pending_plan'])
+    st.session_state['pending_plan'] = []
+
+def discard_pending_plan():
+    st.session_state['pending_plan'] = []
+
+@timed()
 def handle_duplicates():
-    df = st.session_state['main_df']
-    df = remove_duplicate_rows(df)
-    update_dataframe(df)
-    
-def handle_missing_data():
-    df = st.session_state['main_df']
-    fill_feature = st.session_state['fill_feature']
-    fill_method = st.session_state['fill_method']
-    fill_value = st.session_state['fill_value'] if 'fill_value' in st.session_state else None
-
-    if fill_method == "Fill with mean":
-        fill_value = df[fill_feature].mean()
-    elif fill_method == "Fill with median":
-        fill_value = df[fill_feature].median()
-    elif fill_method == "Fill with mode":
-        fill_value = df[fill_feature].mode()[0]
+    subset = st.session_state.get('duplicate_subset') or None
+    run_step({'op': 'drop_duplicates', 'subset': subset})
     
-    df[fill_feature].fillna(fill_value, inplace=True)
-    update_dataframe(df)
-    st.success("Missing data handled successfully!")
-
+# Turn the rows of the missing data table into fill steps, all run together in one pass
+@timed()
+def handle_missing_data(fill_table, df):
+    steps, errors = [], []
+    numeric_features = set(get_numerical_features(df))
+    for feature, row in fill_table.iterrows():
+        if row['method'] == LEAVE_AS_IS:
+            continue
+        numeric = feature in numeric_features
+        if row['method'] in GROUP_FILL_METHODS and not numeric:
+            errors.append(f"{feature}: {row['method'].lower()} needs a numeric column")
+            continue
+        value = row['value']
+        if row['method'] == "Fill with custom value":
+            if pd.isna(value) or value == "":
+                errors.append(f"{feature}: enter a custom value")
+                continue
+            if numeric:
+                try:
+                    value = float(value)
+                except ValueError:
+                    errors.append(f"{feature}: {value!r} is not a number")
+                    continue
+        by = row['group by'] if pd.notna(row['group by']) and row['group by'] != feature else None
+        steps.append({'op': 'fill', 'column': feature, 'method': row['method'], 'value': value, 'by': by})
+    if not errors and steps:
+        run_steps(steps)
+    return steps, errors
+
+@timed()
 def handle_outliers():
-    df = st.session_state['main_df']
     feature = st.session_state['outlier_feature']
     threshold = st.session_state['outlier_threshold']
-    df = remove_outliers(df, feature, threshold)  # Assuming this function modifies df directly
-    update_dataframe(df)
-    st.success("Outliers handled successfully!")
+    method = OUTLIER_METHODS[st.session_state.get('outlier_method', "Z-score")]
+    run_step({'op': 'remove_outliers', 'columns': [feature], 'method': method, 'threshold': threshold})
+
+def get_working_data():
+    '''return the data the tabs work on, with its row index, profile, outlier scores and the key results computed from it are cached under'''
+    if st.session_state.get('lazy_mode'):
+        pending_plan = st.session_state['pending_plan']
+        preview_df = get_plan_preview(pending_plan)
+        row_index = build_row_index(preview_df)
+        profile = profile_dataframe(preview_df, row_index)
+        scores = compute_outlier_scores(preview_df, stats=profile['columns'])
+        return preview_df, row_index, profile, scores, ("preview", repr(pending_plan))
+    # statistics of the full data come from caches keyed by the dataset version
+    return get_dataframe(), get_row_index(), get_dataset_profile(), get_outlier_scores(), ("full",)
 
 
 #-----------------------------------------------------------------------
 
+# Preview mode: record steps as a plan, preview them on a sample, then run the plan once on the full data
+st.sidebar.divider()
+st.sidebar.subheader("Preview Mode")
+st.session_state.setdefault('pending_plan', [])
+lazy_mode = st.sidebar.toggle("Preview changes on a sample", key="lazy_mode",
+                              help=f"Changes are recorded as a plan and shown on a sample of {PREVIEW_ROWS} rows. Apply the plan to run it once on the full data.")
+if lazy_mode:
+    for number, step in enumerate(st.session_state['pending_plan'], 1):
+        st.sidebar.write(f"{number}. {describe_step(step)}")
+    apply_col, discard_col = st.sidebar.columns(2)
+    with apply_col:
+        st.button("Apply plan", on_click=apply_pending_plan, disabled=not st.session_state['pending_plan'] or jobs_running, use_container_width=True)
+    with discard_col:
+        st.button("Discard plan", on_click=discard_pending_plan, disabled=not st.session_state['pending_plan'], use_container_width=True)
+
+df, row_index, profile, scores, source = get_working_data()
 
 with tab1:
     st.subheader("Remove Duplicates")
-    num_duplicates = count_duplicate_rows(df)
+    subset = st.multiselect("Only compare these columns (leave empty to compare whole rows)", df.columns, key="duplicate_subset")
+    num_duplicates = count_duplicate_rows(df, subset, row_index) if subset else profile['duplicates']
     if num_duplicates > 0:
         st.write(f"There are {num_duplicates} duplicate rows in your data.")
-        st.button("Remove All Duplicates", on_click=handle_duplicates)
+        st.button("Remove All Duplicates", on_click=handle_duplicates, disabled=jobs_running)
     else:
         st.write("No duplicate rows found!")
 
 
 #removing or filling in missing data 
-#PROBLEM_2A => need to make dynamic => the total missing values and list of features with missing values should be updated after each change
+#the profile is refreshed after each change, so only features that still have missing values are listed
                 
 with tab2:
-    df = st.session_state['main_df']
-    total_missing = get_total_missing_values(df)
-    num_missing_by_feature = get_missing_values_by_feature(df)
+    num_missing_by_feature = profile['columns']['missing']
+    num_missing_by_feature = num_missing_by_feature[num_missing_by_feature > 0]
+    total_missing = num_missing_by_feature.sum()
 
     st.subheader("Handle Missing Data")
     if total_missing > 0:
         st.write(f"There are {total_missing} missing values in your dataset")
-        feature = st.selectbox("Select a feature to fill in missing values", num_missing_by_feature.index, key="fill_feature")
-        method = st.selectbox("Select a method to fill in missing values", ["Fill with mean", "Fill with median", "Fill with mode", "Fill with custom value"], key="fill_method")
-        if method == "Fill with custom value":
-            value = st.text_input("Fill in missing values with:", key="fill_value")
-        if st.button("Apply Changes to Missing Data", on_click=handle_missing_data):
-            pass  # Button to trigger the callback
+        numeric_features = get_numerical_features(df)
+        default_col1, default_col2 = st.columns(2)
+        with default_col1:
+            numeric_default = st.selectbox("Start numeric features with", [LEAVE_AS_IS] + FILL_METHODS[:3], key="fill_numeric_default")
+        with default_col2:
+            text_default = st.selectbox("Start other features with", [LEAVE_AS_IS, "Fill with mode"], key="fill_other_default")
+        # one row per feature with missing values, every filled feature is handled by the same step
+        fill_table = pd.DataFrame({
+            'missing': num_missing_by_feature.astype("int64"),
+            'method': [numeric_default if feature in numeric_features else text_default for feature in num_missing_by_feature.index],
+            'group by': None,
+            'value': "",
+        }, index=pd.Index(num_missing_by_feature.index, name="feature"))
+        with st.form("missing_data_form"):
+            fill_table = st.data_editor(fill_table, disabled=["feature", "missing"], column_config={
+                'method': st.column_config.SelectboxColumn("method", options=[LEAVE_AS_IS] + FILL_METHODS, required=True),
+                'group by': st.column_config.SelectboxColumn("group by", options=list(df.columns),
+                                                             help="Fill with the mean or median of the rows sharing this column's value"),
+                'value': st.column_config.TextColumn("value", help="Used by Fill with custom value"),
+            })
+            if st.form_submit_button("Apply Changes to Missing Data", disabled=jobs_running):
+                steps, errors = handle_missing_data(fill_table, df)
+                for error in errors:
+                    st.error(error)
+                if steps and not errors:
+                    rerun()  # show the updated data, or the progress of the step
     else:
         st.success("Congratulations! There are no more missing values in your dataset!")
 
 with tab3:
-    df = st.session_state.main_df
+    # scores are cached per dataset version, so changing the threshold is only a comparison
     
     with st.form("outliers_data_form"):
         st.subheader("Handle Outliers")
         col1, col2 = st.columns([1, 1])
         with col1:
+            method = st.radio("Select a method to detect outliers", ["Z-score", "IQR"], key="outlier_method", horizontal=True)
+            method_key = OUTLIER_METHODS[method]
             # Ensure that both `value` and `step` are of the same type (float in this case)
-            threshold = st.number_input("Enter the threshold for outliers", value=3, step=1, key="outlier_threshold", help="The threshold for outliers is usually 1.5 times the interquartile range (IQR).")
+            threshold = st.number_input("Enter the threshold for outliers", value=3.0, step=0.5, key="outlier_threshold", help="For the Z-score method the threshold is the number of standard deviations from the mean, usually 3. For the IQR method it is the number of interquartile ranges outside the quartiles, usually 1.5.")
+            outliers_by_feature = pd.Series(outlier_mask(scores, threshold, method_key).sum(axis=0), index=scores['columns'], name="outliers", dtype="int64")
             st.write("These are the features in your data set that have outliers:")
-            feature = st.selectbox("Select a feature to view the outliers", df.columns, key="outlier_feature")
+            st.dataframe(outliers_by_feature[outliers_by_feature > 0])
+            feature = st.selectbox("Select a feature to view the outliers", scores['columns'], key="outlier_feature")
             remove = st.checkbox("Remove outliers", key="remove_outliers")
-            if st.form_submit_button("Apply Changes"):
-                if remove:
-                    df = remove_outliers(df, feature, threshold)  # Assuming this function modifies df directly
-                    st.session_state.main_df = df  # Update session state
-                    st.success("Data table updated")
+            if st.form_submit_button("Apply Changes", disabled=jobs_running):
+                if remove and feature is not None:
+                    run_step({'op': 'remove_outliers', 'columns': [feature], 'method': method_key, 'threshold': threshold})
+                    rerun()  # show the updated data, or the progress of the step
         with col2:
             st.write("Outliers are extreme values that deviate from other observations in the data set...")
+            if feature is not None:
+                st.dataframe(get_outliers_table(df, feature, threshold, method_key, scores))
 
 
             
 with tab4:
-    df = st.session_state.main_df
-    
     with st.form("ft_eng_data_form"):
         st.subheader("Feature Engineering")
         st.write("feature engineering logic here")
         submitted = st.form_submit_button("Apply Changes")
         if submitted:
-            st.session_state.main_df = df  # Update session state
-            st.success("data table updated")
+            st.info("There are no feature engineering steps yet, the data was not changed")
             
             
 with tab5:
-    df = st.session_state.main_df
-
+    # encoders are fitted when the step runs, and replayed with the same categories on new data
+    categorical_features = get_categorical_features(df)
+    st.subheader("Encoding")
+    # the features and category limit are outside the form, so the memory estimate follows them before the step runs
+    encode_columns = st.multiselect("Select the features to encode", categorical_features, key="encode_columns")
+    max_categories = st.number_input("Most frequent categories given their own column (one-hot)", min_value=1,
+                                     value=ONEHOT_MAX_CATEGORIES, step=10, key="encode_max_categories",
+                                     help="The other categories share one 'other' column, so high-cardinality features do not add thousands of columns")
+    if encode_columns:
+        st.dataframe(onehot_nbytes(df, encode_columns, max_categories), hide_index=True)
+        st.caption("Memory of a one-hot encoding of the selected features, stored as 0/1 columns or as the sparse matrix linear models are trained on")
     with st.form("encode_data_form"):
-        st.subheader("Encoding")
-        st.write("encoding logic here")
-        submitted = st.form_submit_button("Apply Changes")
-        if submitted:
-            st.session_state.main_df = df  # Update session state
-            st.success("data table updated")
-            
-            
+        encode_method = st.radio("Select an encoding", list(ENCODING_METHODS), key="encode_method", horizontal=True,
+                                 help="One-hot adds a 0/1 column per category, ordinal replaces each category by a number, frequency by its share of the rows and target by the mean of a target feature for its rows")
+        encode_target = st.selectbox("Target feature (target encoding)", get_numerical_features(df), key="encode_target")
+        if st.form_submit_button("Apply Changes", disabled=jobs_running):
+            method = ENCODING_METHODS[encode_method]
+            if not encode_columns:
+                st.error("Select at least one feature to encode")
+            elif method == 'target' and encode_target is None:
+                st.error("Target encoding needs a numerical target feature")
+            else:
+                step = {'op': 'encode', 'method': method, 'columns': encode_columns}
+                if method == 'onehot':
+                    step['max_categories'] = int(max_categories)
+                if method == 'target':
+                    step['target'] = encode_target
+                run_step(step)
+                rerun()  # show the updated data, or the progress of the step
+
+
 with tab6:
-    df = st.session_state.main_df
-    
+    # scaled features are stored as float32, the fitted centers and scales are kept with the step
     with st.form("scale_data_form"):
         st.subheader("Scaling")
-        st.write("scaling logic here")
-        submitted = st.form_submit_button("Apply Changes")
-        if submitted:
-            st.session_state.main_df = df  # Update session state
-            st.success("data table updated")
-            
-            
-with tab7:
-    df = st.session_state.main_df
-    
-    with st.form("dim_reduc_data_form"):
-        st.subheader("Dimensionality Reduction")
-        st.write("suggest removal of features with one to one correlation")
-        st.write("suggest combining one hot encoded columns")
-        st.write("Offer option of PCA")
-        submitted = st.form_submit_button("Apply Changes")
-        if submitted:
-            st.session_state.main_df = df  # Update session state
-            st.success("data table updated")
+        scale_columns = st.multiselect("Select the features to scale", get_numerical_features(df), key="scale_columns")
+        scale_method = st.radio("Select a scaler", list(SCALING_METHODS), key="scale_method", horizontal=True,
+                                help="Standard scales to mean 0 and standard deviation 1, min-max to the range 0 to 1 and robust to median 0 and interquartile range 1, which outliers barely affect")
+        if st.form_submit_button("Apply Changes", disabled=jobs_running):
+            if scale_columns:
+                run_step({'op': 'scale', 'method': SCALING_METHODS[scale_method], 'columns': scale_columns})
+                rerun()  # show the updated data, or the progress of the step
+            else:
+                st.error("Select at least one feature to scale")
 
-df = st.session_state.main_df
 
+with tab7:
+    # screenings and PCA fits of df are cached per dataset version, and per plan when df is the preview sample
+    numeric_features = get_numerical_features(df)
+    st.subheader("Dimensionality Reduction")
+    with st.form("correlation_form"):
+        st.write("Near-duplicate features")
+        corr_threshold = st.slider("Smallest correlation of a near-duplicate", min_value=0.8, max_value=1.0,
+                                   value=CORR_THRESHOLD, step=0.01, key="corr_threshold",
+                                   help="Every pair is screened on a sample of rows, only likely pairs are checked on all rows")
+        if st.form_submit_button("Find correlated features"):
+            st.session_state['corr_screened'] = True
+    if st.session_state.get('corr_screened') and numeric_features:
+        pairs = get_cached_result("correlated_features", (source, tuple(numeric_features), corr_threshold),
+                                  lambda: find_correlated_features(df, numeric_features, corr_threshold), max_entries=4)
+        if pairs.empty:
+            st.info(f"No pair of numerical features is correlated at {corr_threshold} or more")
+        else:
+            st.dataframe(pairs, hide_index=True)
+            drops = suggest_drops(pairs)
+            st.button(f"Drop {', '.join(map(str, drops))}", key="drop_correlated", disabled=jobs_running,
+                      on_click=run_step, args=({'op': 'drop_columns', 'columns': drops},),
+                      help="Keeps the first feature of every group of near-duplicates")
+
+    with st.form("pca_form"):
+        st.write("Principal component analysis")
+        pca_columns = st.multiselect("Features to reduce (all numerical features if empty)", numeric_features, key="pca_columns")
+        n_components = st.number_input("Number of components", min_value=1, max_value=max(1, len(numeric_features)),
+                                       value=min(10, max(1, len(numeric_features))), key="pca_components")
+        fit_col, replace_col = st.columns(2)
+        with fit_col:
+            if st.form_submit_button("Compute explained variance"):
+                st.session_state['pca_fitted'] = True
+        with replace_col:
+            replace = st.form_submit_button("Replace the features by the components", disabled=jobs_running)
+    pca_columns = pca_columns or numeric_features
+    if replace and pca_columns:
+        # fitted when the step runs, and replayed with the same components on new data
+        run_step({'op': 'reduce', 'method': 'pca', 'columns': pca_columns, 'n_components': int(n_components)})
+        rerun()  # show the updated data, or the progress of the step
+    if st.session_state.get('pca_fitted') and pca_columns:
+        pca = get_cached_result("pca", (source, tuple(pca_columns), int(n_components)),
+                                lambda: fit_pca(df, pca_columns, int(n_components)), max_entries=4)
+        variance = pd.DataFrame({'component': [f"PC{number}" for number in range(1, len(pca['explained_variance']) + 1)],
+                                 'explained variance': pca['explained_variance_ratio']})
+        variance['cumulative'] = variance['explained variance'].cumsum()
+        st.bar_chart(variance, x='component', y='explained variance')
+        st.caption(f"{len(variance)} components explain {variance['cumulative'].iloc[-1]:.1%} of the variance of "
+                   f"{len(pca_columns)} standardized features")
+
+# show the current data, the plan preview or an earlier step
+if lazy_mode:
+    st.caption(f"Showing the plan on a sample of up to {PREVIEW_ROWS} rows. Apply the plan to change the full data.")
+    pending_plan = st.session_state['pending_plan']
+    show_data_grid(get_plan_preview(pending_plan), key="data_grid", source=("plan", repr(pending_plan)))
+elif view_step == history_position:
+    show_data_grid(get_dataframe(), key="data_grid")
+else:
+    st.caption(f"Showing the data after step {view_step}. Undo or redo to make it the current data.")
+    show_data_grid(get_dataframe_at_step(view_step), key="data_grid", source=("step", view_step))
 
-# allow download of modified data as csv  
-csv = convert_df(df)
-st.dataframe(df)
-
+# allow download of modified data, the file is only written when a download is requested
 col1, col2 = st.columns([20, 4])
 
 with col1:
+    export_format = st.selectbox("Download format", list(EXPORT_FORMATS), key="export_format",
+                                 help="Parquet, Feather and gzip-compressed CSV files are much smaller than plain CSV")
+    st.download_button(
+    label=f"Download data as {export_format}",
+    data=get_export(export_format),
+    file_name=f"processed_data.{EXPORT_FORMATS[export_format]['extension']}",
+    mime=EXPORT_FORMATS[export_format]['mime'],
+    on_click="ignore",
+)
+    # the notebook replays the same plan that produced the current data
+    applied_plan = get_applied_plan()
+    actions = plan_to_code(applied_plan)
+    notebook_file = os.path.join(get_store_dir(), "actions.ipynb")
+    def export_notebook():
+        with open(convert_actions_to_pnyb(actions, notebook_file), "rb") as notebook:
+            return notebook.read()
+    st.download_button(
+    label="Download steps as notebook",
+    data=export_notebook,
+    file_name='preprocessing_steps.ipynb',
+    mime='application/x-ipynb+json',
+    on_click="ignore",
+)
+    # the same plan as JSON, for running it over many files with python -m modules.batch_functions
+    # (the plan is read here, the deferred download runs without the session state)
     st.download_button(
-    label="Download data as CSV",
-    data=csv,
-    file_name='processed_data.csv',
-    mime='text/csv',
+    label="Download steps as pipeline",
+    data=lambda: plan_to_json(applied_plan),
+    file_name='pipeline.json',
+    mime='application/json',
+    on_click="ignore",
 )
 with col2:    
     finish_button = st.button("NEXT VISUALIZATION", key="finish_button", help="Move to Visualization")
     if finish_button: 
-        if 'main_df' not in st.session_state:
-            st.session_state.main_df = uploaded_df.copy()  # Initialize session state
-            st.dataframe(st.session_state.main_df)
         switch_page("STEP2-Visualization")
 
+# where this rerun spent its time, also written to the timing log and metrics file
+show_timing_panel(finish_rerun())
+
 
 
 
@@ -1,12 +1,14 @@
 import streamlit as st
 import pandas as pd
-import seaborn as sns
-import time
-import matplotlib.pyplot as plt 
-from modules.shared_functions import *
+from modules.shared_functions import switch_page
 from modules.preproc_functions import *
+from modules.store_functions import get_dataframe, has_dataframe, get_cached_result, get_session_id
+from modules.timing_functions import timer, start_rerun, finish_rerun, show_timing_panel
+from modules.viz_functions import (line_chart_data, scatter_chart_data, bar_chart_data, BAR_AGGREGATIONS,
+                                   histogram_bins, render_histogram)
 
 st.set_page_config(page_title="Visualize Your Data", page_icon="📊", layout="wide")
+start_rerun("Visualization", get_session_id())
 
 st.header("Visualize")
 st.write("**Note:** larger datasets may yeild long loading times")
@@ -14,16 +16,14 @@ st.write("**Note:** larger datasets may yeild long loading times")
 st.sidebar.header("Visualize")
 st.sidebar.write("Visualizations allow the human eye to process patterns and trends with greater ease and efficiency than tabular data. This step is essential to gather key insights into your data.")
 
-if 'main_df' not in st.session_state:
-    df = pd.DataFrame()
-    st.session_state.main_df = df
+if not has_dataframe():
     #st.image(confused.png, caption="You haven't uploaded any data yet!")
     st.error("you havent uploaded any data yet!") 
     button = st.button("UPLOAD DATA NOW")
     if button:
         switch_page("UPLOAD") #this is not moving to upload page???
 
-df = st.session_state["main_df"]
+df = get_dataframe()
 
 
 tab1, tab2, tab3, tab4 = st.tabs(["Scatter Plot", "Histogram", "Bar Chart", "Line Chart"])
@@ -48,15 +48,14 @@ with tab1:
         if not x_col or not y_col:
             st.warning("Please select both X and Y columns to plot.")
         elif not df.empty and x_col in df.columns and y_col in df.columns:
-            # Create the scatter plot 
-            if hue_col:
-                with st.spinner("Creating your scatter plot:"):
-                    time.sleep(2)
-                    st.scatter_chart(data=df, x=x_col, y=y_col, color=hue_col)
-            else:
-                with st.spinner("Creating your scatter plot:"):
-                    time.sleep(2)
-                    st.scatter_chart(data=df, x=x_col, y=y_col)
+            # Create the scatter plot from binned points, cached for this version of the data
+            with st.spinner("Creating your scatter plot:"):
+                chart_df, size_col = get_cached_result("chart_data", ("scatter", x_col, y_col, hue_col),
+                                                       lambda: scatter_chart_data(df, x_col, y_col, hue_col))
+                if size_col:
+                    st.caption(f"{len(df)} rows are shown as {len(chart_df)} binned points, sized by the number of rows in each bin.")
+                with timer("draw scatter chart", rows=len(chart_df)):
+                    st.scatter_chart(data=chart_df, x=x_col, y=y_col, color=hue_col, size=size_col)
         else:
             st.error("No data found or selected columns are invalid. Please check your data.")
             
@@ -67,8 +66,7 @@ with tab2:
     hist_1, hist_2, hist_3 = st.columns(3)
     
     # We also want to select bin between 2 and 20
-    bin_input = st.text_input("Enter the number of bins:", 3)
-    int_bins = int(bin_input)
+    int_bins = st.number_input("Enter the number of bins:", min_value=2, max_value=20, value=3, step=1)
     
     with hist_1:
         x_col = st.selectbox("Select X-axias column:", df.columns)
@@ -84,17 +82,13 @@ with tab2:
         if not x_col or not y_col:
             st.warning("Please select both X and Y columns to plot.")
         elif not df.empty and x_col in df.columns and y_col in df.columns:
-            # Now create the plot
-            fig, ax =  plt.subplots(figsize=(18, 12))
-            if hue_col_hist:
-                with st.spinner("Creating your histogram:"):
-                    time.sleep(2)
-                    sns.histplot(x=x_col, y=y_col, hue=hue_col_hist, data=df, ax=ax, bins=int_bins)
-            else:
-                with st.spinner("Creating your histogram:"):
-                    time.sleep(2)
-                    sns.histplot(x=x_col, y=y_col, data=df, ax=ax, bins=int_bins)
-            st.pyplot(fig)
+            # Now create the plot: the bin counts and the rendered image are both cached for this version of the data
+            with st.spinner("Creating your histogram:"):
+                params = (x_col, y_col, hue_col_hist, int(int_bins))
+                hist = get_cached_result("histogram_bins", params, lambda: histogram_bins(df, x_col, y_col, hue_col_hist, int(int_bins)))
+                png = get_cached_result("histogram_png", params, lambda: render_histogram(hist, x_col, y_col, hue_col_hist), max_entries=8)
+            with timer("draw histogram"):
+                st.image(png)
             
         else:
             st.error("No data found or selected columns are invalid. Please check your data.")
@@ -113,6 +107,7 @@ with tab3:
 
     # Color (Hue) Selection
     hue_col_bar = st.selectbox("Hue col:", df.columns.insert(0, None))
+    bar_aggregation = st.selectbox("Aggregate Y values by:", list(BAR_AGGREGATIONS))
 
     # Plot Button
     if st.button("Create Bar Chart"):
@@ -120,15 +115,12 @@ with tab3:
         if not cat_col or not num_col:
             st.warning("Please select both a categorical and numerical column.")
         elif not df.empty and cat_col in df.columns and num_col in df.columns:
-            # Create the bar chart
-            if hue_col_bar:
-                with st.spinner("Building your bar chart:"):
-                    time.sleep(2)
-                    st.bar_chart(x=cat_col, y=num_col, color=hue_col_bar, data=df)
-            else:
-                with st.spinner("Building your bar chart:"):
-                    time.sleep(2)
-                    st.bar_chart(x=cat_col, y=num_col, data=df)
+            # Create the bar chart from one pre-aggregated row per bar
+            with st.spinner("Building your bar chart:"):
+                chart_df = get_cached_result("chart_data", ("bar", cat_col, num_col, hue_col_bar, bar_aggregation),
+                                             lambda: bar_chart_data(df, cat_col, num_col, hue_col_bar, bar_aggregation))
+                with timer("draw bar chart", rows=len(chart_df)):
+                    st.bar_chart(x=cat_col, y=chart_df.columns[-1], color=hue_col_bar, data=chart_df)
         else:
             st.error("No data found or selected columns are invalid. Please check your data.") 
 
@@ -152,18 +144,14 @@ with tab4:
         if not line_x or not line_y:
             st.warning("Please select both X and Y columns to plot.")
         elif not df.empty and line_x in df.columns and line_y in df.columns:
-            # Create the line chart
-            if group_col:
-                with st.spinner("Creating your line graph:"):
-                    time.sleep(2)
-                    st.line_chart(x=line_x, y=line_y, color=group_col, data=df)
-            else:
-                with st.spinner("Creating your line graph:"):
-                    time.sleep(2)
-                    st.line_chart(x=line_x, y=line_y, data=df)
+            # Create the line chart from a downsampled copy of each line
+            with st.spinner("Creating your line graph:"):
+                chart_df = get_cached_result("chart_data", ("line", line_x, line_y, group_col),
+                                             lambda: line_chart_data(df, line_x, line_y, group_col))
+                with timer("draw line chart", rows=len(chart_df)):
+                    st.line_chart(x=line_x, y=line_y, color=group_col, data=chart_df)
         else:
-            st.error("No data found or selected columns are invalid. Please check your data.") 
-    
-    
-    
+            st.error("No data found or selected columns are invalid. Please check your data.")
 
+# where this rerun spent its time, also written to the timing log and metrics file
+show_timing_panel(finish_rerun())
@@ -1,8 +1,99 @@
+import pickle
 import streamlit as st
 import pandas as pd
 from modules.shared_functions import switch_page
+from modules.preproc_functions import get_numerical_features, get_categorical_features
+from modules.store_functions import (get_dataframe, has_dataframe, get_session_id, submit_training, get_running_training,
+                                     collect_finished_training, get_training_scores, get_trained_model)
+from modules.training_functions import (MODELS, METRICS, CV_FOLDS, TRAINING_WORKERS, infer_task, model_candidates,
+                                        describe_candidate)
+from modules.timing_functions import start_rerun, finish_rerun, show_timing_panel, rerun, stop
 
 st.set_page_config(page_title="Use Your Data For ML", page_icon="📈", layout="wide")
+start_rerun("Machine Learning", get_session_id())
+
+st.header("Machine Learning")
 
 st.sidebar.header("Machine Learning")
-st.sidebar.write("On this page, you can use your data to train a machine learning model. You can also use the model to make predictions on new data.")
\ No newline at end of file
+st.sidebar.write("On this page, you can use your data to train a machine learning model. You can also use the model to make predictions on new data.")
+
+if not has_dataframe():
+    st.error("You haven't uploaded any data yet!")
+    button = st.button("UPLOAD DATA NOW")
+    if button:
+        switch_page("UPLOAD")
+    stop()
+
+# training runs as a background job, its scores and model are cached on the first run after it finishes
+for job in collect_finished_training():
+    if job.status == "done":
+        st.success(f"{job.description}: done")
+    elif job.status == "failed":
+        st.error(f"{job.description} failed: {job.error}")
+    elif job.status == "cancelled":
+        st.info(f"{job.description}: cancelled")
+    else:
+        st.warning(f"{job.description} was discarded because the data changed while it was running")
+
+@st.fragment(run_every=0.5)
+def show_running_training():
+    running = get_running_training()
+    if not running:
+        rerun()  # rerun the whole page so the result is cached and shown
+    for job in running:
+        st.progress(job.progress, text=f"{job.description}...")
+    def cancel_training():
+        for job in get_running_training():
+            job.cancel()
+    st.button("Cancel", on_click=cancel_training)
+
+training_running = bool(get_running_training())
+if training_running:
+    show_running_training()
+
+df = get_dataframe()
+usable = get_numerical_features(df) + get_categorical_features(df)
+
+#-----------------------------------------------------------------------
+
+target = st.selectbox("Target feature to predict", usable, key="ml_target")
+if target is None:
+    st.info("The data has no numerical or categorical feature to predict")
+    stop()
+task = infer_task(df[target])
+st.caption(f"Predicting {target} is a {task} task, models are compared by their cross-validated {METRICS[task]}")
+
+with st.form("train_form"):
+    features = st.multiselect("Features (all other features if empty)", [col for col in usable if col != target],
+                              key="ml_features")
+    model = st.selectbox("Model", [name for name, spec in MODELS.items() if spec['task'] == task], key="ml_model",
+                         help="Out-of-core models learn from one chunk of rows at a time, so they train on data larger than memory")
+    n_folds = st.number_input("Cross-validation folds", min_value=2, max_value=10, value=CV_FOLDS, key="ml_folds")
+    tune = st.checkbox("Try every hyperparameter candidate", key="ml_tune",
+                       help=f"Every candidate and fold is fitted in parallel on {TRAINING_WORKERS} processes")
+    submitted = st.form_submit_button("Train", disabled=training_running)
+
+features = features or [col for col in usable if col != target]
+candidates = model_candidates(model, tune)
+if submitted:
+    submit_training(features, target, candidates, int(n_folds))
+    rerun()  # show the progress of the training
+
+# scores of every candidate tried on this version of the data, cached per candidate
+scores = get_training_scores(features, target, candidates, int(n_folds))
+if scores:
+    table = pd.DataFrame([{'model': describe_candidate(candidate), METRICS[task]: score['score'], 'std': score['std'],
+                           'fit seconds': score['fit seconds']} for candidate, score in scores.items()])
+    st.dataframe(table.sort_values(METRICS[task], ascending=False), hide_index=True)
+    best = max(scores, key=lambda candidate: scores[candidate]['score'])
+    trained = get_trained_model(features, target, int(n_folds), best)
+    if trained is not None:
+        st.success(f"Best model: {describe_candidate(best)}, {METRICS[task]} {scores[best]['score']:.3f}, "
+                   f"fitted on all {trained['meta']['rows']:,} rows with a target")
+        # pickled only when the button is clicked, not on every rerun (trained is bound now, the callable runs outside the rerun)
+        st.download_button("Download model", data=lambda trained=trained: pickle.dumps(trained), file_name="model.pkl",
+                           mime="application/octet-stream", on_click="ignore",
+                           help="A pickle of the fitted estimator and how its features are encoded (see prepare_features, with the pickle's 'sparse')")
+
+# where this rerun spent its time, also written to the timing log and metrics file
+show_timing_panel(finish_rerun())
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.history_functions import make_delta, apply_delta, replay_deltas, delta_changes
+
+
+def make_df():
+    return pd.DataFrame({
+        'ints': pd.array([1, None, 3, 4, None], dtype="Int64"),
+        'flags': pd.array([True, None, False, True, False], dtype="boolean"),
+        'text': pd.array(["a", None, "c", "d", "e"], dtype="string[pyarrow]"),
+        'kind': pd.Categorical(["x", "y", None, "x", "y"]),
+        'floats': [1.0, np.nan, 3.0, 4.0, 5.0],
+    })
+
+
+def fill_cells(df):
+    new = df.copy()
+    new['ints'] = new['ints'].fillna(0)
+    new['flags'] = new['flags'].fillna(False)
+    new['text'] = new['text'].fillna("missing")
+    new['kind'] = new['kind'].fillna("x")
+    return new, ['ints', 'flags', 'text', 'kind']
+
+
+def change_dtypes(df):
+    new = df.copy()
+    new['floats'] = new['floats'].astype("Float64")
+    new['kind'] = new['kind'].cat.add_categories("z")
+    new['more_text'] = pd.array(["p", None, "q", "r", "s"], dtype="string[pyarrow]")
+    return new, ['floats', 'kind', 'more_text']
+
+
+def drop_rows_and_clear(df):
+    kept_rows = np.array([True, False, True, True, False])
+    new = df[kept_rows].copy()
+    new['text'] = pd.array([None, "c", "d"], dtype="string[pyarrow]")
+    new['ints'] = pd.array([None, None, 4], dtype="Int64")
+    return new, ['text', 'ints'], kept_rows
+
+
+@pytest.mark.parametrize('step', [fill_cells, change_dtypes])
+def test_column_patches_keep_extension_dtypes(step):
+    old = make_df()
+    new, changed_columns = step(old)
+    delta = make_delta(old, new, changed_columns)
+    pd.testing.assert_frame_equal(apply_delta(old, delta), new)
+
+
+def test_only_changed_cells_are_stored():
+    old = make_df()
+    new, changed_columns = fill_cells(old)
+    delta = make_delta(old, new, changed_columns)
+    assert {col: list(positions) for col, (positions, _) in delta['patches'].items()} == {
+        'ints': [1, 4], 'flags': [1], 'text': [1], 'kind': [2]}
+
+
+def test_rows_and_columns_round_trip():
+    old = make_df()
+    new, changed_columns, kept_rows = drop_rows_and_clear(old)
+    delta = make_delta(old, new, changed_columns, kept_rows)
+    columns, kept = delta_changes(delta)
+    assert sorted(columns) == ['ints', 'text']
+    np.testing.assert_array_equal(kept, kept_rows)
+    pd.testing.assert_frame_equal(apply_delta(old, delta), new)
+
+
+def test_undo_and_redo_replay_the_same_versions():
+    versions = [make_df()]
+    deltas = []
+    for step in (fill_cells, change_dtypes):
+        new, changed_columns = step(versions[-1])
+        deltas.append(make_delta(versions[-1], new, changed_columns))
+        versions.append(new)
+    new, changed_columns, kept_rows = drop_rows_and_clear(versions[-1])
+    deltas.append(make_delta(versions[-1], new, changed_columns, kept_rows))
+    versions.append(new)
+
+    # undo goes back by replaying fewer steps from the base, redo by replaying them again
+    for position in [3, 2, 1, 0, 1, 2, 3]:
+        pd.testing.assert_frame_equal(replay_deltas(versions[0], deltas[:position]), versions[position])
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.pipeline_functions import apply_plan, fuse_plan
+
+
+def make_df():
+    rng = np.random.default_rng(0)
+    n = 300
+    df = pd.DataFrame({
+        'key': rng.integers(0, 4, n).astype(float),
+        'x': rng.normal(size=n),
+        'y': rng.normal(size=n),
+        'label': rng.choice(['a', 'b', 'c'], n),
+    })
+    df.loc[::7, 'key'] = np.nan
+    df.loc[::5, 'x'] = np.nan
+    df.loc[::3, 'y'] = np.nan
+    df.loc[::11, 'label'] = None
+    df.loc[[4, 40], 'x'] = [25.0, -30.0]
+    return pd.concat([df, df.iloc[:20]], ignore_index=True)
+
+
+def replay_one_by_one(df, plan):
+    for step in plan:
+        df = apply_plan(df, [step])[0]
+    return df
+
+
+PLANS = {
+    'filters': [
+        {'op': 'drop_duplicates', 'subset': None},
+        {'op': 'drop_duplicates', 'subset': ['key', 'label']},
+        {'op': 'remove_outliers', 'columns': ['x'], 'method': 'zscore', 'threshold': 3.0},
+    ],
+    'fills': [
+        {'op': 'fill', 'column': 'x', 'method': "Fill with mean", 'value': None, 'by': 'key'},
+        {'op': 'fill', 'column': 'y', 'method': "Fill with median", 'value': None, 'by': None},
+        {'op': 'fill', 'column': 'label', 'method': "Fill with mode", 'value': None, 'by': None},
+    ],
+    'fill by a filled key': [
+        {'op': 'fill', 'column': 'key', 'method': "Fill with custom value", 'value': 0.0, 'by': None},
+        {'op': 'fill', 'column': 'x', 'method': "Fill with mean", 'value': None, 'by': 'key'},
+        {'op': 'fill', 'column': 'y', 'method': "Fill with median", 'value': None, 'by': 'key'},
+    ],
+    'mixed': [
+        {'op': 'drop_duplicates', 'subset': None},
+        {'op': 'fill', 'column': 'x', 'method': "Fill with median", 'value': None, 'by': None},
+        {'op': 'remove_outliers', 'columns': ['x', 'y'], 'method': 'iqr', 'threshold': 1.5},
+        {'op': 'drop_columns', 'columns': ['label']},
+        {'op': 'drop_columns', 'columns': ['y']},
+    ],
+}
+
+
+@pytest.mark.parametrize('name', PLANS)
+def test_fused_plan_matches_running_the_steps_one_by_one(name):
+    df = make_df()
+    fused, kept_rows, _, _ = apply_plan(df, PLANS[name])
+    expected = replay_one_by_one(df, PLANS[name])
+    pd.testing.assert_frame_equal(fused, expected)
+    if kept_rows is not None:
+        assert kept_rows.sum() == len(fused)
+
+
+def test_fill_keyed_on_a_column_filled_earlier_starts_a_new_group():
+    groups = fuse_plan(PLANS['fill by a filled key'])
+    assert [len(group) for group in groups] == [1, 2]
+
+
+def test_independent_fills_share_a_group():
+    assert [len(group) for group in fuse_plan(PLANS['fills'])] == [3]
+
+
+def test_duplicate_filter_on_a_narrower_subset_fuses_but_outlier_filter_does_not():
+    groups = fuse_plan(PLANS['filters'])
+    assert [len(group) for group in groups] == [2, 1]
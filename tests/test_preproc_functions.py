@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.preproc_functions import (build_row_index, filter_row_index, refresh_row_index, duplicate_mask,
+                                      compute_outlier_scores)
+from modules.pipeline_functions import apply_plan
+
+
+def make_df():
+    rng = np.random.default_rng(0)
+    n = 500
+    df = pd.DataFrame({
+        'a': rng.integers(0, 5, n),
+        'b': rng.choice(['x', 'y', None], n),
+        'c': rng.integers(0, 3, n).astype(float),
+        'd': pd.array(rng.integers(0, 2, n), dtype="Int64"),
+    })
+    df.loc[::9, 'c'] = np.nan
+    return df
+
+
+def assert_same_index(index, expected):
+    assert list(index['column_hashes']) == list(expected['column_hashes'])
+    for col, hashes in expected['column_hashes'].items():
+        np.testing.assert_array_equal(index['column_hashes'][col], hashes)
+
+
+def test_row_index_does_not_depend_on_row_labels_or_copies():
+    df = make_df()
+    relabelled = df.copy().set_axis(np.arange(len(df))[::-1] * 3)
+    assert_same_index(build_row_index(relabelled), build_row_index(df))
+
+
+@pytest.mark.parametrize('subset', [None, ['a'], ['a', 'b'], ['b', 'c', 'd']])
+def test_duplicate_mask_matches_pandas(subset):
+    df = make_df()
+    for keep in ('first', 'last'):
+        np.testing.assert_array_equal(duplicate_mask(build_row_index(df), subset, keep),
+                                      df.duplicated(subset=subset, keep=keep).to_numpy())
+
+
+def test_filtered_index_matches_a_rebuilt_one():
+    df = make_df()
+    index = build_row_index(df)
+    duplicate_mask(index, ['a', 'b'])  # cache a subset's row hashes, they have to be filtered too
+    keep = ~duplicate_mask(index)
+    filtered = filter_row_index(index, keep)
+    rebuilt = build_row_index(df[keep])
+    assert_same_index(filtered, rebuilt)
+    np.testing.assert_array_equal(duplicate_mask(filtered, ['a', 'b']), duplicate_mask(rebuilt, ['a', 'b']))
+
+
+def test_refreshed_index_matches_a_rebuilt_one():
+    df = make_df()
+    index = build_row_index(df)
+    duplicate_mask(index, ['a', 'b'])
+    duplicate_mask(index, ['a', 'd'])
+    new_df = df.drop(columns=['c']).assign(b=df['b'].fillna('x'), e=df['a'] * 2)
+    refreshed = refresh_row_index(index, new_df, ['b', 'c', 'e'])
+    # subsets that include a changed column are dropped, the others are kept
+    assert set(refreshed['row_hashes']) == {('a', 'd')}
+    assert_same_index(refreshed, build_row_index(new_df))
+    for subset in (None, ['a', 'b'], ['a', 'd']):
+        np.testing.assert_array_equal(duplicate_mask(refreshed, subset), new_df.duplicated(subset=subset).to_numpy())
+
+
+PLAN = [
+    {'op': 'drop_duplicates', 'subset': ['a', 'b']},
+    {'op': 'remove_outliers', 'columns': ['c'], 'method': 'iqr', 'threshold': 1.0},
+    {'op': 'fill', 'column': 'c', 'method': "Fill with median", 'value': None, 'by': 'a'},
+]
+
+
+def test_plan_run_with_the_cached_index_matches_a_plan_run_without_it():
+    df = make_df()
+    index = build_row_index(df)
+    with_cache = apply_plan(df, PLAN, row_index=index, outlier_scores=compute_outlier_scores(df))
+    without_cache = apply_plan(df, PLAN)
+    pd.testing.assert_frame_equal(with_cache[0], without_cache[0])
+    np.testing.assert_array_equal(with_cache[1], without_cache[1])
+
+
+def test_index_updated_after_a_plan_matches_a_rebuilt_one():
+    df = make_df()
+    index = build_row_index(df)
+    new_df, kept_rows, changed_columns, _ = apply_plan(df, PLAN, row_index=index)
+    # a finished job stores its rows and columns, the cached index is filtered and refreshed from them
+    updated = refresh_row_index(filter_row_index(index, kept_rows), new_df, changed_columns)
+    assert_same_index(updated, build_row_index(new_df))
+    np.testing.assert_array_equal(duplicate_mask(updated), new_df.duplicated().to_numpy())